@@ -26,6 +26,7 @@ setup(name='shakemap',
                 'shakemap.transfer'],
       package_data={'shakemap': [os.path.join('tests', 'data', '*'),
                                  os.path.join('utils', 'configspec.ini'),
-                                 os.path.join('grind', 'data', 'ps2ff', '*.csv')]},
+                                 os.path.join('grind', 'data', 'ps2ff', '*.csv'),
+                                 os.path.join('grind', 'data', 'ps2ff', '*.npz')]},
       scripts=['runscenarios', 'mkfault', 'mkinputdir', 'mkscenariogrids'],
       )
@@ -5,8 +5,10 @@ import openquake.hazardlib.geo as geo
 import copy
 
 from shakemap.grind.distance import get_distance
+from shakemap.grind.distance import _distance_sq_to_segment
 import shakemap.utils.ecef as ecef
 from shakemap.utils.vector import Vector
+from shakemap.utils.vector import VectorArray
 
 
 class Bayless2013(object):
@@ -105,6 +107,7 @@ class Bayless2013(object):
         self._lat = lat
         self._dep = depth
         self._T = T
+        self.__site_mat = None
 
         # Lists of widths and lengths for each quad in the fault
         self._W = self._flt.getIndividualWidths()
@@ -194,64 +197,51 @@ class Bayless2013(object):
         """
         hyp_ecef = Vector.fromPoint(geo.point.Point(
             self._hyp.longitude, self._hyp.latitude, self._hyp.depth))
-        # Loop over each quad
-        self.phyp = [None] * self._nq
-        for i in range(self._nq):
-            P0, P1, P2, P3 = self._flt.getQuadrilaterals()[i]
-            p0 = Vector.fromPoint(P0)  # convert to ECEF
-            p1 = Vector.fromPoint(P1)
-            p2 = Vector.fromPoint(P2)
-            p3 = Vector.fromPoint(P3)
-
-            # Create 4 planes with normals pointing outside rectangle
-            hpnp = Vector.cross(p1 - p0, p2 - p0).norm()
-            hpp = -hpnp.x * p0.x - hpnp.y * p0.y - hpnp.z * p0.z
-            n0 = Vector.cross(p1 - p0, hpnp)
-            n1 = Vector.cross(p2 - p1, hpnp)
-            n2 = Vector.cross(p3 - p2, hpnp)
-            n3 = Vector.cross(p0 - p3, hpnp)
-
-            # Is the hypocenter inside the projected rectangle?
-            # Dot products show which side the origin is on.
-            # If origin is on same side of all the planes, then it is 'inside'
-
-            sgn0 = np.signbit(Vector.dot(n0, p0 - hyp_ecef))
-            sgn1 = np.signbit(Vector.dot(n1, p1 - hyp_ecef))
-            sgn2 = np.signbit(Vector.dot(n2, p2 - hyp_ecef))
-            sgn3 = np.signbit(Vector.dot(n3, p3 - hyp_ecef))
-
-            if (sgn0 == sgn1) and (sgn1 == sgn2) and (sgn2 == sgn3):
-                # Origin is inside. Use distance-to-plane formula.
-                d = Vector.dot(hpnp, hyp_ecef) + hpp
-                d = d * d
-
-                # Put the pseudo hypocenter on the plane
-                D = Vector.dot(hpnp, hyp_ecef) + hpp
-                self.phyp[i] = hyp_ecef - hpnp * D
+        hyp = VectorArray(hyp_ecef.getArray())
+
+        # ECEF vertices of all quads
+        quads = self._flt.getQuadrilaterals()
+        p0, p1, p2, p3 = [VectorArray.fromPoints([q[k] for q in quads])
+                          for k in range(4)]
+
+        # Create 4 planes with normals pointing outside rectangle
+        hpnp = (p1 - p0).cross(p2 - p0).norm()
+        hpp = -hpnp.dot(p0)
+        n0 = (p1 - p0).cross(hpnp)
+        n1 = (p2 - p1).cross(hpnp)
+        n2 = (p3 - p2).cross(hpnp)
+        n3 = (p0 - p3).cross(hpnp)
+
+        # Is the hypocenter inside the projected rectangle?
+        # Dot products show which side the origin is on.
+        # If origin is on same side of all the planes, then it is 'inside'
+        sgn0 = np.signbit(n0.dot(p0 - hyp))
+        sgn1 = np.signbit(n1.dot(p1 - hyp))
+        sgn2 = np.signbit(n2.dot(p2 - hyp))
+        sgn3 = np.signbit(n3.dot(p3 - hyp))
+        inside = (sgn0 == sgn1) & (sgn1 == sgn2) & (sgn2 == sgn3)
+
+        # Origin is inside: put the pseudo hypocenter on the plane, using the
+        # distance-to-plane formula.
+        D = hpnp.dot(hyp) + hpp
+        on_plane = (hyp - hpnp * D).getArray()
+
+        # Origin is outside: find distance to edges. Assuming that the fault
+        # is segmented along strike and not updip (as described by Bayless
+        # and somerville), we only need to consider the side edges, and the
+        # pseudo hypocenter is half way down the closer one.
+        s1 = _distance_sq_to_segment((p1 - hyp).getArray(),
+                                     (p2 - hyp).getArray())
+        s3 = _distance_sq_to_segment((p3 - hyp).getArray(),
+                                     (p0 - hyp).getArray())
+        e30 = p0 - p3
+        mid30 = (p3 + e30.norm() * (0.5 * e30.mag())).getArray()
+        e21 = p1 - p2
+        mid21 = (p2 + e21.norm() * (0.5 * e21.mag())).getArray()
+        on_edge = np.where((s1 > s3)[:, np.newaxis], mid30, mid21)
 
-            else:
-                # Origin is outside. Find distance to edges
-                p0p = np.reshape(p0.getArray() - hyp_ecef.getArray(), [1, 3])
-                p1p = np.reshape(p1.getArray() - hyp_ecef.getArray(), [1, 3])
-                p2p = np.reshape(p2.getArray() - hyp_ecef.getArray(), [1, 3])
-                p3p = np.reshape(p3.getArray() - hyp_ecef.getArray(), [1, 3])
-                s1 = dist2_to_segment(p1p, p2p)
-                s2 = dist2_to_segment(p2p, p3p)
-                s3 = dist2_to_segment(p3p, p0p)
-
-                # Assuming that the fault is segmented along strike and not
-                # updip (as described by Bayless and somerville), we only
-                # need to consider s1 and s3:
-                if s1 > s3:
-                    e30 = p0 - p3
-                    e30norm = e30.norm()
-                    mag = e30.mag()
-                    self.phyp[i] = p3 + e30norm * (0.5 * mag)
-                else:
-                    e21 = p1 - p2
-                    e21norm = e21.norm()
-                    mag = e21.mag()
-                    self.phyp[i] = p2 + e21norm * (0.5 * mag)
+        phyp = np.where(inside[:, np.newaxis], on_plane, on_edge)
+        self.phyp = VectorArray(phyp).toVectors()
 
     def __computeDS(self):
         # d is the length of dipping fault rupturing toward site;
@@ -329,6 +319,20 @@ class Bayless2013(object):
         Az[ix] = np.arctan(self.__Rx[ix] / self.__Ry[ix])
         self.Az = Az
 
+    def __getSiteMatrix(self):
+        """
+        :returns:
+            3x(number of sites) matrix of site locations (rows are x, y, z) in
+            ECEF; it is the same for all quads so it is only computed once.
+        """
+        if self.__site_mat is None:
+            site_ecef_x, site_ecef_y, site_ecef_z = ecef.latlon2ecef_mesh(
+                self._lat, self._lon, 0.0)
+            self.__site_mat = np.array([np.reshape(site_ecef_x, (-1,)),
+                                        np.reshape(site_ecef_y, (-1,)),
+                                        np.reshape(site_ecef_z, (-1,))])
+        return self.__site_mat
+
     def __computeD(self, i):
         """Compute d for the i-th quad/segment.
 
@@ -354,21 +358,7 @@ class Bayless2013(object):
             [[e21norm.x], [e21norm.y], [e21norm.z]])  # ECEF coords
 
         # Sites
-        slat = self._lat
-        slon = self._lon
-
-        # Convert sites to ECEF:
-        site_ecef_x = np.ones_like(slat)
-        site_ecef_y = np.ones_like(slat)
-        site_ecef_z = np.ones_like(slat)
-
-        # Make a 3x(#number of sites) matrix of site locations
-        # (rows are x, y, z) in ECEF
-        site_ecef_x, site_ecef_y, site_ecef_z = ecef.latlon2ecef(
-            slat, slon, np.zeros(slon.shape))
-        site_mat = np.array([np.reshape(site_ecef_x, (-1,)),
-                             np.reshape(site_ecef_y, (-1,)),
-                             np.reshape(site_ecef_z, (-1,))])
+        site_mat = self.__getSiteMatrix()
 
         # Hypocenter-to-site matrix
         h2s_mat = site_mat - hyp_col  # in ECEF
@@ -403,21 +393,7 @@ class Bayless2013(object):
             [[e01norm.x], [e01norm.y], [e01norm.z]])  # ECEF coords
 
         # Sites
-        slat = self._lat
-        slon = self._lon
-
-        # Convert sites to ECEF:
-        site_ecef_x = np.ones_like(slat)
-        site_ecef_y = np.ones_like(slat)
-        site_ecef_z = np.ones_like(slat)
-
-        # Make a 3x(#number of sites) matrix of site locations
-        # (rows are x, y, z) in ECEF
-        site_ecef_x, site_ecef_y, site_ecef_z = ecef.latlon2ecef(
-            slat, slon, np.zeros(slon.shape))
-        site_mat = np.array([np.reshape(site_ecef_x, (-1,)),
-                             np.reshape(site_ecef_y, (-1,)),
-                             np.reshape(site_ecef_z, (-1,))])
+        site_mat = self.__getSiteMatrix()
 
         # Epicenter-to-site matrix
         e2s_mat = site_mat - epi_col  # in ECEF
@@ -1,18 +1,32 @@
 #!/usr/bin/env python
 
 
-import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 import copy
 
+import numpy as np
+
 import openquake.hazardlib.geo as geo
 from openquake.hazardlib.geo.utils import get_orthographic_projection
 
 import shakemap.grind.fault as fault
 from shakemap.grind.distance import _calc_rupture_distance
 from shakemap.grind.distance import get_distance
+from shakemap.grind.distance import TILES_PER_WORKER
 from shakemap.utils.ecef import latlon2ecef
+from shakemap.utils.ecef import latlon2ecef_mesh
 from shakemap.utils.ecef import ecef2latlon
 from shakemap.utils.vector import Vector
+from shakemap.utils.parallel import SharedArray
+from shakemap.utils.parallel import check_parallel
+from shakemap.utils.parallel import get_tiles
+
+# Maximum number of site/subfault pairs that are evaluated together when
+# computing xi'; this bounds the size of the temporary arrays.
+SITE_SUBFAULT_BLOCK = 2**16
+
+# State of a xi' worker process (see _init_xi_prime_worker)
+_WORKER = {}
 
 
 class Rowshandel2013(object):
@@ -53,9 +67,14 @@ class Rowshandel2013(object):
     - IM is the intensity measure predicted by the GMPE.
     - IM_dir is the directivity-adjusted IM.
 
+    The coefficients C1 and C2 are interpolated linearly in log period
+    between the periods of the model (1 to 10 s); the coefficients of the
+    end periods are used outside of that range. WP and DT are computed for
+    all periods at once, so additional periods cost little once xi' is
+    computed.
+
     To do
         - Add checks on function arguments (e.g., mtype) for valid values.
-        - Interpolate periods. 
 
     References: 
         Rowshandel, B. (2013). Rowshandel’s NGA-West2 directivity model, 
@@ -64,12 +83,14 @@ class Rowshandel2013(object):
         `[link] <http://peer.berkeley.edu/publications/peer_reports/reports_2013/webPEER-2013-09-Spudich.pdf>`__
     """
 
-    __c1 = [0.35, 0.75, 0.95, 1.28, 1.60]
-    __c2 = [-0.035, -0.10, -0.15, -0.26, -0.30]
-    __periods = [1.0, 3.0, 5.0, 7.5, 10.0]
+    __c1 = np.array([0.35, 0.75, 0.95, 1.28, 1.60])
+    __c2 = np.array([-0.035, -0.10, -0.15, -0.26, -0.30])
+    __periods = np.array([1.0, 3.0, 5.0, 7.5, 10.0])
 
     def __init__(self, source, lat, lon, dep, dx, T, a_weight=0.5,
-                 mtype=1, simpleDT=False, centered=True):
+                 mtype=1, simpleDT=False, centered=True,
+                 block_size=SITE_SUBFAULT_BLOCK, chunk_size=None,
+                 n_workers=None, cull=False):
         """
         Constructor for rowshandel2013.
 
@@ -87,8 +108,8 @@ with warnings.catch_warnings():
             snaps to the edges of the quadrilaterals so the actual mesh spacing
             will not equal this exactly; spacing in x and y will not be equal.
         :param T:
-            List floats (or a float) for periods to compute fd;
-            Currently, only acceptable values are 1, 2, 3, 4, 5, 7.5. 
+            List floats (or a float) for periods to compute fd; the
+            coefficients are interpolated between the periods of the model.
         :param a_weight:
             Weighting factor for how p-dot-q and s-dot-q are averaged; 0 for
             only p-dot-q (propagation factor) and 1 for only s-dot-q (slip
@@ -100,6 +121,50 @@ with warnings.catch_warnings():
             Boolean; should the simpler DT equation be used? Usually False.
         :param centered:
             Boolean; should the centered directivity parameter be used.
+        :param block_size:
+            Maximum number of site/subfault pairs evaluated at one time in
+            the xi' calculation; this controls the memory used for temporary
+            arrays.
+        :param chunk_size:
+            Number of sites per tile. Sites are processed in tiles of this
+            size (or, if n_workers is given and chunk_size is None, about
+            TILES_PER_WORKER tiles per worker); None for a single tile.
+        :param n_workers:
+            Number of worker processes; if greater than 1, the tiles of
+            sites are computed in a process pool that shares the subfault
+            mesh, propagation and slip vectors (computed once) read-only;
+            this needs Python 3.8 or later.
+        :param cull:
+            Boolean; if True, xi' and LD are only computed for sites where
+            DT * WP is nonzero for at least one of the periods, and are zero
+            elsewhere (where Fd is zero regardless of xi' and LD).
+        """
+        self.__setup(source, lat, lon, dep, dx, T, a_weight, mtype,
+                     simpleDT, centered, block_size, chunk_size, n_workers,
+                     cull)
+
+        # Period independent parameters
+        self.__computeWrup()
+        self.__computeRrup()
+
+        # Period dependent parameters, for all periods
+        self.__computeWP()
+        self.__computeDT()
+        if self._cull:
+            self._taper_mask = self.__getTaperMask()
+        self.__computeLD()
+        self._xi_prime = self.__computeXiPrimes([self._hyp])[0]
+        self.__getCenteringTerm()
+
+        self.__computeFd()
+
+    def __setup(self, source, lat, lon, dep, dx, T, a_weight=0.5,
+                mtype=1, simpleDT=False, centered=True,
+                block_size=SITE_SUBFAULT_BLOCK, chunk_size=None,
+                n_workers=None, cull=False):
+        """
+        Check and store the arguments of the constructor; see the
+        constructor.
         """
         self._source = source
         self._flt = source.getFault()
@@ -112,10 +177,7 @@ with warnings.catch_warnings():
         self._M = source.getEventParam('mag')
 #        if np.all(T != np.array([1, 2, 3, 4, 5, 7.5])):
 #            raise IndexError('Invalid T value. Interpolation not yet supported.')
-        if isinstance(T, float):
-            self._T = [T]
-        else:
-            self._T = T
+        self._T = np.atleast_1d(np.asarray(T, dtype=float))
         if (a_weight > 1.0) or (a_weight < 0):
             raise ValueError('a_weight must be between 0 and 1.')
         self._a_weight = a_weight
@@ -124,18 +186,16 @@ with warnings.catch_warnings():
         self._mtype = mtype
         self._simpleDT = simpleDT
         self._centered = centered
-
-        # Period independent parameters
-        self.__computeWrup()
-        self.__computeLD()
-        self.__computeXiPrime()
-        self.__getCenteringTerm()
-
-        self.__computeFd()
+        self._block_size = block_size
+        self._chunk_size = chunk_size
+        self._n_workers = n_workers
+        self._cull = cull
 
     @classmethod
     def fromSites(cls, source, sites, dx, T, a_weight=0.5,
-                  mtype=1, simpleDT=False, centered=True):
+                  mtype=1, simpleDT=False, centered=True,
+                  block_size=SITE_SUBFAULT_BLOCK, chunk_size=None,
+                  n_workers=None, cull=False):
         """Construct a rowshandel2013 instance from a sites instance.
 
         Class method for constructing a rowshandel2013 instance from
@@ -150,7 +210,7 @@ with warnings.catch_warnings():
             snaps to the edges of the quadrilaterals so the actual mesh spacing
             will not equal this exactly; spacing in x and y will not be equal.
         :param T:
-            Period; Currently, only acceptable values are 1, 2, 3, 4, 5, 7.5. 
+            List floats (or a float) for periods to compute fd.
         :param a_weight:
             Weighting factor for how p-dot-q and s-dot-q are averaged; 0 for
             only p-dot-q (propagation factor) and 1 for only s-dot-q (slip
@@ -162,6 +222,15 @@ with warnings.catch_warnings():
             Boolean; should the simpler DT equation be used? Usually False.
         :param centered:
             Boolean; should the centered directivity parameter be used.
+        :param block_size:
+            Maximum number of site/subfault pairs evaluated at one time.
+        :param chunk_size:
+            Number of sites per tile; see the constructor.
+        :param n_workers:
+            Number of worker processes; see the constructor.
+        :param cull:
+            Boolean; only compute xi' where Fd can be nonzero; see the
+            constructor.
         """
         sm_dict = sites.GeoDict
         west = sm_dict.xmin
@@ -175,7 +244,58 @@ with warnings.catch_warnings():
         lon, lat = np.meshgrid(lons, lats)
         dep = np.zeros_like(lon)
         return cls(source, lat, lon, dep, dx, T,
-                   a_weight, mtype, simpleDT, centered)
+                   a_weight, mtype, simpleDT, centered, block_size,
+                   chunk_size, n_workers, cull)
+
+    @classmethod
+    def fromHypocenters(cls, source, hypos, lat, lon, dep, dx, T, **kwargs):
+        """
+        Construct rowshandel2013 instances for several hypocenters on the
+        fault of one source, for the same sites.
+
+        The subfault mesh, site locations, q vectors (from the subfaults to
+        the sites) and their normalization, Rrup, and the distance taper are
+        computed once and shared by all of the hypocenters.
+
+        :param source:
+            Source instance; its hypocenter is not used.
+        :param hypos:
+            List of hypocenters (openquake Points).
+        :param lat:
+            Numpy array of site latitudes.
+        :param lon:
+            Numpy array of site longitudes.
+        :param dep:
+            Numpy array of site depths (km); positive down.
+        :param dx:
+            Float for target mesh spacing for subfaults in km.
+        :param T:
+            List floats (or a float) for periods to compute fd.
+        :param kwargs:
+            Other arguments of the constructor (e.g., a_weight, mtype).
+        :returns:
+            List of Rowshandel2013 instances, one for each hypocenter.
+        """
+        shared = cls.__new__(cls)
+        shared.__setup(source, lat, lon, dep, dx, T, **kwargs)
+        shared.__computeRrup()
+        shared.__computeWP()
+        shared.__computeDT()
+        if shared._cull:
+            shared._taper_mask = shared.__getTaperMask()
+        shared.__getCenteringTerm()
+        xi_primes = shared.__computeXiPrimes(hypos)
+
+        results = []
+        for hyp, xi_prime in zip(hypos, xi_primes):
+            r = copy.copy(shared)
+            r._hyp = hyp
+            r._xi_prime = xi_prime
+            r.__computeWrup()
+            r.__computeLD()
+            r.__computeFd()
+            results.append(r)
+        return results
 
     def getFd(self):
         """
@@ -196,14 +316,15 @@ with warnings.catch_warnings():
     def getDT(self):
         """
         :returns:
-           Numpy array of the distance taper factor.
+           Numpy array of the distance taper factor; the first dimension is
+           the period.
         """
         return copy.deepcopy(self._DT)
 
     def getWP(self):
         """
         :returns:
-            Numpy array of the narrow-band multiplier. 
+            Numpy array of the narrow-band multiplier, one for each period.
         """
         return copy.deepcopy(self._WP)
 
@@ -221,24 +342,26 @@ with warnings.catch_warnings():
         ln(Y) = f(M, R, ...) + Fd
         """
 
-        xcipc = self._xi_prime - self._xi_c
+        # Coefficients, interpolated in log period
+        logT = np.log(self._T)
+        logperiods = np.log(self.__periods)
+        c1 = np.interp(logT, logperiods, self.__c1)[:, np.newaxis]
+        c2 = np.interp(logT, logperiods, self.__c2)[:, np.newaxis]
+
+        # (periods x sites) arrays
+        WP = self._WP[:, np.newaxis]
+        DT = np.reshape(self._DT, (len(self._T), -1))
+        if self._centered:
+            xcipc = np.reshape(self._xi_prime - self._xi_c, (1, -1))
+            fd = c1 * WP * DT * xcipc
+        else:
+            xi_prime = np.reshape(self._xi_prime, (1, -1))
+            LD = np.reshape(self._LD, (1, -1))
+            fd = (c1 * xi_prime + c2) * LD * DT * WP
 
         # fd is a list with same length as T
-        self._fd = [None] * len(self._T)
-        for i in range(len(self._T)):
-            period = self._T[i]
-            c1sel = self.__c1[self.__periods == period]
-            c2sel = self.__c2[self.__periods == period]
-
-            # Period dependent parameters
-            self.__computeWP(period)
-            self.__computeDT(period)
-
-            if self._centered:
-                self._fd[i] = c1sel * self._WP * self._DT * xcipc
-            else:
-                self._fd[i] = (c1sel * self._xi_prime + c2sel) * \
-                    self._LD * self._DT * self._WP
+        fd = np.reshape(fd, (len(self._T),) + np.shape(self._lat))
+        self._fd = list(fd)
 
     def __computeWrup(self):
         """
@@ -254,7 +377,7 @@ with warnings.catch_warnings():
         * Alternative is to compute max Wrup for the different quads.
 
         """
-        nquad = len(self._flt._quadrilaterals)
+        nquad = self._flt.getNumQuads()
 
         #-------------------------------------------
         # First find which quad the hypocenter is on
@@ -283,48 +406,52 @@ with warnings.catch_warnings():
         ddv = fault.get_quad_down_dip_vector(q)
         self._Wrup = Vector.dot(ddv, hp0) / 1000
 
-    def __computeXiPrime(self):
+    def __computeXiPrimes(self, hypos):
         """
-        Computes the xi' value.
+        Computes the xi' values for a list of hypocenters. The subfault
+        mesh, site locations, and the q vectors from the subfaults to the
+        sites are shared by all of the hypocenters.
+
+        :param hypos:
+            List of hypocenters (Points).
+        :returns:
+            List of numpy arrays of xi', one for each hypocenter.
         """
-        hypo_ecef = Vector.fromPoint(geo.point.Point(
-            self._hyp.longitude, self._hyp.latitude, self._hyp.depth))
-        epi_ll = Vector(self._hyp.longitude, self._hyp.latitude, 0)
-        epi_ecef = Vector.fromPoint(geo.point.Point(
-            epi_ll.x, epi_ll.y, 0))
+        nhyp = len(hypos)
+        hypo_ecef = [Vector.fromPoint(geo.point.Point(
+            hyp.longitude, hyp.latitude, hyp.depth)) for hyp in hypos]
 
         slat = self._lat
         slon = self._lon
 
-        # Convert site to ECEF:
-        site_ecef_x = np.ones_like(slat)
-        site_ecef_y = np.ones_like(slat)
-        site_ecef_z = np.ones_like(slat)
-
-        # Make a 3x(#number of sites) matrix of site locations
-        # (rows are x, y, z) in ECEF
-        site_ecef_x, site_ecef_y, site_ecef_z = latlon2ecef(
-            slat, slon, np.zeros(slon.shape))
-        site_mat = np.array([np.reshape(site_ecef_x, (-1,)),
-                             np.reshape(site_ecef_y, (-1,)),
-                             np.reshape(site_ecef_z, (-1,))])
-
-        xi_prime_unscaled = np.zeros_like(slat)
-
-        # Normalize by total number of subfaults. For mtype == 1, the number
-        # of subfaults will vary with site and be different for xi_s and
-        # xi_p, so keep two variables and sum them for each quad.
-        nsubs = np.zeros(np.product(slat.shape))
-        nsubp = np.zeros(np.product(slat.shape))
-
-        xi_prime_s = np.zeros(np.product(slat.shape))
-        xi_prime_p = np.zeros(np.product(slat.shape))
-
-        for k in range(len(self._flt._quadrilaterals)):
+        # Make a (#number of sites)x3 matrix of site locations
+        # (columns are x, y, z) in ECEF; regular grids (e.g., from fromSites)
+        # use the separable grid conversion.
+        site_ecef_x, site_ecef_y, site_ecef_z = latlon2ecef_mesh(
+            slat, slon, 0.0)
+        sites = np.column_stack((np.reshape(site_ecef_x, (-1,)),
+                                 np.reshape(site_ecef_y, (-1,)),
+                                 np.reshape(site_ecef_z, (-1,))))
+
+        # Sites outside of the distance taper for all periods are skipped
+        isite = None
+        if self._cull:
+            isite = np.flatnonzero(self._taper_mask)
+            sites = sites[isite]
+        nsites = sites.shape[0]
+
+        # Subfault center points, and the propagation and slip unit vectors
+        # for each hypocenter, of all quads; rows of
+        # (nsubfaults x (3 + 6 * nhyp)) and quad offsets
+        subfaults = []
+        offsets = [0]
+        quads = self._flt.getQuadrilaterals()
+        for k in range(self._flt.getNumQuads()):
             # Select a quad
-            q = self._flt.getQuadrilaterals()[k]
+            q = quads[k]
 
-            # Quad mesh (ECEF coords)
+            # Quad mesh (ECEF coords); cached, so repeated evaluations for
+            # the same rupture reuse it
             mesh = fault.get_quad_mesh(q, self._dx)
 
             # Rupture plane normal vector (ECEF coords)
@@ -345,80 +472,104 @@ with warnings.catch_warnings():
                                np.reshape(mesh['cpy'], (-1,)),
                                np.reshape(mesh['cpz'], (-1,))])
 
-            # Compute matrix of p vectors
-            hypcol = np.array([[hypo_ecef.x],
-                               [hypo_ecef.y],
-                               [hypo_ecef.z]])
-            pmat = cp_mat - hypcol
-
-            # Project pmat onto quad
-            ndotp = np.sum(pmat * rpnvcol, axis=0)
-            pmat = pmat - ndotp * rpnvcol
-
-            mag = np.sqrt(np.sum(pmat * pmat, axis=0))
-            pmatnorm = pmat / mag  # like r1
-
-            # According to Rowshandel:
-            #   "The choice of the +/- sign in the above equations
-            #    depends on the (along-the-strike and across-the-dip)
-            #    location of the rupturing sub-fault relative to the
-            #    location of the hypocenter."
-            # and:
-            #   "for the along the strike component of the slip unit
-            #    vector, the choice of the sign should result in the
-            #    slip unit vector (s) being exactly the same as  the
-            #    rupture unit vector (p) for a pure strike-slip case"
-
-            # Strike slip and dip slip components of unit slip vector
-            # (ECEF coords)
-            ds_mat, ss_mat = _get_quad_slip_ds_ss(
-                q, self._rake, cp_mat, pmatnorm)
-
-            slpmat = (ds_mat + ss_mat)
-            mag = np.sqrt(np.sum(slpmat * slpmat, axis=0))
-            slpmatnorm = slpmat / mag
-
-            # Loop over sites
-            for i in range(site_mat.shape[1]):
-                sitecol = np.array([[site_mat[0, i]],
-                                    [site_mat[1, i]],
-                                    [site_mat[2, i]]])
-
-                qmat = sitecol - cp_mat  # 3x(ni*nj), like r2
-                mag = np.sqrt(np.sum(qmat * qmat, axis=0))
-                qmatnorm = qmat / mag
-
-                # Propagation dot product
-                pdotqraw = np.sum(pmatnorm * qmatnorm, axis=0)
-
-                # Slip vector dot product
-                sdotqraw = np.sum(slpmatnorm * qmatnorm, axis=0)
-
-                if self._mtype == 1:
-                    # Only sum over (+) directivity effect subfaults
-
-                    # xi_p_prime
-                    pdotq = pdotqraw.clip(min=0)
-                    nsubp[i] = nsubp[i] + np.sum(pdotq > 0)
-
-                    # xi_s_prime
-                    sdotq = sdotqraw.clip(min=0)
-                    nsubs[i] = nsubs[i] + np.sum(sdotq > 0)
-
-                elif self._mtype == 2:
-                    # Sum over contributing subfaults
-
-                    # xi_p_prime
-                    pdotq = pdotqraw
-                    nsubp[i] = nsubp[i] + cp_mat.shape[1]
-
-                    # xi_s_prime
-                    sdotq = sdotqraw
-                    nsubs[i] = nsubs[i] + cp_mat.shape[1]
+            columns = [cp_mat.T]
+            for h in range(nhyp):
+                # Compute matrix of p vectors
+                hypcol = np.array([[hypo_ecef[h].x],
+                                   [hypo_ecef[h].y],
+                                   [hypo_ecef[h].z]])
+                pmat = cp_mat - hypcol
+
+                # Project pmat onto quad
+                ndotp = np.sum(pmat * rpnvcol, axis=0)
+                pmat = pmat - ndotp * rpnvcol
+
+                mag = np.sqrt(np.sum(pmat * pmat, axis=0))
+                pmatnorm = pmat / mag  # like r1
+
+                # According to Rowshandel:
+                #   "The choice of the +/- sign in the above equations
+                #    depends on the (along-the-strike and across-the-dip)
+                #    location of the rupturing sub-fault relative to the
+                #    location of the hypocenter."
+                # and:
+                #   "for the along the strike component of the slip unit
+                #    vector, the choice of the sign should result in the
+                #    slip unit vector (s) being exactly the same as  the
+                #    rupture unit vector (p) for a pure strike-slip case"
+
+                # Strike slip and dip slip components of unit slip vector
+                # (ECEF coords)
+                ds_mat, ss_mat = _get_quad_slip_ds_ss(
+                    q, self._rake, cp_mat, pmatnorm)
+
+                slpmat = (ds_mat + ss_mat)
+                mag = np.sqrt(np.sum(slpmat * slpmat, axis=0))
+                slpmatnorm = slpmat / mag
+
+                columns.extend([pmatnorm.T, slpmatnorm.T])
+            subfaults.append(np.hstack(columns))
+            offsets.append(offsets[-1] + cp_mat.shape[1])
+        subfaults = np.concatenate(subfaults)
+
+        # Sums of xi_s, xi_p, and numbers of subfaults for xi_s and xi_p
+        # (rows) for each hypocenter and site. For mtype == 1, the number
+        # of subfaults will vary with site and be different for xi_s and
+        # xi_p.
+        n_workers = self._n_workers
+        chunk_size = self._chunk_size
+        if n_workers is not None and n_workers > 1 and nsites > 1:
+            check_parallel()
+            if chunk_size is None:
+                chunk_size = int(np.ceil(
+                    nsites / (n_workers * TILES_PER_WORKER)))
+            shared = [SharedArray.fromArray(sites),
+                      SharedArray.fromArray(subfaults),
+                      SharedArray((nhyp, 4, nsites), np.float64)]
+            sums = shared[2].array
+        else:
+            shared = []
+            sums = np.empty((nhyp, 4, nsites))
+        if chunk_size is None:
+            chunk_size = nsites
+        tiles = get_tiles(nsites, chunk_size)
+        try:
+            if shared and len(tiles) > 1:
+                initargs = (shared[0].getSpec(), shared[1].getSpec(),
+                            shared[2].getSpec(), offsets, self._mtype,
+                            self._block_size)
+                with ProcessPoolExecutor(
+                        max_workers=n_workers,
+                        initializer=_init_xi_prime_worker,
+                        initargs=initargs) as pool:
+                    list(pool.map(_xi_prime_worker, tiles))
+            else:
+                for istart, iend in tiles:
+                    _calc_xi_prime_sums(sites[istart:iend], subfaults,
+                                        offsets, self._mtype,
+                                        self._block_size,
+                                        sums[:, :, istart:iend])
+            xi_primes = [self.__getXiPrime(hsums, isite)
+                         for hsums in sums]
+        finally:
+            for shared_array in shared:
+                shared_array.close()
+        return xi_primes
+
+    def __getXiPrime(self, sums, isite):
+        """
+        Normalize and scale the sums of the dot products to get xi'.
 
-                # Normalize by n sub faults later
-                xi_prime_s[i] = xi_prime_s[i] + np.sum(sdotq)
-                xi_prime_p[i] = xi_prime_p[i] + np.sum(pdotq)
+        :param sums:
+            Numpy array (4 x nsites) of the sums of s-dot-q, p-dot-q, and the
+            numbers of subfaults for s-dot-q and p-dot-q.
+        :param isite:
+            Indices of the sites of the sums when culling, otherwise None.
+        :returns:
+            Numpy array of xi', with the shape of the sites.
+        """
+        slat = self._lat
+        xi_prime_s, xi_prime_p, nsubs, nsubp = sums
 
         # Apply a water level to nsubp and nsubs to avoid division by
         # zero. This should only occur when the numerator is also zero
@@ -426,22 +577,23 @@ with warnings.catch_warnings():
         nsubs = np.maximum(nsubs, 1)
         nsubp = np.maximum(nsubp, 1)
 
-        # We are outside the 'k' loop over nquads.
         # o Normalize xi_prime_s and xi_prime_p
-        # o Reshape them
         # o Add them together with the 'a' weights
+        # o Reshape them
         xi_prime_tmp = (self._a_weight) * (xi_prime_s / nsubs) + \
                        (1 - self._a_weight) * (xi_prime_p / nsubp)
-        xi_prime_unscaled = xi_prime_unscaled + \
-            np.reshape(xi_prime_tmp, slat.shape)
 
         # Scale so that xi_prime has range (0, 1)
-        if self._mtype == 1:
-            xi_prime = xi_prime_unscaled
-        elif self._mtype == 2:
-            xi_prime = 0.5 * (xi_prime_unscaled + 1)
+        if self._mtype == 2:
+            xi_prime_tmp = 0.5 * (xi_prime_tmp + 1)
 
-        self._xi_prime = xi_prime
+        if self._cull:
+            xi_prime = np.zeros(slat.size)
+            xi_prime[isite] = xi_prime_tmp
+            xi_prime = np.reshape(xi_prime, slat.shape)
+        else:
+            xi_prime = np.reshape(xi_prime_tmp, slat.shape)
+        return xi_prime
 
     def __computeLD(self):
         """
@@ -476,81 +628,101 @@ with warnings.catch_warnings():
         Lrup_max = 400
         slat = self._lat
         slon = self._lon
-        LD = np.zeros_like(slat)
-        Ls = np.zeros_like(slat)
-
-        ni, nj = LD.shape
-        for i in range(ni):
-            for j in range(nj):
-                #-----------------------
-                # Compute Ls
-                #-----------------------
-                # Convert to local orthographic
-                site_x, site_y = proj(slon[i, j], slat[i, j])
-
-                # Shift so center is at epicenter
-                site_x2 = site_x - epi_x
-                site_y2 = site_y - epi_y
-                top_x2 = top_x - epi_x
-                top_y2 = top_y - epi_y
-
-                # Angle to rotate to put site on x-axis
-                alpha = np.arctan2(site_y2, site_x2)
-                axis = [0, 0, 1]
-                rmat = _rotation_matrix(axis, -alpha)
-                llr = [None] * len(top_lat)
-
-                # Apply rotation to each point on trace
-                for k in range(len(top_lat)):
-                    llr[k] = np.dot(rmat, [top_x2[k], top_y2[k], 0])
-                    site3 = np.dot(rmat, [site_x2, site_y2, 0])
-                Li = np.min([np.max([a[0] for a in llr]), site3[0]])
-
-                #-----------------------------------
-                # Compute LD and save results into matrices
-                #-----------------------------------
-
-                Lrup = np.sqrt(Li * Li + self._Wrup * self._Wrup)
-                LD[i, j] = np.log(Lrup) / np.log(Lrup_max)
-                Ls[i, j] = Li
+        LD = np.zeros(slat.size)
+        Ls = np.zeros(slat.size)
+
+        # Sites outside of the distance taper are skipped
+        if self._cull:
+            isite = np.flatnonzero(self._taper_mask)
+        else:
+            isite = np.arange(slat.size)
+
+        #-----------------------
+        # Compute Ls
+        #-----------------------
+        # Convert to local orthographic
+        site_x, site_y = proj(np.reshape(slon, (-1,))[isite],
+                              np.reshape(slat, (-1,))[isite])
+
+        # Shift so center is at epicenter
+        site_x2 = site_x - epi_x
+        site_y2 = site_y - epi_y
+        top_x2 = top_x - epi_x
+        top_y2 = top_y - epi_y
+
+        # Rotate each site onto the x-axis, and the trace with it; blocks of
+        # sites are (sites x trace points)
+        chunk = max(1, self._block_size // len(top_x2))
+        for istart in range(0, len(isite), chunk):
+            iend = min(istart + chunk, len(isite))
+            alpha = np.arctan2(site_y2[istart:iend], site_x2[istart:iend])
+            cosa = np.cos(alpha)[:, np.newaxis]
+            sina = np.sin(alpha)[:, np.newaxis]
+            top_xr = top_x2 * cosa + top_y2 * sina
+            site_xr = site_x2[istart:iend] * cosa[:, 0] + \
+                site_y2[istart:iend] * sina[:, 0]
+            Ls[isite[istart:iend]] = np.minimum(np.max(top_xr, axis=1),
+                                                site_xr)
+
+        #-----------------------------------
+        # Compute LD and save results into matrices
+        #-----------------------------------
+        Li = Ls[isite]
+        Lrup = np.sqrt(Li * Li + self._Wrup * self._Wrup)
+        LD[isite] = np.log(Lrup) / np.log(Lrup_max)
+        LD = np.reshape(LD, slat.shape)
+        Ls = np.reshape(Ls, slat.shape)
         self._LD = LD
         self._Ls = Ls
 
-    def __computeDT(self, period):
+    def __computeRrup(self):
         """
-        Computes DT -- the distance taper term.
+        Computes Rrup, which is used by the distance taper for all periods.
         """
         slat = self._lat
         slon = self._lon
         site_z = np.zeros_like(slat)
-        ddict = get_distance('rrup', slat, slon, site_z, self._source)
-        Rrup = np.reshape(ddict['rrup'], (-1, ))
-        nsite = len(Rrup)
+        ddict = get_distance('rrup', slat, slon, site_z, self._source,
+                             chunk_size=self._chunk_size,
+                             n_workers=self._n_workers)
+        self._Rrup = np.reshape(ddict['rrup'], (-1, ))
+
+    def __getTaperMask(self):
+        """
+        Find the sites where DT * WP is nonzero for at least one period.
+
+        :returns:
+            Boolean numpy array with one value for each site (flattened).
+        """
+        WPDT = self._WP[:, np.newaxis] * \
+            np.reshape(self._DT, (len(self._T), -1))
+        return np.any(WPDT != 0, axis=0)
+
+    def __computeDT(self):
+        """
+        Computes DT -- the distance taper term -- for all periods.
+        """
+        slat = self._lat
+        Rrup = self._Rrup[np.newaxis, :]
+        period = self._T[:, np.newaxis]
 
         if self._simpleDT:   # eqn 3.10
             R1 = 35
             R2 = 70
-            DT = np.ones(nsite)
-            ix = [(Rrup > R1) & (Rrup < R2)]
-            DT[ix] = 2 - Rrup[ix] / R1
-            DT[Rrup >= R2] = 0
         else:                  # eqn 3.9
-            if period >= 1:
-                R1 = 20 + 10 * np.log(period)
-                R2 = 2 * (20 + 10 * np.log(period))
-            else:
-                R1 = 20
-                R2 = 40
-            DT = np.ones(nsite)
-            # As written in report:
-            # DT[(Rrup > R1) & (Rrup < R2)] = 2 - Rrup[(Rrup > R1) & (Rrup < R2)]/(20 + 10 * np.log(period))
-            # Modification:
-            DT[(Rrup > R1) & (Rrup < R2)] = 2 - \
-                Rrup[(Rrup > R1) & (Rrup < R2)] / R1
-            # Note: it is not clear if the above modification is 'correct' but it gives
-            #       results that make more sense
-            DT[Rrup >= R2] = 0
-        DT = np.reshape(DT, slat.shape)
+            # R1 is 20 for periods less than 1 s
+            R1 = 20 + 10 * np.log(np.maximum(period, 1.0))
+            R2 = 2 * R1
+        DT = np.ones((len(self._T), len(self._Rrup)))
+        # As written in report (eqn 3.9):
+        # DT = 2 - Rrup/(20 + 10 * np.log(period)) for R1 < Rrup < R2
+        # Modification:
+        ix = (Rrup > R1) & (Rrup < R2)
+        DT = np.where(ix, 2 - Rrup / R1, DT)
+        # Note: it is not clear if the above modification is 'correct' but
+        #       it gives results that make more sense
+        DT[np.broadcast_to(Rrup >= R2, DT.shape)] = 0
+        DT = np.reshape(DT, (len(self._T),) + slat.shape)
         self._DT = DT
 
     def __getCenteringTerm(self):
@@ -567,10 +739,11 @@ with warnings.catch_warnings():
             cct = (CSSLP + CNRML) / 2
             self._xi_c = act * np.cos(2 * np.radians(self._rake)) + cct
 
-    def __computeWP(self, period):
+    def __computeWP(self):
         """
-        Computes WP -- the narrow-band multiplier.
+        Computes WP -- the narrow-band multiplier -- for all periods.
         """
+        period = self._T
         # As written in report:
         # sig = 0.6
         # Tp = np.exp(1.27*self._M - 7.28)
@@ -581,6 +754,112 @@ with warnings.catch_warnings():
                             np.log10(period / Tp)) / (2 * sig * sig))
 
 
+def _calc_xi_prime_sums(sites, subfaults, offsets, mtype, block_size, out):
+    """
+    Compute the sums of the slip and propagation dot products, and the
+    numbers of subfaults in the sums, for a set of sites.
+
+    :param sites:
+        Numpy array (nsites x 3) of site locations in ECEF coords.
+    :param subfaults:
+        Numpy array (nsubfaults x (3 + 6 * nhyp)) of subfault center points,
+        followed by the propagation unit vectors and slip unit vectors for
+        each of nhyp hypocenters (ECEF coords).
+    :param offsets:
+        List of the index of the first subfault of each quad, plus the
+        number of subfaults.
+    :param mtype:
+        Integer, either 1 or 2; see Rowshandel2013.
+    :param block_size:
+        Maximum number of site/subfault pairs evaluated at one time.
+    :param out:
+        Numpy array (nhyp x 4 x nsites) for the sums of s-dot-q, p-dot-q, and
+        the numbers of subfaults for s-dot-q and p-dot-q.
+    """
+    out[:] = 0
+    nsites = sites.shape[0]
+    for k in range(len(offsets) - 1):
+        # Sites are processed in blocks; the arrays are (sites x
+        # subfaults x 3)
+        cp = subfaults[offsets[k]:offsets[k + 1], 0:3]
+        nsub = cp.shape[0]
+        chunk = max(1, block_size // nsub)
+        for istart in range(0, nsites, chunk):
+            iend = min(istart + chunk, nsites)
+            qmat = sites[istart:iend, np.newaxis, :] - cp  # like r2
+            mag = np.sqrt(np.sum(qmat * qmat, axis=2))
+            qmatnorm = qmat / mag[:, :, np.newaxis]
+
+            # The q vectors are shared by all of the hypocenters
+            for h in range(len(out)):
+                xi_prime_s, xi_prime_p, nsubs, nsubp = out[h]
+                pnorm = subfaults[offsets[k]:offsets[k + 1],
+                                  3 + 6 * h:6 + 6 * h]
+                snorm = subfaults[offsets[k]:offsets[k + 1],
+                                  6 + 6 * h:9 + 6 * h]
+
+                # Propagation dot product
+                pdotqraw = np.sum(pnorm * qmatnorm, axis=2)
+
+                # Slip vector dot product
+                sdotqraw = np.sum(snorm * qmatnorm, axis=2)
+
+                if mtype == 1:
+                    # Only sum over (+) directivity effect subfaults
+
+                    # xi_p_prime
+                    pdotq = pdotqraw.clip(min=0)
+                    nsubp[istart:iend] += np.sum(pdotq > 0, axis=1)
+
+                    # xi_s_prime
+                    sdotq = sdotqraw.clip(min=0)
+                    nsubs[istart:iend] += np.sum(sdotq > 0, axis=1)
+
+                elif mtype == 2:
+                    # Sum over contributing subfaults
+
+                    # xi_p_prime
+                    pdotq = pdotqraw
+                    nsubp[istart:iend] += nsub
+
+                    # xi_s_prime
+                    sdotq = sdotqraw
+                    nsubs[istart:iend] += nsub
+
+                # Normalize by n sub faults later
+                xi_prime_s[istart:iend] += np.sum(sdotq, axis=1)
+                xi_prime_p[istart:iend] += np.sum(pdotq, axis=1)
+
+
+def _init_xi_prime_worker(sites_spec, subfaults_spec, sums_spec, offsets,
+                          mtype, block_size):
+    """
+    Initialize a xi' worker process; the shared arrays are attached once per
+    worker rather than once per tile.
+    """
+    _WORKER['sites'] = SharedArray.fromSpec(sites_spec)
+    _WORKER['subfaults'] = SharedArray.fromSpec(subfaults_spec)
+    _WORKER['sums'] = SharedArray.fromSpec(sums_spec)
+    _WORKER['offsets'] = offsets
+    _WORKER['mtype'] = mtype
+    _WORKER['block_size'] = block_size
+
+
+def _xi_prime_worker(tile):
+    """
+    Compute the xi' sums for one tile of sites in a worker process and
+    write them into the shared output array.
+
+    :param tile:
+        Tuple of (start, end) indices of the sites.
+    """
+    istart, iend = tile
+    _calc_xi_prime_sums(_WORKER['sites'].array[istart:iend],
+                        _WORKER['subfaults'].array, _WORKER['offsets'],
+                        _WORKER['mtype'], _WORKER['block_size'],
+                        _WORKER['sums'].array[:, :, istart:iend])
+
+
 def _get_quad_slip_ds_ss(q, rake, cp, p):
     """
     Compute the DIP SLIP and STRIKE SLIP components of the unit slip vector in
@@ -670,21 +949,3 @@ def _get_quad_slip_ds_ss(q, rake, cp, p):
                       s1_ecef[2].reshape(-1) - s02])
     return d_mat, s_mat
 
-
-def _rotation_matrix(axis, theta):
-    """
-    Return the rotation matrix associated with counterclockwise rotation about
-    the given axis by theta radians.
-    Source: Response by 'unutbu' in this thread:
-    http://stackoverflow.com/questions/6802577/python-rotation-of-3d-vector
-    """
-    axis = np.asarray(axis)
-    theta = np.asarray(theta)
-    axis = axis / np.sqrt(np.dot(axis, axis))
-    a = np.cos(theta / 2)
-    b, c, d = -axis * np.sin(theta / 2)
-    aa, bb, cc, dd = a * a, b * b, c * c, d * d
-    bc, ad, ac, ab, bd, cd = b * c, a * d, a * c, a * b, b * d, c * d
-    return np.array([[aa + bb - cc - dd, 2 * (bc + ad), 2 * (bd - ac)],
-                     [2 * (bc - ad), aa + cc - bb - dd, 2 * (cd + ab)],
-                     [2 * (bd + ac), 2 * (cd - ab), aa + dd - bb - cc]])
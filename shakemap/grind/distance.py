@@ -3,25 +3,77 @@
 # stdlib imports
 import copy
 import warnings
-import itertools as it
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 # third party imports
 from ..utils.ecef import latlon2ecef
-from ..utils.vector import Vector
-from .fault import get_quad_length
+from ..utils.ecef import latlon2ecef_mesh
+from ..utils.ecef import is_meshgrid
 from .source import rake_to_mech
+from .fault import get_quad_mesh
 from openquake.hazardlib.geo import geodetic
-from openquake.hazardlib.geo.utils import get_orthographic_projection
+from openquake.hazardlib.geo import point
 from openquake.hazardlib.gsim.base import GMPE
 from openquake.hazardlib.gsim import base
 import numpy as np
 import pandas as pd
 import re
 import scipy.interpolate as spint
+from scipy.spatial import cKDTree
 
 # local imports
 from shakemap.utils.exception import ShakeMapException
+from shakemap.utils.parallel import SharedArray
+from shakemap.utils.parallel import check_parallel
+from shakemap.utils.parallel import get_tiles
+
+# Maximum number of quad/site pairs that are evaluated together when computing
+# Rrup and Rjb; this bounds the size of the temporary arrays.
+QUAD_SITE_BLOCK = 2**18
+
+# Margin (m) added to the bounds used to prune quads with bounding spheres.
+PRUNE_MARGIN = 1.0
+
+# Approximate working memory (bytes) per quad/site pair in the Rrup, Rjb and
+# GC2 kernels, and per site for the other arrays of get_distance; these are
+# used to convert max_memory into block sizes.
+QUAD_SITE_BYTES = 512
+SITE_BYTES = 512
+
+# Number of tiles per worker when computing distances in parallel and no
+# chunk_size is given; more tiles than workers balances the load.
+TILES_PER_WORKER = 4
+
+# State of a distance worker process (see _init_distance_worker)
+_WORKER = {}
+
+# Spacing (in grid cells) of the coarse grid used by the adaptive distance
+# calculation, the distance (km) from the rupture within which tiles are
+# always computed exactly, and the distance (km) below which the tolerance is
+# absolute rather than relative. Since Rjb and Rrup are exact near the
+# rupture, the latter only matters for the signed distances near zero. The
+# interpolation error is checked at a few points of each tile against this
+# fraction of the tolerance, as a margin for the error between them.
+ADAPTIVE_TILE = 8
+ADAPTIVE_NEAR_DISTANCE = 20.0
+ADAPTIVE_MIN_DISTANCE = 10.0
+ADAPTIVE_CHECK_FACTOR = 0.5
+
+# Relative accuracy of the point cloud approximation of Rrup and Rjb (see
+# FaultPointCloud); sites where the error bound of the approximation is larger
+# than this fraction of the distance are computed exactly.
+MESH_TOLERANCE = 0.01
+
+# Location of the ps2ff Repi to Rjb/Rrup tables and their precompiled form
+PS2FF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'data', 'ps2ff')
+PS2FF_NPZ_FILE = os.path.join(PS2FF_DIR, 'ps2ff_tables.npz')
+
+# Interpolators for the ps2ff tables keyed by (region, mechanism, kind), and
+# the contents of the npz file once it has been loaded
+_PS2FF_CACHE = {}
+_PS2FF_NPZ = None
 
 
 class Distance(object):
@@ -38,7 +90,10 @@ class Distance(object):
         Report 2015-1028, 20 p., http://dx.doi.org/10.3133/ofr20151028.
     """
 
-    def __init__(self, gmpe, source, lat, lon, dep, use_median_distance=True):
+    def __init__(self, gmpe, source, lat, lon, dep, use_median_distance=True,
+                 chunk_size=None, max_memory=None, n_workers=None,
+                 cache=None, geodict=None, tolerance=None,
+                 max_distance=None, mesh_dx=None):
         """
         :param gmpe:
             Concrete subclass of GMPE
@@ -63,16 +118,44 @@ class Distance(object):
             Boolean; only used if GMPE requests fault distances and not fault is
             availalbe. Default is True, meaning that point-source distances are
             adjusted based on magnitude to get the median fault distance.
+        :param chunk_size:
+            Number of sites to compute at one time; see get_distance.
+        :param max_memory:
+            Approximate limit (bytes) of working memory; see get_distance.
+        :param n_workers:
+            Number of worker processes; see get_distance.
+        :param cache:
+            Optional DistanceCache object; distances are read from it if
+            available, and saved to it otherwise. Requires geodict.
+        :param geodict:
+            GeoDict of the grid of sites given by lat/lon; only used with
+            cache.
+        :param tolerance:
+            Relative tolerance of the adaptive calculation; see get_distance.
+        :param max_distance:
+            Distance (km) beyond which the fault distances are approximated;
+            see get_distance.
+        :param mesh_dx:
+            Spacing (km) of the point cloud approximation of Rrup and Rjb;
+            see get_distance.
         :returns:
             Distance object.
         """
         self._source = source
+        self._approximated = None
 
         self._distance_context = self._calcDistanceContext(
-            gmpe, lat, lon, dep, use_median_distance)
+            gmpe, lat, lon, dep, use_median_distance,
+            chunk_size=chunk_size, max_memory=max_memory,
+            n_workers=n_workers, cache=cache, geodict=geodict,
+            tolerance=tolerance, max_distance=max_distance,
+            mesh_dx=mesh_dx)
 
     @classmethod
-    def fromSites(cls, gmpe, source, sites, use_median_distance=True):
+    def fromSites(cls, gmpe, source, sites, use_median_distance=True,
+                  chunk_size=None, max_memory=None, n_workers=None,
+                  cache=None, tolerance=None, max_distance=None,
+                  mesh_dx=None):
         """
         Convenience class method to construct a Distance object from a sites object.
 
@@ -88,6 +171,22 @@ class Distance(object):
             Boolean; only used if GMPE requests fault distances and not fault is
             availalbe. Default is True, meaning that point-source distances are
             adjusted based on magnitude to get the median fault distance.
+        :param chunk_size:
+            Number of sites to compute at one time; see get_distance.
+        :param max_memory:
+            Approximate limit (bytes) of working memory; see get_distance.
+        :param n_workers:
+            Number of worker processes; see get_distance.
+        :param cache:
+            Optional DistanceCache object.
+        :param tolerance:
+            Relative tolerance of the adaptive calculation; see get_distance.
+        :param max_distance:
+            Distance (km) beyond which the fault distances are approximated;
+            see get_distance.
+        :param mesh_dx:
+            Spacing (km) of the point cloud approximation of Rrup and Rjb;
+            see get_distance.
         :returns:
             Distance object.
         """
@@ -102,15 +201,29 @@ class Distance(object):
         lons = np.linspace(west, east, nx)
         lon, lat = np.meshgrid(lons, lats)
         dep = np.zeros_like(lon)
-        return cls(gmpe, source, lat, lon, dep, use_median_distance)
+        return cls(gmpe, source, lat, lon, dep, use_median_distance,
+                   chunk_size=chunk_size, max_memory=max_memory,
+                   n_workers=n_workers, cache=cache, geodict=sm_dict,
+                   tolerance=tolerance, max_distance=max_distance,
+                   mesh_dx=mesh_dx)
 
     def getDistanceContext(self):
         """
+        The distance arrays are not copied (they may be large, and memory
+        mapped from a DistanceCache); they are read-only views of the arrays
+        of this object, so they must be copied before being modified.
+
         :returns:
             Openquake distance context
             `[link] <http://docs.openquake.org/oq-hazardlib/master/gsim/index.html?highlight=distancescontext#openquake.hazardlib.gsim.base.DistancesContext>`__.
         """
-        return copy.deepcopy(self._distance_context)
+        context = copy.copy(self._distance_context)
+        for name, value in list(vars(context).items()):
+            if isinstance(value, np.ndarray):
+                value = value.view()
+                value.flags.writeable = False
+                setattr(context, name, value)
+        return context
 
     def getSource(self):
         """
@@ -119,8 +232,20 @@ class Distance(object):
         """
         return copy.deepcopy(self._source)
 
+    def getApproximated(self):
+        """
+        :returns:
+            Boolean numpy array that is True for the sites whose fault
+            distances were approximated because they are beyond
+            max_distance, or None if max_distance was not used.
+        """
+        return self._approximated
+
     def _calcDistanceContext(self, gmpe, lat, lon, dep,
-                             use_median_distance=True):
+                             use_median_distance=True, chunk_size=None,
+                             max_memory=None, n_workers=None, cache=None,
+                             geodict=None, tolerance=None,
+                             max_distance=None, mesh_dx=None):
         """
         Create a DistancesContext object.
 
@@ -138,10 +263,30 @@ class Distance(object):
             Boolean; only used if GMPE requests fault distances and not fault is
             availalbe. Default is True, meaning that point-source distances are
             adjusted based on magnitude to get the median fault distance.
+        :param chunk_size:
+            Number of sites to compute at one time; see get_distance.
+        :param max_memory:
+            Approximate limit (bytes) of working memory; see get_distance.
+        :param n_workers:
+            Number of worker processes; see get_distance.
+        :param cache:
+            Optional DistanceCache object.
+        :param geodict:
+            GeoDict of the grid of sites; required with cache.
+        :param tolerance:
+            Relative tolerance of the adaptive calculation; see get_distance.
+        :param max_distance:
+            Distance (km) beyond which the fault distances are approximated;
+            see get_distance.
+        :param mesh_dx:
+            Spacing (km) of the point cloud approximation of Rrup and Rjb;
+            see get_distance.
         :returns:
             DistancesContext object with distance grids required by input gmpe(s).
         :raises TypeError:
             if gmpe is not a subclass of GMPE
+        :raises ShakeMapException:
+            if cache is given without geodict.
         """
         if not isinstance(gmpe, list):
             gmpe = [gmpe]
@@ -158,8 +303,23 @@ class Distance(object):
 
         context = base.DistancesContext()
 
-        ddict = get_distance(list(requires), lat, lon, dep, self._source,
-                             use_median_distance=use_median_distance)
+        if cache is not None:
+            if geodict is None:
+                raise ShakeMapException(
+                    'A GeoDict is required to use the distance cache.')
+            ddict = cache.getDistance(
+                list(requires), lat, lon, dep, self._source, geodict,
+                use_median_distance=use_median_distance,
+                chunk_size=chunk_size, max_memory=max_memory,
+                n_workers=n_workers, tolerance=tolerance,
+                max_distance=max_distance, mesh_dx=mesh_dx)
+        else:
+            ddict = get_distance(list(requires), lat, lon, dep, self._source,
+                                 use_median_distance=use_median_distance,
+                                 chunk_size=chunk_size, max_memory=max_memory,
+                                 n_workers=n_workers, tolerance=tolerance,
+                                 max_distance=max_distance, mesh_dx=mesh_dx)
+        self._approximated = ddict.get('approximated')
 
         for method in requires:
             (context.__dict__)[method] = ddict[method]
@@ -168,7 +328,9 @@ class Distance(object):
 
 
 def get_distance(methods, lat, lon, dep, source,
-                 use_median_distance=True):
+                 use_median_distance=True, chunk_size=None, max_memory=None,
+                 n_workers=None, tolerance=None, max_distance=None,
+                 mesh_dx=None):
     """
     Calculate distance using any one of a number of distance measures.
     One of quadlist OR hypo must be specified. The following table gives
@@ -215,19 +377,61 @@ def get_distance(methods, lat, lon, dep, source,
         Boolean; only used if GMPE requests fault distances and not fault is
         availalbe. Default is True, meaning that point-source distances are
         adjusted based on magnitude to get the median fault distance.
+    :param chunk_size:
+        Number of sites to compute at one time. If given, the sites are
+        processed in blocks of this size and the results are written into
+        preallocated output arrays, so that the working memory does not
+        depend on the number of sites. Default is None (all sites at once).
+    :param max_memory:
+        Approximate limit (bytes) of working memory. This sets the number of
+        quad/site pairs evaluated together in the Rrup, Rjb and GC2 kernels
+        and, if chunk_size is not given, the number of sites per block. The
+        output arrays are not included. Default is None (no limit).
+    :param n_workers:
+        Number of worker processes. If greater than one, the sites are split
+        into tiles (of chunk_size sites, if given) that are computed in a
+        process pool; the sites and distances are passed through shared
+        memory and the source is sent once to each worker. The results are
+        identical to the serial calculation. Default is None (serial).
+        The parallel mode needs Python 3.8 or later; a ShakeMapException is
+        raised otherwise.
+    :param tolerance:
+        If given, and lat/lon are a regular 2D grid (as made by
+        numpy.meshgrid), the fault distances (all but repi and rhypo, which
+        are always exact) are computed adaptively: they are computed exactly
+        on a coarse grid and bilinearly interpolated elsewhere, except in
+        tiles of the coarse grid where the interpolation error of any
+        distance at the tile centre or at the midpoint of any tile edge is
+        larger than ADAPTIVE_CHECK_FACTOR times tolerance times that
+        distance (or times ADAPTIVE_MIN_DISTANCE km, for smaller distances
+        and for the signed rx, ry, U and T near zero), or that are within
+        ADAPTIVE_NEAR_DISTANCE km of the rupture; those tiles are computed
+        exactly. The error elsewhere is then within tolerance times the
+        distance, except where it is not smooth between the checked points
+        (e.g., where the closest part of the rupture changes).
+        Default is None (all sites exact).
+    :param max_distance:
+        If given (in km), and the source has a fault, only the sites that may
+        be within max_distance of the fault (from a lower bound on Rjb using
+        bounding spheres of the fault quads) are computed exactly. For
+        regular 2D grids, the sub-grid that encloses those sites is computed
+        (adaptively if tolerance is given). At the other sites, Rjb and Rrup
+        are approximated by the epicentral distance minus half the fault
+        length, and the GC2 distances are those of a straight fault from the
+        first to the last top vertex. The output then includes a boolean
+        array 'approximated' that is True at these sites.
+        Default is None (no cutoff).
+    :param mesh_dx:
+        If given (in km), and the source has a fault, Rrup and Rjb are
+        approximated by the distance to the nearest point of a point cloud
+        on the fault surface with this spacing (see FaultPointCloud), and
+        computed exactly only where the error bound of the approximation is
+        more than MESH_TOLERANCE times the distance. The error is then at
+        most MESH_TOLERANCE times the distance everywhere. Default is None
+        (exact).
     :returns:
        dictionary of numpy array of distances, size of lon.shape
     """
-    fault = source.getFault()
-    hypo = source.getHypo()
-    if fault is not None:
-        quadlist = fault.getQuadrilaterals()
-    else:
-        quadlist = None
-
-    # Dictionary for holding the distances
-    distdict = dict()
-
     if not isinstance(methods, list):
         methods = [methods]
 
@@ -243,6 +447,517 @@ def get_distance(methods, lat, lon, dep, source,
     else:
         raise ShakeMapException('lat, lon, and dep must have the same shape.')
 
+    if max_distance is not None and source._fault is not None:
+        return _get_distance_cutoff(methods, lat, lon, dep, source,
+                                    use_median_distance, max_distance,
+                                    chunk_size=chunk_size,
+                                    max_memory=max_memory,
+                                    n_workers=n_workers, tolerance=tolerance,
+                                    mesh_dx=mesh_dx)
+
+    if tolerance is not None and _is_regular_grid(lat, lon):
+        return _get_distance_adaptive(methods, lat, lon, dep, source,
+                                      use_median_distance, tolerance,
+                                      chunk_size=chunk_size,
+                                      max_memory=max_memory,
+                                      n_workers=n_workers, mesh_dx=mesh_dx)
+
+    cloud = None
+    if mesh_dx is not None and source._fault is not None and \
+       (('rrup' in methods) or ('rjb' in methods)):
+        cloud = _get_point_cloud(source._fault, mesh_dx)
+        # Build the trees before the cloud is sent to any workers
+        if 'rrup' in methods:
+            cloud.getTree()
+        if 'rjb' in methods:
+            cloud.getTree(surface=True)
+
+    block_size = QUAD_SITE_BLOCK
+    if max_memory is not None:
+        block_size = max(1, int(max_memory // QUAD_SITE_BYTES))
+        if chunk_size is None:
+            chunk_size = max(1, int(max_memory // SITE_BYTES))
+
+    nsites = lon.size
+    if n_workers is not None and n_workers > 1 and nsites > 1:
+        return _get_distance_parallel(methods, lat, lon, dep, source,
+                                      use_median_distance, block_size,
+                                      chunk_size, n_workers, cloud=cloud)
+
+    if chunk_size is None or chunk_size >= nsites:
+        return _get_distance(methods, lat, lon, dep, source,
+                             use_median_distance, block_size, cloud=cloud)
+
+    # Stream blocks of sites into the output arrays
+    oldshape = lon.shape
+    lat = np.reshape(lat, (-1,))
+    lon = np.reshape(lon, (-1,))
+    dep = np.reshape(dep, (-1,))
+    distdict = dict()
+    for istart in range(0, nsites, chunk_size):
+        iend = istart + chunk_size
+        ddict = _get_distance(methods, lat[istart:iend], lon[istart:iend],
+                              dep[istart:iend], source, use_median_distance,
+                              block_size, cloud=cloud)
+        for key, value in ddict.items():
+            if key not in distdict:
+                distdict[key] = np.empty(nsites, dtype=value.dtype)
+            distdict[key][istart:iend] = value
+    for value in distdict.values():
+        value.shape = oldshape
+    return distdict
+
+
+def _get_distance_cutoff(methods, lat, lon, dep, source,
+                         use_median_distance, max_distance, **kwargs):
+    """
+    Calculate distances exactly for the sites that may be within
+    max_distance of the fault, and approximately for the others; see
+    get_distance.
+
+    :param methods:
+        List of strings of distances to compute.
+    :param lat:
+       A numpy array of latitudes.
+    :param lon:
+       A numpy array of longidues.
+    :param dep:
+       A numpy array of depths (km).
+    :param source:
+       source instance; must have a fault.
+    :param use_median_distance:
+        Boolean; see get_distance.
+    :param max_distance:
+        Cutoff distance (km).
+    :param kwargs:
+        Other options passed to get_distance for the exact calculations.
+    :returns:
+       dictionary of numpy array of distances, size of lon.shape, and the
+       boolean array 'approximated'.
+    """
+    hypo = source.getHypo()
+    repi = geodetic.distance(hypo.longitude, hypo.latitude, 0.0,
+                             lon, lat, dep)
+    inside = _get_rjb_lower_bound(source._fault, lat, lon) <= max_distance
+
+    # For a regular grid, compute the enclosing sub-grid so that it is still
+    # a grid (e.g., for the adaptive calculation)
+    subgrid = None
+    if _is_regular_grid(lat, lon) and np.any(inside):
+        rows = np.flatnonzero(np.any(inside, axis=1))
+        cols = np.flatnonzero(np.any(inside, axis=0))
+        subgrid = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+        inside = np.zeros_like(inside)
+        inside[subgrid] = True
+    approximated = ~inside
+
+    # Approximate distances for all sites; the exact ones replace them below
+    distdict = _get_far_distances(methods, lat, lon, dep, source, repi)
+    if subgrid is not None:
+        ddict = get_distance(methods, lat[subgrid], lon[subgrid],
+                             dep[subgrid], source, use_median_distance,
+                             **kwargs)
+    elif np.any(inside):
+        ddict = get_distance(methods, lat[inside], lon[inside], dep[inside],
+                             source, use_median_distance, **kwargs)
+    else:
+        ddict = {}
+    for key, value in ddict.items():
+        if key not in distdict:
+            distdict[key] = np.full(lon.shape, np.nan, dtype=value.dtype)
+        if subgrid is not None:
+            distdict[key][subgrid] = value
+        else:
+            distdict[key][inside] = value
+    distdict['approximated'] = approximated
+    return distdict
+
+
+def _get_far_distances(methods, lat, lon, dep, source, repi):
+    """
+    Approximate fault distances for sites far from the fault; see
+    get_distance (max_distance).
+
+    :param methods:
+        List of strings of distances to compute.
+    :param lat:
+       A numpy array of latitudes.
+    :param lon:
+       A numpy array of longidues.
+    :param dep:
+       A numpy array of depths (km).
+    :param source:
+       source instance; must have a fault.
+    :param repi:
+       A numpy array of epicentral distances (km).
+    :returns:
+       dictionary of numpy array of distances, size of lon.shape
+    """
+    fault = source._fault
+    hypo = source.getHypo()
+    distdict = dict()
+    if 'repi' in methods:
+        distdict['repi'] = repi.copy()
+    if 'rhypo' in methods:
+        distdict['rhypo'] = geodetic.distance(
+            hypo.longitude, hypo.latitude, hypo.depth, lon, lat, dep)
+
+    gc2 = fault.getGC2Frame()
+    if ('rrup' in methods) or ('rjb' in methods):
+        rfar = np.maximum(repi - gc2.total_length / 2.0, 0.0)
+        if 'rrup' in methods:
+            distdict['rrup'] = rfar
+        if 'rjb' in methods:
+            distdict['rjb'] = rfar.copy()
+
+    if ('rx' in methods) or ('ry' in methods) or \
+       ('ry0' in methods) or ('U' in methods) or ('T' in methods):
+        # GC2 of a single straight segment from the first to the last top
+        # vertex of the fault. U is scaled so that the end points have the
+        # same U as on the fault; for multi-segment faults the direction of
+        # U may be opposite to the order of the quads.
+        p0x = gc2.p0x[:1]
+        p0y = gc2.p0y[:1]
+        dx = gc2.p1x[-1] - p0x
+        dy = gc2.p1y[-1] - p0y
+        length = np.sqrt(dx * dx + dy * dy)
+        u_hat = np.column_stack((dx / length, dy / length))
+        t_hat = np.column_stack((dy / length, -dx / length))
+        sx, sy = gc2.proj(np.reshape(lon, (-1,)), np.reshape(lat, (-1,)))
+        totweight, wt, wu = _gc2_sums(sx, sy, p0x, p0y, u_hat, t_hat,
+                                      length, np.zeros(1))
+        scale = (gc2.end_length - gc2.u_offsets[0]) / length[0]
+        GC2U = (gc2.u_offsets[0] + scale * wu / totweight).reshape(lon.shape)
+        GC2T = (np.sign(scale) * wt / totweight).reshape(lon.shape)
+        distdict.update(_get_gc2_distances(gc2, GC2U, GC2T))
+    return distdict
+
+
+def _is_regular_grid(lat, lon):
+    """
+    Check whether lat/lon are a regular 2D grid, i.e., latitude is constant
+    along rows and longitude is constant along columns, with at least two
+    rows and columns.
+
+    :param lat:
+       A numpy array of latitudes.
+    :param lon:
+       A numpy array of longidues.
+    :returns:
+        Boolean.
+    """
+    if lat.ndim != 2 or lat.shape[0] < 2 or lat.shape[1] < 2:
+        return False
+    return is_meshgrid(lat, lon)
+
+
+def _get_distance_adaptive(methods, lat, lon, dep, source,
+                           use_median_distance, tolerance, **kwargs):
+    """
+    Calculate distances on a regular grid by interpolating from a coarse
+    grid, with exact calculations where the interpolation is not accurate
+    enough or near the rupture; see get_distance.
+
+    :param methods:
+        List of strings of distances to compute.
+    :param lat:
+       A 2D numpy array of latitudes.
+    :param lon:
+       A 2D numpy array of longidues.
+    :param dep:
+       A 2D numpy array of depths (km).
+    :param source:
+       source instance.
+    :param use_median_distance:
+        Boolean; see get_distance.
+    :param tolerance:
+        Relative tolerance; see get_distance.
+    :param kwargs:
+        Other options passed to get_distance for the exact calculations.
+    :returns:
+       dictionary of numpy array of distances, size of lon.shape
+    """
+    # The epicentral and hypocentral distances are cheap, so they are always
+    # computed exactly; only the fault distances are interpolated
+    exact = [m for m in methods if m in ('repi', 'rhypo')]
+    methods = [m for m in methods if m not in exact]
+    distdict = dict()
+    if len(exact):
+        distdict.update(get_distance(exact, lat, lon, dep, source,
+                                     use_median_distance, **kwargs))
+    if not len(methods):
+        return distdict
+
+    ny, nx = lon.shape
+    rows = np.unique(np.r_[np.arange(0, ny, ADAPTIVE_TILE), ny - 1])
+    cols = np.unique(np.r_[np.arange(0, nx, ADAPTIVE_TILE), nx - 1])
+
+    # Exact distances on the coarse grid, interpolated to all sites
+    ix = np.ix_(rows, cols)
+    coarse = get_distance(methods, lat[ix], lon[ix], dep[ix], source,
+                          use_median_distance, **kwargs)
+    irow, frow = _get_interp_weights(rows, ny)
+    icol, fcol = _get_interp_weights(cols, nx)
+    for key, value in coarse.items():
+        distdict[key] = _bilinear(value, irow, frow, icol, fcol)
+        distdict[key][ix] = value
+
+    # Exact distances at the centre and at the midpoints of the edges of
+    # each tile of the coarse grid; the edges are shared by adjacent tiles
+    r0 = rows[:-1]
+    r1 = rows[1:]
+    c0 = cols[:-1]
+    c1 = cols[1:]
+    rmid = (r0 + r1) // 2
+    cmid = (c0 + c1) // 2
+    cix = np.ix_(rmid, cmid)
+    checks = [cix, np.ix_(rows, cmid), np.ix_(rmid, cols)]
+    clat = np.concatenate([lat[idx].ravel() for idx in checks])
+    clon = np.concatenate([lon[idx].ravel() for idx in checks])
+    cdep = np.concatenate([dep[idx].ravel() for idx in checks])
+    check = get_distance(methods, clat, clon, cdep, source,
+                         use_median_distance, **kwargs)
+    bad = np.zeros(clon.shape, dtype=bool)
+    for method in methods:
+        allowed = ADAPTIVE_CHECK_FACTOR * tolerance * \
+            np.maximum(np.abs(check[method]), ADAPTIVE_MIN_DISTANCE)
+        interp = np.concatenate([distdict[method][idx].ravel()
+                                 for idx in checks])
+        bad |= ~(np.abs(interp - check[method]) <= allowed)
+
+    # A tile is refined if the check fails at its centre or on any edge
+    nr = len(r0)
+    nc = len(c0)
+    bad_centre = bad[:nr * nc].reshape((nr, nc))
+    bad_rows = bad[nr * nc:nr * nc + (nr + 1) * nc].reshape((nr + 1, nc))
+    bad_cols = bad[nr * nc + (nr + 1) * nc:].reshape((nr, nc + 1))
+    refine = (bad_centre | bad_rows[:-1] | bad_rows[1:] |
+              bad_cols[:, :-1] | bad_cols[:, 1:])
+
+    # Tiles near the rupture are always exact. The lower bound on the
+    # distance from the tile centre to the rupture (its surface projection,
+    # using the quad bounding spheres) is compared to the tile diagonal.
+    fault = source._fault
+    if fault is not None:
+        lower = _get_rjb_lower_bound(fault, lat[cix], lon[cix])
+    else:
+        hypo = source.getHypo()
+        lower = geodetic.distance(hypo.longitude, hypo.latitude, 0.0,
+                                  lon[cix], lat[cix], dep[cix])
+    diag = geodetic.distance(lon[np.ix_(r0, c0)], lat[np.ix_(r0, c0)], 0.0,
+                             lon[np.ix_(r1, c1)], lat[np.ix_(r1, c1)], 0.0)
+    refine |= lower < ADAPTIVE_NEAR_DISTANCE + diag
+
+    istart = 0
+    for idx in checks:
+        iend = istart + lon[idx].size
+        for key, value in check.items():
+            distdict[key][idx] = value[istart:iend].reshape(lon[idx].shape)
+        istart = iend
+
+    mask = np.zeros((ny, nx), dtype=bool)
+    for i, j in zip(*np.nonzero(refine)):
+        mask[r0[i]:r1[i] + 1, c0[j]:c1[j] + 1] = True
+    if np.any(mask):
+        fine = get_distance(methods, lat[mask], lon[mask], dep[mask], source,
+                            use_median_distance, **kwargs)
+        for key, value in fine.items():
+            distdict[key][mask] = value
+    return distdict
+
+
+def _get_interp_weights(nodes, n):
+    """
+    Indices and weights for linear interpolation from nodes to 0..n-1.
+
+    :param nodes:
+        Sorted numpy array of node indices, starting at 0 and ending at n-1.
+    :param n:
+        Number of points.
+    :returns:
+        Tuple of the index of the node before each point and the fractional
+        distance of each point to the next node.
+    """
+    idx = np.arange(n)
+    i = np.clip(np.searchsorted(nodes, idx, side='right') - 1, 0,
+                len(nodes) - 2)
+    f = (idx - nodes[i]) / (nodes[i + 1] - nodes[i])
+    return i, f
+
+
+def _bilinear(values, irow, frow, icol, fcol):
+    """
+    Bilinear interpolation of a coarse grid (see _get_interp_weights).
+
+    :param values:
+        2D numpy array of values on the coarse grid.
+    :param irow:
+        Coarse row index before each row.
+    :param frow:
+        Fractional distance of each row to the next coarse row.
+    :param icol:
+        Coarse column index before each column.
+    :param fcol:
+        Fractional distance of each column to the next coarse column.
+    :returns:
+        2D numpy array of interpolated values.
+    """
+    frow = frow[:, np.newaxis]
+    fcol = fcol[np.newaxis, :]
+    v00 = values[np.ix_(irow, icol)]
+    v01 = values[np.ix_(irow, icol + 1)]
+    v10 = values[np.ix_(irow + 1, icol)]
+    v11 = values[np.ix_(irow + 1, icol + 1)]
+    return ((1 - frow) * ((1 - fcol) * v00 + fcol * v01) +
+            frow * ((1 - fcol) * v10 + fcol * v11))
+
+
+def _get_distance_parallel(methods, lat, lon, dep, source,
+                           use_median_distance, block_size, chunk_size,
+                           n_workers, cloud=None):
+    """
+    Calculate distances for tiles of sites in a process pool; see
+    get_distance.
+
+    :param methods:
+        List of strings of distances to compute.
+    :param lat:
+       A numpy array of latitudes.
+    :param lon:
+       A numpy array of longidues.
+    :param dep:
+       A numpy array of depths (km).
+    :param source:
+       source instance.
+    :param use_median_distance:
+        Boolean; see get_distance.
+    :param block_size:
+        Maximum number of quad/site pairs evaluated at one time.
+    :param chunk_size:
+        Number of sites per tile, or None.
+    :param n_workers:
+        Number of worker processes.
+    :param cloud:
+        FaultPointCloud object for approximate Rrup and Rjb, or None.
+    :returns:
+       dictionary of numpy array of distances, size of lon.shape
+    :raises ShakeMapException:
+        if the parallel mode is not available (see check_parallel).
+    """
+    check_parallel()
+    oldshape = lon.shape
+    nsites = lon.size
+    if chunk_size is None:
+        chunk_size = int(np.ceil(nsites / (n_workers * TILES_PER_WORKER)))
+    tiles = get_tiles(nsites, chunk_size)
+
+    # Set up the GC2 frame before the source is sent to the workers
+    if source._fault is not None:
+        source._fault.getGC2Frame()
+
+    sites = SharedArray((3, nsites), np.float64)
+    outputs = {}
+    try:
+        sites.array[0] = np.reshape(lat, (-1,))
+        sites.array[1] = np.reshape(lon, (-1,))
+        sites.array[2] = np.reshape(dep, (-1,))
+
+        # The first tile is done here to find out what the outputs are
+        istart, iend = tiles[0]
+        ddict = _get_distance(methods, sites.array[0, istart:iend],
+                              sites.array[1, istart:iend],
+                              sites.array[2, istart:iend], source,
+                              use_median_distance, block_size, cloud=cloud)
+        for key, value in ddict.items():
+            outputs[key] = SharedArray((nsites,), value.dtype)
+            outputs[key].array[istart:iend] = value
+
+        if len(tiles) > 1:
+            specs = dict((key, out.getSpec()) for key, out in outputs.items())
+            initargs = (methods, source, use_median_distance, block_size,
+                        sites.getSpec(), specs, cloud)
+            with ProcessPoolExecutor(max_workers=n_workers,
+                                     initializer=_init_distance_worker,
+                                     initargs=initargs) as pool:
+                list(pool.map(_distance_worker, tiles[1:]))
+
+        distdict = dict((key, out.array.reshape(oldshape).copy())
+                        for key, out in outputs.items())
+    finally:
+        sites.close()
+        for out in outputs.values():
+            out.close()
+    return distdict
+
+
+def _init_distance_worker(methods, source, use_median_distance, block_size,
+                          sites_spec, output_specs, cloud):
+    """
+    Initialize a distance worker process; the source and the shared arrays
+    are set up once per worker rather than once per tile.
+    """
+    _WORKER['methods'] = methods
+    _WORKER['source'] = source
+    _WORKER['use_median_distance'] = use_median_distance
+    _WORKER['block_size'] = block_size
+    _WORKER['cloud'] = cloud
+    _WORKER['sites'] = SharedArray.fromSpec(sites_spec)
+    _WORKER['outputs'] = dict((key, SharedArray.fromSpec(spec))
+                              for key, spec in output_specs.items())
+
+
+def _distance_worker(tile):
+    """
+    Compute the distances for one tile of sites in a worker process and
+    write them into the shared output arrays.
+
+    :param tile:
+        Tuple of (start, end) indices of the sites.
+    """
+    istart, iend = tile
+    sites = _WORKER['sites'].array
+    ddict = _get_distance(_WORKER['methods'], sites[0, istart:iend],
+                          sites[1, istart:iend], sites[2, istart:iend],
+                          _WORKER['source'], _WORKER['use_median_distance'],
+                          _WORKER['block_size'], cloud=_WORKER['cloud'])
+    for key, value in ddict.items():
+        _WORKER['outputs'][key].array[istart:iend] = value
+
+
+def _get_distance(methods, lat, lon, dep, source, use_median_distance,
+                  block_size, cloud=None):
+    """
+    Calculate distances for one block of sites; see get_distance.
+
+    :param methods:
+        List of strings of distances to compute.
+    :param lat:
+       A numpy array of latitudes.
+    :param lon:
+       A numpy array of longidues.
+    :param dep:
+       A numpy array of depths (km).
+    :param source:
+       source instance.
+    :param use_median_distance:
+        Boolean; see get_distance.
+    :param block_size:
+        Maximum number of quad/site pairs evaluated at one time in the Rrup,
+        Rjb and GC2 calculations.
+    :param cloud:
+        FaultPointCloud object; if given, Rrup and Rjb are approximated
+        with it (see get_distance).
+    :returns:
+       dictionary of numpy array of distances, size of lon.shape
+    """
+    # Use the source's own fault (rather than a copy) so that quantities
+    # cached on the fault are shared between calls
+    fault = source._fault
+    hypo = source.getHypo()
+
+    # Dictionary for holding the distances
+    distdict = dict()
+
     oldshape = lon.shape
 
     if len(oldshape) == 2:
@@ -251,23 +966,24 @@ def get_distance(methods, lat, lon, dep, source,
         newshape = (oldshape[0], 1)
 
     if ('rrup' in methods) or ('rjb' in methods):
-        x, y, z = latlon2ecef(lat, lon, dep)
-        x.shape = newshape
-        y.shape = newshape
-        z.shape = newshape
-        sites_ecef = np.hstack((x, y, z))
+        # Regular grids (e.g., from Distance.fromSites) are converted with
+        # the separable grid conversion
+        x, y, z = latlon2ecef_mesh(lat, lon, dep)
+        sites_ecef = np.column_stack((np.reshape(x, (-1,)),
+                                      np.reshape(y, (-1,)),
+                                      np.reshape(z, (-1,))))
 
     # ---------------------------------------------
     # Distances that do not require loop over quads
     # ---------------------------------------------
 
     if ('repi' in methods) or \
-       (('rjb' in methods) and (quadlist is None)) or \
-       (('rrup' in methods) and (quadlist is None)) or \
-       (('ry0' in methods) and (quadlist is None)) or \
-       (('rx' in methods) and (quadlist is None)) or \
-       (('T' in methods) and (quadlist is None)) or \
-       (('U' in methods) and (quadlist is None)):
+       (('rjb' in methods) and (fault is None)) or \
+       (('rrup' in methods) and (fault is None)) or \
+       (('ry0' in methods) and (fault is None)) or \
+       (('rx' in methods) and (fault is None)) or \
+       (('T' in methods) and (fault is None)) or \
+       (('U' in methods) and (fault is None)):
         if hypo is None:
             raise ShakeMapException('Cannot calculate epicentral distance '
                                     'without a point object')
@@ -277,7 +993,7 @@ def get_distance(methods, lat, lon, dep, source,
         distdict['repi'] = repidist
 
     if ('rhypo' in methods) or \
-       (('rrup' in methods) and (quadlist is None)):
+       (('rrup' in methods) and (fault is None)):
         if hypo is None:
             raise ShakeMapException('Cannot calculate epicentral distance '
                                     'without a point object')
@@ -286,194 +1002,50 @@ def get_distance(methods, lat, lon, dep, source,
         rhypodist = rhypodist.reshape(oldshape)
         distdict['rhypo'] = rhypodist
 
-    # --------------------------------------------------------
-    # Loop over quadlist for those distances that require loop
-    # --------------------------------------------------------
-    if 'rrup' in methods:
-        minrrup = np.ones(newshape, dtype=lon.dtype) * 1e16
-    if 'rjb' in methods:
-        minrjb = np.ones(newshape, dtype=lon.dtype) * 1e16
-    if ('rx' in methods) or ('ry' in methods) or \
-       ('ry0' in methods) or ('U' in methods) or ('T' in methods):
-        totweight = np.zeros(newshape, dtype=lon.dtype)
-        GC2T = np.zeros(newshape, dtype=lon.dtype)
-        GC2U = np.zeros(newshape, dtype=lon.dtype)
-
-        if quadlist is not None:
-            # For these distances, we need to sort out strike discordance and nominal
-            # strike prior to starting the loop if there are more than one
-            # segments
-            segind = fault._getSegmentIndex()
-            segindnp = np.array(segind)
-            uind = np.unique(segind)
-            nseg = len(uind)
-            if nseg > 1:
-                quadlist = fault.getQuadrilaterals()
-                # Need to get index of first and last quad
-                # for each segment
-                iq0 = np.zeros(nseg, dtype='int16')
-                iq1 = np.zeros(nseg, dtype='int16')
-                for k in uind:
-                    ii = [i for i, j in enumerate(segind) if j == uind[k]]
-                    iq0[k] = int(np.min(ii))
-                    iq1[k] = int(np.max(ii))
-
-                it_seg = it.product(it.combinations(uind, 2),
-                                    it.product([0, 1], [0, 1]))
-                dist_save = 0
-                for k in it_seg:
-                    s0ind = k[0][0]
-                    s1ind = k[0][1]
-                    p0ind = k[1][0]
-                    p1ind = k[1][1]
-                    if p0ind == 0:
-                        P0 = quadlist[iq0[s0ind]][0]
-                    else:
-                        P0 = quadlist[iq1[s0ind]][1]
-                    if p1ind == 0:
-                        P1 = quadlist[iq1[s1ind]][0]
-                    else:
-                        P1 = quadlist[iq0[s1ind]][1]
-
-                    dist = geodetic.distance(P0.longitude, P0.latitude, 0.0,
-                                             P1.longitude, P1.latitude, 0.0)
-                    if dist > dist_save:
-                        dist_save = dist
-                        A0 = P0
-                        A1 = P1
-
-                A0.depth = 0
-                A1.depth = 0
-                p_origin = Vector.fromPoint(A0)
-                a0 = Vector.fromPoint(A0)
-                a1 = Vector.fromPoint(A1)
-                ahat = (a1 - a0).norm()
-                # Loop over traces
-                e_j = np.zeros(nseg)
-                b_prime = [None] * nseg
-                for j in range(nseg):
-                    P0 = quadlist[iq0[j]][0]
-                    P1 = quadlist[iq1[j]][1]
-                    P0.depth = 0
-                    P1.depth = 0
-                    p0 = Vector.fromPoint(P0)
-                    p1 = Vector.fromPoint(P1)
-                    b_prime[j] = p1 - p0
-                    e_j[j] = ahat.dot(b_prime[j])
-                E = np.sum(e_j)
-                # List of discordancy
-                dc = [np.sign(a) * np.sign(E) for a in e_j]
-                b = Vector(0, 0, 0)
-                for j in range(nseg):
-                    b.x = b.x + b_prime[j].x * dc[j]
-                    b.y = b.y + b_prime[j].y * dc[j]
-                    b.z = b.z + b_prime[j].z * dc[j]
-                    bhat = b.norm()
-
-    if quadlist is not None:
-        # Length of prior segments
-        s_i = 0.0
-        l_i = np.zeros(len(quadlist))
-        for i in range(len(quadlist)):
-            P0, P1, P2, P3 = quadlist[i]
-
-            if 'rrup' in methods:
-                rrupdist = _calc_rupture_distance(P0, P1, P2, P3, sites_ecef)
-                minrrup = np.minimum(minrrup, rrupdist)
-
-            if 'rjb' in methods:
-                S0 = copy.deepcopy(P0)
-                S1 = copy.deepcopy(P1)
-                S2 = copy.deepcopy(P2)
-                S3 = copy.deepcopy(P3)
-                S0.depth = 0.0
-                S1.depth = 0.0
-                S2.depth = 0.0
-                S3.depth = 0.0
-                rjbdist = _calc_rupture_distance(S0, S1, S2, S3, sites_ecef)
-                minrjb = np.minimum(minrjb, rjbdist)
-
-            if ('rx' in methods) or ('ry' in methods) or \
-               ('ry0' in methods) or ('U' in methods) or ('T' in methods):
-                # Rx, Ry, and Ry0 are all computed if one is requested since
-                # they all require similar information for the weights. This
-                # isn't necessary for a single segment fault though.
-                # Note, we are basing these calculations on GC2 coordinates U
-                # and T as described in:
-                # Spudich and Chiou (2015)
-                # http://dx.doi.org/10.3133/ofr20151028.
-
-                # Compute u_i and t_i for this segment
-                t_i = __calc_t_i(P0, P1, lat, lon)
-                u_i = __calc_u_i(P0, P1, lat, lon)
-
-                # Quad length
-                l_i[i] = get_quad_length(quadlist[i])
-
-                # Weight of segment, three cases
-                # Case 3: t_i == 0 and 0 <= u_i <= l_i
-                w_i = np.zeros_like(t_i)
-                # Case 1:
-                ix = t_i != 0
-                w_i[ix] = (1.0 / t_i[ix]) * (np.arctan((l_i[i] -
-                                                        u_i[ix]) / t_i[ix]) - np.arctan(-u_i[ix] / t_i[ix]))
-                # Case 2:
-                ix = (t_i == 0) & ((u_i < 0) | (u_i > l_i[i]))
-                w_i[ix] = 1 / (u_i[ix] - l_i[i]) - 1 / u_i[ix]
-
-                totweight = totweight + w_i
-                GC2T = GC2T + w_i * t_i
-                if nseg == 1:
-                    GC2U = GC2U + w_i * (u_i + s_i)
-                else:
-                    if i == 0:
-                        qind = np.array(range(len(quadlist)))
-                        l_kj = 0
-                        s_ij_1 = 0
-                    else:
-                        l_kj = l_i[(segindnp == segindnp[i]) & (qind < i)]
-                        s_ij_1 = np.sum(l_kj)
-
-                    p1 = Vector.fromPoint(quadlist[iq0[segind[i]]][0])
-                    s_ij_2 = ((p1 - p_origin) *
-                              dc[segind[i]]).dot(bhat) / 1000.0
-                    s_ij = s_ij_1 + s_ij_2
-                    GC2U = GC2U + w_i * (u_i + s_ij)
-                s_i = s_i + l_i[i]
-
-        # Collect distances from loop into the distance dict
+    # ----------------------------------------
+    # Distances that require the fault surface
+    # ----------------------------------------
+    if fault is not None:
+        # Rrup and Rjb are computed for all quads at once
+        if 'rrup' in methods:
+            quads_ecef = fault.getQuadsECEF()
+            if cloud is None:
+                minrrup = _calc_min_rupture_distance(quads_ecef, sites_ecef,
+                                                     block_size=block_size)
+            else:
+                minrrup = cloud.getDistance(quads_ecef, sites_ecef,
+                                            block_size=block_size)
+            minrrup.shape = newshape
+
         if 'rjb' in methods:
-            minrjb = minrjb.reshape(oldshape)
-            distdict['rjb'] = minrjb
+            quads_ecef = fault.getQuadsECEF(surface=True)
+            if cloud is None:
+                minrjb = _calc_min_rupture_distance(quads_ecef, sites_ecef,
+                                                    block_size=block_size)
+            else:
+                minrjb = cloud.getDistance(quads_ecef, sites_ecef,
+                                           surface=True,
+                                           block_size=block_size)
+            minrjb.shape = newshape
 
         if ('rx' in methods) or ('ry' in methods) or \
            ('ry0' in methods) or ('U' in methods) or ('T' in methods):
-            # Normalize by sum of quad weights
-            GC2T = GC2T / totweight
-            GC2U = GC2U / totweight
-            distdict['T'] = copy.deepcopy(GC2T).reshape(oldshape)
-            distdict['U'] = copy.deepcopy(GC2U).reshape(oldshape)
-
-            # Take care of Rx
-            Rx = copy.deepcopy(GC2T)  # preserve sign (no absolute value)
-            Rx = Rx.reshape(oldshape)
-            distdict['rx'] = Rx
-
-            # Ry
-            Ry = GC2U - s_i / 2.0
-            Ry = Ry.reshape(oldshape)
-            distdict['ry'] = Ry
-
-            # Ry0
-            Ry0 = np.zeros_like(GC2U)
-            ix = GC2U < 0
-            Ry0[ix] = np.abs(GC2U[ix])
-            if nseg > 1:
-                s_i = s_ij + l_i[-1]
-            ix = GC2U > s_i
-            Ry0[ix] = GC2U[ix] - s_i
-            Ry0 = Ry0.reshape(oldshape)
-            distdict['ry0'] = Ry0
+            # Rx, Ry, and Ry0 are all computed if one is requested since
+            # they all require similar information for the weights.
+            # Note, we are basing these calculations on GC2 coordinates U
+            # and T as described in:
+            # Spudich and Chiou (2015)
+            # http://dx.doi.org/10.3133/ofr20151028.
+            # The strike discordance and nominal strike only depend on the
+            # fault so they are cached on it.
+            gc2 = fault.getGC2Frame()
+            GC2U, GC2T = _calc_gc2(gc2, lat, lon, block_size=block_size)
+            GC2U.shape = oldshape
+            GC2T.shape = oldshape
+            distdict.update(_get_gc2_distances(gc2, GC2U, GC2T))
+
+        if 'rjb' in methods:
+            distdict['rjb'] = minrjb.reshape(oldshape)
 
         if 'rrup' in methods:
             minrrup = minrrup.reshape(oldshape)
@@ -484,102 +1056,14 @@ def get_distance(methods, lat, lon, dep, source,
             if use_median_distance:
                 warnings.warn(
                     'No fault; Replacing rjb with median rjb given M and repi.')
-                cdir, tmp = os.path.split(__file__)
-
-                # -------------------
-                # Sort out file names
-                # -------------------
                 mech = source.getEventParam('mech')
-                if not hasattr(source, '_tectonic_region'):
-                    rf = os.path.join(
-                        cdir, "data", "ps2ff", "Rjb_WC94_mechA_ar1p0_seis0_20_Ratios.csv")
-                    vf = os.path.join(
-                        cdir, "data", "ps2ff", "Rjb_WC94_mechA_ar1p0_seis0_20_Var.csv")
-                elif source._tectonic_region == 'Active Shallow Crust':
-                    if mech == 'ALL':
-                        rf = os.path.join(
-                            cdir, "data", "ps2ff", "Rjb_WC94_mechA_ar1p7_seis0_20_Ratios.csv")
-                        vf = os.path.join(
-                            cdir, "data", "ps2ff", "Rjb_WC94_mechA_ar1p7_seis0_20_Var.csv")
-                    elif mech == 'RS':
-                        rf = os.path.join(
-                            cdir, "data", "ps2ff", "Rjb_WC94_mechR_ar1p7_seis0_20_Ratios.csv")
-                        vf = os.path.join(
-                            cdir, "data", "ps2ff", "Rjb_WC94_mechR_ar1p7_seis0_20_Var.csv")
-                    elif mech == 'NM':
-                        rf = os.path.join(
-                            cdir, "data", "ps2ff", "Rjb_WC94_mechN_ar1p7_seis0_20_Ratios.csv")
-                        vf = os.path.join(
-                            cdir, "data", "ps2ff", "Rjb_WC94_mechN_ar1p7_seis0_20_Var.csv")
-                    elif mech == 'SS':
-                        rf = os.path.join(
-                            cdir, "data", "ps2ff", "Rjb_WC94_mechSS_ar1p7_seis0_20_Ratios.csv")
-                        vf = os.path.join(
-                            cdir, "data", "ps2ff", "Rjb_WC94_mechSS_ar1p7_seis0_20_Var.csv")
-                elif source._tectonic_region == 'Stable Shallow Crust':
-                    if mech == 'ALL':
-                        rf = os.path.join(
-                            cdir, "data", "ps2ff", "Rjb_S14_mechA_ar1p0_seis0_15_Ratios.csv")
-                        vf = os.path.join(
-                            cdir, "data", "ps2ff", "Rjb_S14_mechA_ar1p0_seis0_15_Var.csv")
-                    elif mech == 'RS':
-                        rf = os.path.join(
-                            cdir, "data", "ps2ff", "Rjb_S14_mechR_ar1p0_seis0_15_Ratios.csv")
-                        vf = os.path.join(
-                            cdir, "data", "ps2ff", "Rjb_S14_mechR_ar1p0_seis0_15_Var.csv")
-                    elif mech == 'NM':
-                        rf = os.path.join(
-                            cdir, "data", "ps2ff", "Rjb_S14_mechN_ar1p0_seis0_15_Ratios.csv")
-                        vf = os.path.join(
-                            cdir, "data", "ps2ff", "Rjb_S14_mechN_ar1p0_seis0_15_Var.csv")
-                    elif mech == 'SS':
-                        rf = os.path.join(
-                            cdir, "data", "ps2ff", "Rjb_S14_mechSS_ar1p0_seis0_15_Ratios.csv")
-                        vf = os.path.join(
-                            cdir, "data", "ps2ff", "Rjb_S14_mechSS_ar1p0_seis0_15_Var.csv")
-                else:
-                    warnings.warn(
-                        'Unsupported tectonic region; using coefficients for unknown'
-                        'tectonic region.')
-                    rf = os.path.join(
-                        cdir, "data", "ps2ff", "Rjb_WC94_mechA_ar1p0_seis0_20_Ratios.csv")
-                    vf = os.path.join(
-                        cdir, "data", "ps2ff", "Rjb_WC94_mechA_ar1p0_seis0_20_Var.csv")
-
-                # -----------------
-                # Start with ratios
-                # -----------------
-                repi2rjb_ratios_tbl = pd.read_csv(rf, comment='#')
-                r2rrt_cols = repi2rjb_ratios_tbl.columns[1:]
-                mag_list = []
-                for column in (r2rrt_cols):
-                    if re.search('R\d+\.*\d*', column):
-                        magnitude = float(re.findall(
-                            'R(\d+\.*\d*)', column)[0])
-                        mag_list.append(magnitude)
-                mag_list = np.array(mag_list)
-                dist_list = np.log(np.array(repi2rjb_ratios_tbl['Repi_km']))
-                repi2rjb_grid = repi2rjb_ratios_tbl.values[:, 1:]
-                repi2rjb_obj = spint.RectBivariateSpline(
-                    dist_list, mag_list, repi2rjb_grid, kx=1, ky=1)
-
-                def repi2rjb_tbl(repi, M):
-                    ratio = repi2rjb_obj.ev(np.log(repi), M)
-                    rjb = repi * ratio
-                    return rjb
+                region = getattr(source, '_tectonic_region', None)
+                ratio_obj, var_obj = get_ps2ff_interpolators(
+                    'Rjb', region, mech)
                 repis = distdict['repi']
                 mags = np.ones_like(repis) * source.getEventParam('mag')
-                rjb_hat = repi2rjb_tbl(repis, mags)
-                distdict['rjb'] = rjb_hat
-                # -------------------
-                # Additional Variance
-                # -------------------
-                repi2rjbvar_ratios_tbl = pd.read_csv(vf, comment='#')
-                repi2rjbvar_grid = repi2rjbvar_ratios_tbl.values[:, 1:]
-                repi2rjbvar_obj = spint.RectBivariateSpline(
-                    dist_list, mag_list, repi2rjbvar_grid, kx=1, ky=1)
-                rjbvar = repi2rjbvar_obj.ev(np.log(repis), mags)
-                distdict['rjbvar'] = rjbvar
+                distdict['rjb'] = repis * ratio_obj.ev(np.log(repis), mags)
+                distdict['rjbvar'] = var_obj.ev(np.log(repis), mags)
             else:
                 warnings.warn('No fault; Replacing rjb with repi')
                 distdict['rjb'] = distdict['repi']
@@ -587,104 +1071,15 @@ def get_distance(methods, lat, lon, dep, source,
             if use_median_distance:
                 warnings.warn(
                     'No fault; Replacing rrup with median rrup given M and repi.')
-                cdir, tmp = os.path.split(__file__)
-
-                # -------------------
-                # Sort out file names
-                # -------------------
                 rake = source._event_dict.get('rake')
                 mech = rake_to_mech(rake)
-                if not hasattr(source, '_tectonic_region'):
-                    rf = os.path.join(
-                        cdir, "data", "ps2ff", "Rrup_WC94_mechA_ar1p0_seis0-20_Ratios.csv")
-                    vf = os.path.join(
-                        cdir, "data", "ps2ff", "Rrup_WC94_mechA_ar1p0_seis0-20_Var.csv")
-                elif source._tectonic_region == 'Active Shallow Crust':
-                    if mech == 'ALL':
-                        rf = os.path.join(
-                            cdir, "data", "ps2ff", "Rrup_WC94_mechA_ar1p7_seis0-20_Ratios.csv")
-                        vf = os.path.join(
-                            cdir, "data", "ps2ff", "Rrup_WC94_mechA_ar1p7_seis0-20_Var.csv")
-                    elif mech == 'RS':
-                        rf = os.path.join(
-                            cdir, "data", "ps2ff", "Rrup_WC94_mechR_ar1p7_seis0-20_Ratios.csv")
-                        vf = os.path.join(
-                            cdir, "data", "ps2ff", "Rrup_WC94_mechR_ar1p7_seis0-20_Var.csv")
-                    elif mech == 'NM':
-                        rf = os.path.join(
-                            cdir, "data", "ps2ff", "Rrup_WC94_mechN_ar1p7_seis0-20_Ratios.csv")
-                        vf = os.path.join(
-                            cdir, "data", "ps2ff", "Rrup_WC94_mechN_ar1p7_seis0-20_Var.csv")
-                    elif mech == 'SS':
-                        rf = os.path.join(
-                            cdir, "data", "ps2ff", "Rrup_WC94_mechSS_ar1p7_seis0-20_Ratios.csv")
-                        vf = os.path.join(
-                            cdir, "data", "ps2ff", "Rrup_WC94_mechSS_ar1p7_seis0-20_Var.csv")
-                elif source._tectonic_region == 'Stable Shallow Crust':
-                    if mech == 'ALL':
-                        rf = os.path.join(
-                            cdir, "data", "ps2ff", "Rrup_S14_mechA_ar1p0_seis0-15_Ratios.csv")
-                        vf = os.path.join(
-                            cdir, "data", "ps2ff", "Rrup_S14_mechA_ar1p0_seis0-15_Var.csv")
-                    elif mech == 'RS':
-                        rf = os.path.join(
-                            cdir, "data", "ps2ff", "Rrup_S14_mechR_ar1p0_seis0-15_Ratios.csv")
-                        vf = os.path.join(
-                            cdir, "data", "ps2ff", "Rrup_S14_mechR_ar1p0_seis0-15_Var.csv")
-                    elif mech == 'NM':
-                        rf = os.path.join(
-                            cdir, "data", "ps2ff", "Rrup_S14_mechN_ar1p0_seis0-15_Ratios.csv")
-                        vf = os.path.join(
-                            cdir, "data", "ps2ff", "Rrup_S14_mechN_ar1p0_seis0-15_Var.csv")
-                    elif mech == 'SS':
-                        rf = os.path.join(
-                            cdir, "data", "ps2ff", "Rrup_S14_mechSS_ar1p0_seis0-15_Ratios.csv")
-                        vf = os.path.join(
-                            cdir, "data", "ps2ff", "Rrup_S14_mechSS_ar1p0_seis0-15_Var.csv")
-                else:
-                    warnings.warn(
-                        'Unsupported tectonic region; using coefficients for unknown'
-                        'tectonic region.')
-                    rf = os.path.join(
-                        cdir, "data", "ps2ff", "Rrup_WC94_mechA_ar1p0_seis0-20_Ratios.csv")
-                    vf = os.path.join(
-                        cdir, "data", "ps2ff", "Rrup_WC94_mechA_ar1p0_seis0-20_Var.csv")
-
-                # -----------------
-                # Start with ratios
-                # -----------------
-                repi2rrup_ratios_tbl = pd.read_csv(rf, comment='#')
-                r2rrt_cols = repi2rrup_ratios_tbl.columns[1:]
-                mag_list = []
-                for column in (r2rrt_cols):
-                    if re.search('R\d+\.*\d*', column):
-                        magnitude = float(re.findall(
-                            'R(\d+\.*\d*)', column)[0])
-                        mag_list.append(magnitude)
-                mag_list = np.array(mag_list)
-                dist_list = np.log(np.array(repi2rrup_ratios_tbl['Repi_km']))
-                repi2rrup_grid = repi2rrup_ratios_tbl.values[:, 1:]
-                repi2rrup_obj = spint.RectBivariateSpline(
-                    dist_list, mag_list, repi2rrup_grid, kx=1, ky=1)
-
-                def repi2rrup_tbl(repi, M):
-                    ratio = repi2rrup_obj.ev(np.log(repi), M)
-                    rrup = repi * ratio
-                    return rrup
+                region = getattr(source, '_tectonic_region', None)
+                ratio_obj, var_obj = get_ps2ff_interpolators(
+                    'Rrup', region, mech)
                 repis = distdict['repi']
                 mags = np.ones_like(repis) * source.getEventParam('mag')
-                rrup_hat = repi2rrup_tbl(repis, mags)
-                distdict['rrup'] = rrup_hat
-
-                # -------------------
-                # Additional Variance
-                # -------------------
-                repi2rrupvar_ratios_tbl = pd.read_csv(vf, comment='#')
-                repi2rrupvar_grid = repi2rrupvar_ratios_tbl.values[:, 1:]
-                repi2rrupvar_obj = spint.RectBivariateSpline(
-                    dist_list, mag_list, repi2rrupvar_grid, kx=1, ky=1)
-                rrupvar = repi2rrupvar_obj.ev(np.log(repis), mags)
-                distdict['rrupvar'] = rrupvar
+                distdict['rrup'] = repis * ratio_obj.ev(np.log(repis), mags)
+                distdict['rrupvar'] = var_obj.ev(np.log(repis), mags)
             else:
                 warnings.warn('No fault; Replacing rrup with rhypo')
                 distdict['rrup'] = distdict['rhypo']
@@ -701,14 +1096,488 @@ def get_distance(methods, lat, lon, dep, source,
     return distdict
 
 
+def _get_gc2_distances(gc2, GC2U, GC2T):
+    """
+    Get Rx, Ry, and Ry0 from the GC2 coordinates U and T.
+
+    :param gc2:
+        GC2Frame object of the fault.
+    :param GC2U:
+        Numpy array of U (km).
+    :param GC2T:
+        Numpy array of T (km).
+    :returns:
+        Dictionary of numpy arrays of T, U, rx, ry, and ry0.
+    """
+    distdict = {'T': GC2T, 'U': GC2U}
+
+    # Take care of Rx
+    distdict['rx'] = GC2T.copy()  # preserve sign (no absolute value)
+
+    # Ry
+    distdict['ry'] = GC2U - gc2.total_length / 2.0
+
+    # Ry0
+    Ry0 = np.zeros_like(GC2U)
+    ix = GC2U < 0
+    Ry0[ix] = np.abs(GC2U[ix])
+    ix = GC2U > gc2.end_length
+    Ry0[ix] = GC2U[ix] - gc2.end_length
+    distdict['ry0'] = Ry0
+    return distdict
+
+
+def get_ps2ff_interpolators(kind, region, mech):
+    """
+    Get the interpolators for the ps2ff Repi to Rjb/Rrup ratio and variance
+    tables. The tables are read and the interpolators are built only once per
+    process; later calls with the same arguments return the cached objects.
+
+    :param kind:
+        Either 'Rjb' or 'Rrup'.
+    :param region:
+        Tectonic region (e.g., 'Active Shallow Crust'), or None if the source
+        does not have one.
+    :param mech:
+        Mechanism; one of 'ALL', 'RS', 'NM', or 'SS'.
+    :returns:
+        Tuple of two scipy RectBivariateSpline objects (ratio, variance); the
+        first argument of their ev() method is ln(Repi) and the second is
+        magnitude.
+    """
+    key = (region, mech, kind)
+    if key not in _PS2FF_CACHE:
+        name = _get_ps2ff_table_name(kind, region, mech)
+        dist_list, mag_list, ratios, var = _read_ps2ff_table(name)
+        ratio_obj = spint.RectBivariateSpline(
+            dist_list, mag_list, ratios, kx=1, ky=1)
+        var_obj = spint.RectBivariateSpline(
+            dist_list, mag_list, var, kx=1, ky=1)
+        _PS2FF_CACHE[key] = (ratio_obj, var_obj)
+    return _PS2FF_CACHE[key]
+
+
+def _get_ps2ff_table_name(kind, region, mech):
+    """
+    Sort out the base name of the ps2ff table files for a given tectonic
+    region and mechanism.
+
+    :param kind:
+        Either 'Rjb' or 'Rrup'.
+    :param region:
+        Tectonic region, or None.
+    :param mech:
+        Mechanism; one of 'ALL', 'RS', 'NM', or 'SS'.
+    :returns:
+        Base name of the table; the ratio and variance files are this name
+        with '_Ratios.csv' and '_Var.csv' appended.
+    """
+    # The Rjb and Rrup tables use slightly different seismogenic depth labels
+    sep = '_' if kind == 'Rjb' else '-'
+    mechs = {'ALL': 'A', 'RS': 'R', 'NM': 'N', 'SS': 'SS'}
+    if region is None:
+        return '%s_WC94_mechA_ar1p0_seis0%s20' % (kind, sep)
+    if region == 'Active Shallow Crust':
+        model, ar, depth = 'WC94', '1p7', '20'
+    elif region == 'Stable Shallow Crust':
+        model, ar, depth = 'S14', '1p0', '15'
+    else:
+        warnings.warn(
+            'Unsupported tectonic region; using coefficients for unknown'
+            'tectonic region.')
+        return '%s_WC94_mechA_ar1p0_seis0%s20' % (kind, sep)
+    if mech not in mechs:
+        raise ShakeMapException('Unsupported mechanism %s' % mech)
+    return '%s_%s_mech%s_ar%s_seis0%s%s' % (
+        kind, model, mechs[mech], ar, sep, depth)
+
+
+def _read_ps2ff_table(name):
+    """
+    Read a ps2ff ratio table and its variance table, from the precompiled
+    npz file if it exists (see write_ps2ff_npz), otherwise from the csv files.
+
+    :param name:
+        Base name of the table (see _get_ps2ff_table_name).
+    :returns:
+        Tuple of ln(Repi) values, magnitudes, ratio grid and variance grid.
+    """
+    global _PS2FF_NPZ
+    if _PS2FF_NPZ is None and os.path.isfile(PS2FF_NPZ_FILE):
+        with np.load(PS2FF_NPZ_FILE) as npz:
+            _PS2FF_NPZ = dict(npz)
+    if _PS2FF_NPZ is not None and (name + '/ratios') in _PS2FF_NPZ:
+        return (_PS2FF_NPZ[name + '/dists'], _PS2FF_NPZ[name + '/mags'],
+                _PS2FF_NPZ[name + '/ratios'], _PS2FF_NPZ[name + '/var'])
+    return _read_ps2ff_csv(name)
+
+
+def _read_ps2ff_csv(name):
+    """
+    Read a ps2ff ratio table and its variance table from the csv files.
+
+    :param name:
+        Base name of the table (see _get_ps2ff_table_name).
+    :returns:
+        Tuple of ln(Repi) values, magnitudes, ratio grid and variance grid.
+    """
+    rf = os.path.join(PS2FF_DIR, name + '_Ratios.csv')
+    vf = os.path.join(PS2FF_DIR, name + '_Var.csv')
+    ratios_tbl = pd.read_csv(rf, comment='#')
+    mag_list = []
+    for column in ratios_tbl.columns[1:]:
+        if re.search(r'R\d+\.*\d*', column):
+            magnitude = float(re.findall(r'R(\d+\.*\d*)', column)[0])
+            mag_list.append(magnitude)
+    mag_list = np.array(mag_list)
+    dist_list = np.log(np.array(ratios_tbl['Repi_km']))
+    ratios = ratios_tbl.values[:, 1:]
+    var = pd.read_csv(vf, comment='#').values[:, 1:]
+    return dist_list, mag_list, ratios, var
+
+
+def write_ps2ff_npz(filename=PS2FF_NPZ_FILE):
+    """
+    Precompile all of the ps2ff csv tables into a single npz file. If the
+    default file exists, it is used in place of the csv files, which is much
+    faster to load.
+
+    :param filename:
+        Output file name.
+    """
+    names = set()
+    for f in os.listdir(PS2FF_DIR):
+        if f.endswith('_Ratios.csv'):
+            names.add(f[:-len('_Ratios.csv')])
+    arrays = {}
+    for name in sorted(names):
+        dist_list, mag_list, ratios, var = _read_ps2ff_csv(name)
+        arrays[name + '/dists'] = dist_list
+        arrays[name + '/mags'] = mag_list
+        arrays[name + '/ratios'] = ratios
+        arrays[name + '/var'] = var
+    np.savez(filename, **arrays)
+
+
+class FaultPointCloud(object):
+    """
+    Point cloud approximation of a rupture surface (or of its surface
+    projection) for Rrup and Rjb. The nodes of the meshes of the quads (see
+    get_quad_mesh) are put in a KD-tree, and the distance to the nearest node
+    is found for each site. This is never less than the distance to the
+    rupture, and is larger by at most the largest distance from a point on
+    the rupture to its nearest node, which is at most 1/sqrt(3) of the
+    largest side or diagonal of the mesh cells. Sites where that bound is
+    more than MESH_TOLERANCE times the distance are computed exactly.
+    """
+
+    def __init__(self, fault, dx):
+        """
+        Constructor for FaultPointCloud.
+
+        :param fault:
+            Fault object.
+        :param dx:
+            Target mesh spacing (km); see get_quad_mesh.
+        """
+        self.dx = dx
+        self._lld = fault.getQuadVertices()
+        self._trees = {}
+
+    def getTree(self, surface=False):
+        """
+        Return the KD-tree of the mesh nodes and its error bound, which are
+        built when first needed.
+
+        :param surface:
+            Boolean; if True, the mesh is of the surface projection of the
+            rupture (for Rjb).
+        :returns:
+            Tuple of cKDTree of the ECEF mesh nodes, and the largest distance
+            (m) from a point of the rupture to its nearest node.
+        """
+        if surface not in self._trees:
+            nodes = []
+            bound = 0.0
+            for quad in self._lld:
+                if surface:
+                    q = [point.Point(lon, lat, 0.0)
+                         for lon, lat, dep in quad]
+                else:
+                    q = [point.Point(lon, lat, dep)
+                         for lon, lat, dep in quad]
+                mesh = get_quad_mesh(q, self.dx)
+                nodes.append(np.column_stack((mesh['x'].ravel(),
+                                              mesh['y'].ravel(),
+                                              mesh['z'].ravel())))
+                corners = [np.stack((mesh[c + 'x'], mesh[c + 'y'],
+                                     mesh[c + 'z']), axis=-1)
+                           for c in ['ul', 'ur', 'lr', 'll']]
+                for i, j in [(0, 1), (1, 2), (2, 3), (3, 0), (0, 2), (1, 3)]:
+                    d = corners[i] - corners[j]
+                    bound = max(bound, np.sqrt(np.max(np.sum(d * d, axis=-1))))
+            self._trees[surface] = (cKDTree(np.concatenate(nodes)),
+                                    bound / np.sqrt(3.0))
+        return self._trees[surface]
+
+    def getDistance(self, quads, points, surface=False,
+                    block_size=QUAD_SITE_BLOCK):
+        """
+        Calculate the approximate shortest distance from a set of points to
+        the rupture; see _calc_min_rupture_distance.
+
+        :param quads:
+            Numpy array (Q x 4 x 3) of ECEF quad vertices, used for the
+            points that are computed exactly.
+        :param points:
+            Numpy array Nx3 of points (ECEF) to calculate distance from.
+        :param surface:
+            Boolean; if True, the distance is to the surface projection of the
+            rupture (for Rjb); quads must then be at the surface.
+        :param block_size:
+            See _calc_min_rupture_distance.
+        :returns:
+            Array of size N of distances (in km) from input points to the
+            rupture.
+        """
+        tree, bound = self.getTree(surface)
+        dist, idx = tree.query(points)
+        # The exact distance is between dist - bound and dist
+        exact = bound > MESH_TOLERANCE * (dist - bound)
+        dist = dist / 1000.0
+        if np.any(exact):
+            dist[exact] = _calc_min_rupture_distance(
+                quads, points[exact], block_size=block_size)
+        return dist
+
+
+def _get_point_cloud(fault, dx):
+    """
+    Return the FaultPointCloud for a fault, which is cached on the fault for
+    the most recent dx.
+
+    :param fault:
+        Fault object.
+    :param dx:
+        Target mesh spacing (km).
+    :returns:
+        FaultPointCloud object.
+    """
+    cloud = getattr(fault, '_point_cloud', None)
+    if cloud is None or cloud.dx != dx:
+        cloud = FaultPointCloud(fault, dx)
+        fault._point_cloud = cloud
+    return cloud
+
+
+def _get_quads_ecef(quadlist, surface=False):
+    """
+    Convert a list of quadrilaterals to an array of ECEF vertices.
+
+    :param quadlist:
+        List of quadrilaterals; each quad is a tuple of four Point objects.
+    :param surface:
+        Boolean; if True, the vertices are projected to the surface (depth
+        set to zero) before conversion, as is needed for Rjb.
+    :returns:
+        Numpy array (Q x 4 x 3) of ECEF coordinates of the quad vertices.
+    """
+    quads = np.zeros((len(quadlist), 4, 3))
+    for i, quad in enumerate(quadlist):
+        for j, P in enumerate(quad):
+            if surface:
+                x, y, z = latlon2ecef(P.latitude, P.longitude, 0.0)
+            else:
+                x, y, z = latlon2ecef(P.latitude, P.longitude, P.depth)
+            quads[i, j, :] = [x, y, z]
+    return quads
+
+
+def _calc_min_rupture_distance(quads, points, block_size=QUAD_SITE_BLOCK,
+                               prune=True):
+    """
+    Calculate the shortest distance from a set of points to a rupture surface
+    made up of many quadrilaterals. All quads are handled together as array
+    operations; the points are processed in chunks so that the size of the
+    temporary arrays is bounded.
+
+    When prune is True, each quad is enclosed in a bounding sphere. For each
+    point, quads whose sphere is farther away than the best upper bound
+    (distance to the far side of the nearest sphere) are skipped since they
+    cannot contain the closest point. This does not change the result.
+
+    :param quads:
+        Numpy array (Q x 4 x 3) of ECEF quad vertices (see _get_quads_ecef).
+    :param points:
+        Numpy array Nx3 of points (ECEF) to calculate distance from.
+    :param block_size:
+        Maximum number of quad-point pairs to evaluate at one time; this
+        controls the memory used for temporary arrays.
+    :param prune:
+        Boolean; skip quads that cannot be the closest using bounding
+        spheres.
+    :returns:
+        Array of size N of distances (in km) from input points to the closest
+        quad.
+    """
+    nq = quads.shape[0]
+    npoints = points.shape[0]
+
+    p0 = quads[:, 0, :]
+    p1 = quads[:, 1, :]
+    p2 = quads[:, 2, :]
+    p3 = quads[:, 3, :]
+
+    # Unit vectors normal to each quad
+    normal = np.cross(p1 - p0, p2 - p0)
+    normal = normal / np.sqrt(normal[:, 0]**2 + normal[:, 1]**2 +
+                              normal[:, 2]**2)[:, np.newaxis]
+
+    # Create 4 planes per quad with normals pointing outside rectangle
+    edge_normals = np.stack([np.cross(p1 - p0, normal),
+                             np.cross(p2 - p1, normal),
+                             np.cross(p3 - p2, normal),
+                             np.cross(p0 - p3, normal)], axis=1)
+
+    prune = prune and nq > 1
+    if prune:
+        # Bounding spheres (ECEF centre and radius) of each quad
+        centers, radii = _get_quad_spheres(quads)
+
+    dist = np.zeros(npoints)
+    chunk = max(1, block_size // max(nq, 1))
+    for istart in range(0, npoints, chunk):
+        pts = points[istart:istart + chunk]
+        if prune:
+            dc = _dist_to_centers(centers, pts)
+            # No point is farther than this from the rupture
+            upper = np.min(dc + radii[:, np.newaxis], axis=0)
+            lower = dc - radii[:, np.newaxis] - PRUNE_MARGIN
+            # Candidate (point, quad) pairs, grouped by point. Every point
+            # has at least one candidate: the quad that sets its upper bound.
+            ip, iq = np.nonzero((lower <= upper).T)
+            dsq = _quad_distance_sq(quads[iq], normal[iq],
+                                    edge_normals[iq], pts[ip])
+            starts = np.flatnonzero(np.r_[True, ip[1:] != ip[:-1]])
+            dsq = np.minimum.reduceat(dsq, starts)
+        else:
+            dsq = _quad_distance_sq(quads[:, np.newaxis], normal[:, np.newaxis],
+                                    edge_normals[:, np.newaxis],
+                                    pts[np.newaxis])
+            dsq = np.min(dsq, axis=0)
+        dist[istart:istart + chunk] = np.sqrt(dsq) / 1000.0
+
+    if np.any(np.isnan(dist)):
+        raise ShakeMapException("Could not calculate some distances!")
+    return dist
+
+
+def _get_rjb_lower_bound(fault, lat, lon, block_size=QUAD_SITE_BLOCK):
+    """
+    Lower bound on the Joyner-Boore distance of each site, from the bounding
+    spheres of the surface projection of the quads.
+
+    :param fault:
+        Fault object.
+    :param lat:
+       A numpy array of latitudes.
+    :param lon:
+       A numpy array of longitudes.
+    :param block_size:
+        Maximum number of quad/site pairs evaluated at one time.
+    :returns:
+        Numpy array of lower bounds (km), size of lon.shape.
+    """
+    centers, radii = _get_quad_spheres(fault.getQuadsECEF(surface=True))
+    x, y, z = latlon2ecef(np.reshape(lat, (-1,)), np.reshape(lon, (-1,)),
+                          0.0)
+    points = np.column_stack((x, y, z))
+    lower = np.empty(len(points))
+    chunk = max(1, block_size // len(radii))
+    for istart in range(0, len(points), chunk):
+        dc = _dist_to_centers(centers, points[istart:istart + chunk])
+        lower[istart:istart + chunk] = np.min(
+            dc - radii[:, np.newaxis] - PRUNE_MARGIN, axis=0)
+    return (lower / 1000.0).reshape(np.shape(lon))
+
+
+def _get_quad_spheres(quads):
+    """
+    Compute a bounding sphere for each quadrilateral.
+
+    :param quads:
+        Numpy array (Q x 4 x 3) of ECEF quad vertices.
+    :returns:
+        Tuple of the sphere centres (Q x 3, the mean of the vertices) and
+        radii (Q, in m).
+    """
+    centers = np.mean(quads, axis=1)
+    dv = quads - centers[:, np.newaxis, :]
+    radii = np.max(np.sqrt(np.sum(dv * dv, axis=2)), axis=1)
+    return centers, radii
+
+
+def _dist_to_centers(centers, pts):
+    """
+    Distances (m) from points to the centres of the bounding spheres.
+
+    :param centers:
+        Numpy array (Q x 3) of ECEF sphere centres.
+    :param pts:
+        Numpy array (N x 3) of ECEF points.
+    :returns:
+        Numpy array (Q x N) of distances.
+    """
+    dv = centers[:, np.newaxis, :] - pts[np.newaxis, :, :]
+    return np.sqrt(np.sum(dv * dv, axis=2))
+
+
+def _quad_distance_sq(quads, normal, edge_normals, pts):
+    """
+    Squared distance from points to quadrilaterals. The leading dimensions
+    of the inputs are broadcast against each other, so this can evaluate
+    every quad against every point (quads with shape Q x 1 x 4 x 3 and
+    points with shape 1 x N x 3) or matched lists of quad/point pairs.
+
+    :param quads:
+        Numpy array (... x 4 x 3) of ECEF quad vertices.
+    :param normal:
+        Numpy array (... x 3) of unit normals to the quads.
+    :param edge_normals:
+        Numpy array (... x 4 x 3) of normals to the quad edges pointing out
+        of the quads.
+    :param pts:
+        Numpy array (... x 3) of ECEF points.
+    :returns:
+        Numpy array of squared distances (m^2) with the broadcast leading
+        shape.
+    """
+    # Vectors from points to each vertex
+    pd = [quads[..., k, :] - pts for k in range(4)]
+
+    sgn = [np.signbit(np.sum(edge_normals[..., k, :] * pd[k], axis=-1))
+           for k in range(4)]
+    inside = (sgn[0] == sgn[1]) & (sgn[1] == sgn[2]) & (sgn[2] == sgn[3])
+
+    dsq = np.minimum(
+        np.minimum(_distance_sq_to_segment(pd[0], pd[1]),
+                   _distance_sq_to_segment(pd[1], pd[2])),
+        np.minimum(_distance_sq_to_segment(pd[2], pd[3]),
+                   _distance_sq_to_segment(pd[3], pd[0])))
+    dplane = np.power(np.abs(np.sum(pd[0] * normal, axis=-1)), 2)
+    dsq[inside] = dplane[inside]
+    return dsq
+
+
 def _distance_sq_to_segment(p0, p1):
     """
     Calculate the distance^2 from the origin to a segment defined by two vectors
 
     :param p0: 
-        Numpy array Nx3 (ECEF).
+        Numpy array Nx3 (ECEF); any number of leading dimensions is allowed
+        as long as the last dimension is 3.
     :param p1: 
-        Numpy array Nx3 (ECEF).
+        Numpy array Nx3 (ECEF), same shape as p0.
     :returns:
         The squared distance from the origin to a segment.
     """
@@ -718,12 +1587,14 @@ def _distance_sq_to_segment(p0, p1):
     #  * by two vectors
     #  */
 
-    dist = np.zeros_like(p1[:, 0])
+    dist = np.zeros_like(p1[..., 0])
+    p0sq = p0[..., 0]**2 + p0[..., 1]**2 + p0[..., 2]**2
+    p1sq = p1[..., 0]**2 + p1[..., 1]**2 + p1[..., 2]**2
+
     # /* Are the two points equal? */
-    idx_equal = (p0[:, 0] == p1[:, 0]) & (
-        p0[:, 1] == p1[:, 1]) & (p0[:, 2] == p1[:, 2])
-    dist[idx_equal] = np.sqrt(p0[idx_equal, 0]**2 +
-                              p0[idx_equal, 1]**2 + p0[idx_equal, 2]**2)
+    idx_equal = (p0[..., 0] == p1[..., 0]) & (
+        p0[..., 1] == p1[..., 1]) & (p0[..., 2] == p1[..., 2])
+    dist[idx_equal] = np.sqrt(p0sq[idx_equal])
 
     v = p1 - p0
 
@@ -735,29 +1606,22 @@ def _distance_sq_to_segment(p0, p1):
     #  * If C1 is positive and <V then O is inside.
     #  */
 
-    c1 = -1 * np.sum(p0 * v, axis=1)
+    c1 = -1 * np.sum(p0 * v, axis=-1)
     idx_neg = c1 <= 0
-    dist[idx_neg] = p0[idx_neg, 0]**2 + p0[idx_neg, 1]**2 + p0[idx_neg, 2]**2
+    dist[idx_neg] = p0sq[idx_neg]
 
-    c2 = np.sum(v * v, axis=1)
+    c2 = np.sum(v * v, axis=-1)
     idx_less_c1 = c2 <= c1
-    dist[idx_less_c1] = p1[idx_less_c1, 0]**2 + \
-        p1[idx_less_c1, 1]**2 + p1[idx_less_c1, 2]**2
+    dist[idx_less_c1] = p1sq[idx_less_c1]
 
     idx_other = np.logical_not(idx_neg | idx_equal | idx_less_c1)
 
-    nr, nc = p0.shape
-    t1 = c1 / c2
-    t1.shape = (nr, 1)
-    t2 = np.tile(t1, 3)
-    tmp = p0 + (v * t1)
-    dist[idx_other] = tmp[idx_other, 0]**2 + \
-        tmp[idx_other, 1]**2 + tmp[idx_other, 2]**2
+    t1 = c1[idx_other] / c2[idx_other]
+    tmp = p0[idx_other] + (v[idx_other] * t1[:, np.newaxis])
+    dist[idx_other] = tmp[:, 0]**2 + tmp[:, 1]**2 + tmp[:, 2]**2
 
     return dist
 
-# call this once per quad
-
 
 def _calc_rupture_distance(P0, P1, P2, P3, points):
     """
@@ -774,156 +1638,103 @@ def _calc_rupture_distance(P0, P1, P2, P3, points):
     :param points:
         Numpy array Nx3 of points (ECEF) to calculate distance from.
     :returns:
-        Array of size N of distances (in km) from input points to rupture surface.
-    """
-    # Convert to ecef
-    p0 = Vector.fromPoint(P0)
-    p1 = Vector.fromPoint(P1)
-    p2 = Vector.fromPoint(P2)
-    p3 = Vector.fromPoint(P3)
-
-    # Make a unit vector normal to the plane
-    normalVector = (p1 - p0).cross(p2 - p0).norm()
-
-    dist = np.ones_like(points[:, 0]) * np.nan
-
-    p0d = p0.getArray() - points
-    p1d = p1.getArray() - points
-    p2d = p2.getArray() - points
-    p3d = p3.getArray() - points
-
-    # Create 4 planes with normals pointing outside rectangle
-    n0 = (p1 - p0).cross(normalVector).getArray()
-    n1 = (p2 - p1).cross(normalVector).getArray()
-    n2 = (p3 - p2).cross(normalVector).getArray()
-    n3 = (p0 - p3).cross(normalVector).getArray()
-
-    sgn0 = np.signbit(np.sum(n0 * p0d, axis=1))
-    sgn1 = np.signbit(np.sum(n1 * p1d, axis=1))
-    sgn2 = np.signbit(np.sum(n2 * p2d, axis=1))
-    sgn3 = np.signbit(np.sum(n3 * p3d, axis=1))
-
-    inside_idx = (sgn0 == sgn1) & (sgn1 == sgn2) & (sgn2 == sgn3)
-    dist[inside_idx] = np.power(np.abs(
-        np.sum(p0d[inside_idx, :] * normalVector.getArray(), axis=1)), 2)
-
-    outside_idx = np.logical_not(inside_idx)
-    s0 = _distance_sq_to_segment(p0d, p1d)
-    s1 = _distance_sq_to_segment(p1d, p2d)
-    s2 = _distance_sq_to_segment(p2d, p3d)
-    s3 = _distance_sq_to_segment(p3d, p0d)
-
-    smin = np.minimum(np.minimum(s0, s1), np.minimum(s2, s3))
-    dist[outside_idx] = smin[outside_idx]
-    dist = np.sqrt(dist) / 1000.0
-    shp = dist.shape
-    if len(shp) == 1:
-        dist.shape = (shp[0], 1)
-    if np.any(np.isnan(dist)):
-        raise ShakeMapException("Could not calculate some distances!")
-    dist = np.fliplr(dist)
+        Array of size Nx1 of distances (in km) from input points to rupture
+        surface.
+    """
+    quads = _get_quads_ecef([(P0, P1, P2, P3)])
+    dist = _calc_min_rupture_distance(quads, points)
+    dist.shape = (dist.shape[0], 1)
     return dist
 
 
-def __calc_u_i(P0, P1, lat, lon):
+def _calc_gc2(gc2, lat, lon, block_size=QUAD_SITE_BLOCK):
     """
-    Calculate u_i distance. See Spudich and Chiou OFR 2015-1028. This is the distance
-    along strike from the first vertex (P0) of the i-th segment.
-
-    :param P0:
-        Point object, representing the first top-edge vertex of a fault quadrilateral.
-    :param P1:
-        Point object, representing the second top-edge vertex of a fault quadrilateral.
+    Calculate the GC2 coordinates U and T. See Spudich and Chiou OFR
+    2015-1028. The sites are projected once into the local frame of the
+    GC2Frame, and u_i (distance along strike from the first vertex of the i-th
+    quad), t_i (distance normal to strike; positive on the hanging-wall) and
+    the weights are computed for all quads together (see _gc2_sums).
+
+    :param gc2:
+        GC2Frame object (see Fault.getGC2Frame).
     :param lat:
-        A numpy array of latitude.
+        A numpy array of latitudes.
     :param lon:
-        A numpy array of longitude.
+        A numpy array of longitudes.
+    :param block_size:
+        Maximum number of quad-site pairs to evaluate at one time.
     :returns:
-        Array of size lat.shape of distances (in km).
+        Tuple of arrays U and T (in km), with size of lat.
     """
-    # Project to Cartesian space
-    west = min(P0.x, P1.x)
-    east = max(P0.x, P1.x)
-    south = min(P0.y, P1.y)
-    north = max(P0.y, P1.y)
-    proj = get_orthographic_projection(west, east, north, south)
-
-    # projected coordinates are in km
-    p0x, p0y = proj(P0.x, P0.y)
-    p1x, p1y = proj(P1.x, P1.y)
-
-    # projected coordinates are in km
-    p0x, p0y = proj(P0.x, P0.y)
-    p1x, p1y = proj(P1.x, P1.y)
-
-    # Unit vector pointing along strike
-    u_i_hat = Vector(p1x - p0x, p1y - p0y, 0).norm()
-
-    # Convert sites to Cartesian
-    sx, sy = proj(lon, lat)
-    sx1d = np.reshape(sx, (-1,))
-    sy1d = np.reshape(sy, (-1,))
+    sx, sy = gc2.proj(np.reshape(lon, (-1,)), np.reshape(lat, (-1,)))
+    totweight, wt, wu = _gc2_sums(sx, sy, gc2.p0x, gc2.p0y, gc2.u_hat,
+                                  gc2.t_hat, gc2.quad_lengths, gc2.u_offsets,
+                                  block_size)
+    return wu / totweight, wt / totweight
 
-    # Vectors from P0 to sites
-    r = np.zeros([len(sx1d), 2])
-    r[:, 0] = sx1d - p0x
-    r[:, 1] = sy1d - p0y
 
-    # Dot product gives t_i
-    u_i = np.sum(u_i_hat.getArray()[0:2] * r, axis=1)
-    shp = u_i.shape
-    if len(shp) == 1:
-        u_i.shape = (shp[0], 1)
-    u_i = np.fliplr(u_i)
-
-    return u_i
-
-
-def __calc_t_i(P0, P1, lat, lon):
+def _gc2_sums(sx, sy, p0x, p0y, u_hat, t_hat, l_i, offsets,
+              block_size=QUAD_SITE_BLOCK):
     """
-    Calculate t_i distance. See Spudich and Chiou OFR 2015-1028. This is the distance
-    measured normal to strike from the i-th segment. Values on the hanging-wall are
-    positive and those on the foot-wall are negative.
-
-    :param P0:
-        Point object, representing the first top-edge vertex of a fault quadrilateral.
-    :param P1:
-        Point object, representing the second top-edge vertex of a fault quadrilateral.
-    :param lat:
-        A numpy array of latitudes.
-    :param lon:
-        A numpy array of longitudes.
+    Calculate the sums over quads of the GC2 weights, the weighted t_i, and
+    the weighted u_i (plus offsets). U and T are the ratios of the latter two
+    to the first. The sites are processed in chunks so that the size of the
+    temporary arrays is bounded.
+
+    :param sx:
+        Array of projected x coordinates (km) of the sites.
+    :param sy:
+        Array of projected y coordinates (km) of the sites.
+    :param p0x:
+        Array of projected x coordinates (km) of the first vertex of each
+        quad.
+    :param p0y:
+        Array of projected y coordinates (km) of the first vertex of each
+        quad.
+    :param u_hat:
+        Array (nquads x 2) of unit vectors along strike.
+    :param t_hat:
+        Array (nquads x 2) of unit vectors normal to strike.
+    :param l_i:
+        Array of quad lengths (km).
+    :param offsets:
+        Array of the offsets (km) to add to u_i of each quad.
+    :param block_size:
+        Maximum number of quad-site pairs to evaluate at one time.
     :returns:
-        Array of size N of distances (in km) from input points to rupture surface.
-    """
-    # Project to Cartesian space
-    west = min(P0.x, P1.x)
-    east = max(P0.x, P1.x)
-    south = min(P0.y, P1.y)
-    north = max(P0.y, P1.y)
-    proj = get_orthographic_projection(west, east, north, south)
-
-    # projected coordinates are in km
-    p0x, p0y = proj(P0.x, P0.y)
-    p1x, p1y = proj(P1.x, P1.y)
-
-    # Unit vector pointing normal to strike
-    t_i_hat = Vector(p1y - p0y, -(p1x - p0x), 0).norm()
-
-    # Convert sites to Cartesian
-    sx, sy = proj(lon, lat)
-    sx1d = np.reshape(sx, (-1,))
-    sy1d = np.reshape(sy, (-1,))
-
-    # Vectors from P0 to sites
-    r = np.zeros([len(sx1d), 2])
-    r[:, 0] = sx1d - p0x
-    r[:, 1] = sy1d - p0y
-
-    # Dot product gives t_i
-    t_i = np.sum(t_i_hat.getArray()[0:2] * r, axis=1)
-    shp = t_i.shape
-    if len(shp) == 1:
-        t_i.shape = (shp[0], 1)
-    t_i = np.fliplr(t_i)
-    return t_i
+        Tuple of arrays of the sums of w_i, w_i * t_i, and
+        w_i * (u_i + offsets), with the size of sx.
+    """
+    nsites = len(sx)
+    nq = len(l_i)
+
+    totweight = np.zeros(nsites)
+    wt = np.zeros(nsites)
+    wu = np.zeros(nsites)
+    chunk = max(1, block_size // nq)
+    for istart in range(0, nsites, chunk):
+        iend = istart + chunk
+        # Vectors from P0 of each quad to the sites; arrays are sites x quads
+        # so that the sums over quads do not depend on the chunk size.
+        rx = sx[istart:iend, np.newaxis] - p0x
+        ry = sy[istart:iend, np.newaxis] - p0y
+        u_i = u_hat[:, 0] * rx + u_hat[:, 1] * ry
+        t_i = t_hat[:, 0] * rx + t_hat[:, 1] * ry
+
+        # Weight of segment, three cases
+        # Case 3: t_i == 0 and 0 <= u_i <= l_i
+        w_i = np.zeros_like(t_i)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Case 1:
+            ix = t_i != 0
+            w_i = np.where(ix, (np.arctan((l_i - u_i) / t_i) -
+                                np.arctan(-u_i / t_i)) / t_i, w_i)
+            # Case 2:
+            ix = (t_i == 0) & ((u_i < 0) | (u_i > l_i))
+            w_i = np.where(ix, 1 / (u_i - l_i) - 1 / u_i, w_i)
+
+        totweight[istart:iend] = np.sum(w_i, axis=1)
+        wt[istart:iend] = np.sum(w_i * t_i, axis=1)
+        wu[istart:iend] = np.sum(w_i * (u_i + offsets), axis=1)
+
+    return totweight, wt, wu
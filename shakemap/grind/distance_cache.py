@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import hashlib
+import os
+import shutil
+import tempfile
+
+# third party imports
+import numpy as np
+
+# local imports
+from .distance import get_distance
+
+# Bump this when the distance calculations change so that old cache entries
+# are not used.
+CACHE_VERSION = 2
+
+# Default maximum total size (bytes) of the cache directory
+DEFAULT_MAX_SIZE = 2 * 1024**3
+
+
+class DistanceCache(object):
+    """
+    On-disk cache of distance grids. Entries are keyed by a hash of the fault
+    geometry, the hypocenter (and the other event parameters that distances
+    depend on), and the GeoDict of the site grid. Each distance measure is
+    stored as a .npy file in the entry directory and is loaded memory-mapped,
+    so reruns for the same event and grid do not recompute or copy the
+    distances. When the cache grows larger than max_size, the least recently
+    used entries are removed.
+    """
+
+    def __init__(self, cachedir, max_size=DEFAULT_MAX_SIZE):
+        """
+        Constructor for DistanceCache.
+
+        :param cachedir:
+            Directory for the cache; created if it does not exist.
+        :param max_size:
+            Maximum total size (bytes) of the cache.
+        """
+        self._cachedir = cachedir
+        self._max_size = max_size
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+    @staticmethod
+    def getKey(source, geodict, use_median_distance=True, tolerance=None,
+               max_distance=None, mesh_dx=None):
+        """
+        Compute the cache key for a source and site grid.
+
+        :param source:
+            Shakemap Source object.
+        :param geodict:
+            GeoDict of the site grid.
+        :param use_median_distance:
+            Boolean; see get_distance.
+        :param tolerance:
+            Tolerance of the adaptive calculation; see get_distance.
+        :param max_distance:
+            Cutoff distance (km); see get_distance.
+        :param mesh_dx:
+            Point cloud spacing (km); see get_distance.
+        :returns:
+            Hexadecimal hash string.
+        """
+        h = hashlib.sha1()
+        h.update(('version %i\n' % CACHE_VERSION).encode('utf-8'))
+        fault = source._fault
+        if fault is not None:
+            lon, lat, depth = fault.getFaultAsArrays()
+            for a in (lon, lat, depth):
+                h.update(np.ascontiguousarray(a, dtype=np.float64).tobytes())
+            h.update(repr(list(fault._segment_index)).encode('utf-8'))
+        hypo = source.getHypo()
+        params = [hypo.longitude, hypo.latitude, hypo.depth,
+                  source._event_dict.get('mag'),
+                  source._event_dict.get('rake'),
+                  source._event_dict.get('mech'),
+                  getattr(source, '_tectonic_region', None),
+                  use_median_distance,
+                  geodict.xmin, geodict.xmax, geodict.ymin, geodict.ymax,
+                  geodict.dx, geodict.dy, geodict.nx, geodict.ny]
+        if tolerance is not None:
+            params.append(('tolerance', tolerance))
+        if max_distance is not None:
+            params.append(('max_distance', max_distance))
+        if mesh_dx is not None:
+            params.append(('mesh_dx', mesh_dx))
+        h.update(repr(params).encode('utf-8'))
+        return h.hexdigest()
+
+    def load(self, key, methods):
+        """
+        Load distances from the cache.
+
+        :param key:
+            Cache key (see getKey).
+        :param methods:
+            List of distance measures.
+        :returns:
+            Dictionary of read-only memory-mapped arrays for those methods
+            that are in the cache.
+        """
+        entry = os.path.join(self._cachedir, key)
+        distdict = {}
+        if not os.path.isdir(entry):
+            return distdict
+        for method in methods:
+            fname = os.path.join(entry, method + '.npy')
+            if os.path.isfile(fname):
+                distdict[method] = np.load(fname, mmap_mode='r')
+        if len(distdict):
+            # Mark the entry as recently used
+            os.utime(entry, None)
+        return distdict
+
+    def save(self, key, distdict):
+        """
+        Save distances to the cache, then evict old entries if the cache is
+        too large.
+
+        :param key:
+            Cache key (see getKey).
+        :param distdict:
+            Dictionary of distance arrays.
+        """
+        entry = os.path.join(self._cachedir, key)
+        if not os.path.isdir(entry):
+            os.makedirs(entry, exist_ok=True)
+        for method, dist in distdict.items():
+            # Write to a temporary file first so that readers never see a
+            # partial file
+            fd, tmpname = tempfile.mkstemp(dir=entry, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.asarray(dist))
+            os.replace(tmpname, os.path.join(entry, method + '.npy'))
+        os.utime(entry, None)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries until the cache is no larger than
+        max_size.
+
+        :param keep:
+            Key of an entry that should not be removed.
+        """
+        entries = []
+        total = 0
+        for key in os.listdir(self._cachedir):
+            entry = os.path.join(self._cachedir, key)
+            if not os.path.isdir(entry):
+                continue
+            size = 0
+            for fname in os.listdir(entry):
+                size += os.path.getsize(os.path.join(entry, fname))
+            entries.append((os.path.getmtime(entry), key, size))
+            total += size
+        for mtime, key, size in sorted(entries):
+            if total <= self._max_size:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self._cachedir, key),
+                          ignore_errors=True)
+            total -= size
+
+    def getDistance(self, methods, lat, lon, dep, source, geodict,
+                    use_median_distance=True, **kwargs):
+        """
+        Get distances from the cache, computing (and saving) those that are
+        not in it with get_distance.
+
+        :param methods:
+            List of strings (or just a string) of distances to compute.
+        :param lat:
+           A numpy array of latitudes of the grid described by geodict.
+        :param lon:
+           A numpy array of longitudes of the grid described by geodict.
+        :param dep:
+           A numpy array of depths (km).
+        :param source:
+           Shakemap Source object.
+        :param geodict:
+            GeoDict of the site grid.
+        :param use_median_distance:
+            Boolean; see get_distance.
+        :param kwargs:
+            Other options passed to get_distance (e.g., chunk_size).
+        :returns:
+           Dictionary of numpy arrays of distances, size of lon.shape; with
+           max_distance, it also includes the 'approximated' mask (see
+           get_distance).
+        """
+        if not isinstance(methods, list):
+            methods = [methods]
+        key = self.getKey(source, geodict, use_median_distance,
+                          kwargs.get('tolerance'), kwargs.get('max_distance'),
+                          kwargs.get('mesh_dx'))
+        # The mask of the sites approximated beyond max_distance is stored
+        # with the distances; there is no mask without a fault
+        stored = list(methods)
+        if kwargs.get('max_distance') is not None and \
+           source._fault is not None:
+            stored.append('approximated')
+        distdict = self.load(key, stored)
+        distdict = dict((m, d) for m, d in distdict.items()
+                        if d.shape == lon.shape)
+        missing = [m for m in stored if m not in distdict]
+        if len(missing):
+            compute = [m for m in missing if m != 'approximated']
+            if not len(compute):
+                compute = methods
+            ddict = get_distance(compute, lat, lon, dep, source,
+                                 use_median_distance=use_median_distance,
+                                 **kwargs)
+            newdict = dict((m, ddict[m]) for m in missing if m in ddict)
+            self.save(key, newdict)
+            distdict.update(newdict)
+        return distdict
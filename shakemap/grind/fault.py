@@ -1,16 +1,20 @@
 #!/usr/bin/env python
 
 # stdlib modules
+from collections import OrderedDict
 import copy
 
 # third party imports
 import numpy as np
+from openquake.hazardlib.geo import geodetic
 from openquake.hazardlib.geo import mesh
 from openquake.hazardlib.geo import point
 from openquake.hazardlib.geo.utils import get_orthographic_projection
 from ..utils.ecef import latlon2ecef
 from ..utils.ecef import ecef2latlon
 from ..utils.vector import Vector
+from ..utils.vector import VectorArray
+from .fault_library import FaultLibrary
 
 # local imports
 from shakemap.utils.exception import ShakeMapException
@@ -20,6 +24,12 @@ from shakemap.utils.exception import ShakeMapException
 # 4th point can be before being considered non-co-planar?
 OFFPLANE_TOLERANCE = 0.05
 
+# Maximum number of quad meshes kept by get_quad_mesh
+MESH_CACHE_SIZE = 256
+
+# Cache of quad meshes, keyed by the quad vertices and dx
+_mesh_cache = OrderedDict()
+
 
 class Fault(object):
     """
@@ -94,9 +104,8 @@ class Fault(object):
         else:
             raise ShakeMapException(
                 'Number of xp0,yp0,xp1,yp1,zp,widths,dips points must be equal.')
-        if strike is None:
-            pass
-        else:
+        if strike is not None:
+            strike = np.atleast_1d(np.array(strike, dtype='d'))
             if (len(xp0) == len(strike)) | (len(strike) == 1):
                 pass
             else:
@@ -123,83 +132,46 @@ class Fault(object):
 
         # projected coordinates are in km
         proj = get_orthographic_projection(west, east, north, south)
-        surfaces = []
-        xp2 = np.zeros_like(xp0)
-        xp3 = np.zeros_like(xp0)
-        yp2 = np.zeros_like(xp0)
-        yp3 = np.zeros_like(xp0)
-        zpdown = np.zeros_like(zp)
-        for i in range(0, len(xp0)):
-            # Project the top edge coordinates
-            p0x, p0y = proj(xp0[i], yp0[i])
-            p1x, p1y = proj(xp1[i], yp1[i])
-
-            # Get the rotation angle defined by these two points
-            if strike is None:
-                dx = p1x - p0x
-                dy = p1y - p0y
-                theta = np.arctan2(dx, dy)  # theta is angle from north
-            elif len(strike) == 1:
-                theta = np.radians(strike)
-            else:
-                theta = np.radians(strike[i])
-
-            R = np.array([[np.cos(theta), -np.sin(theta)],
-                          [np.sin(theta), np.cos(theta)]])
-
-            # Rotate the top edge points into a new coordinate system (vertical
-            # line)
-            p0 = np.array([p0x, p0y])
-            p1 = np.array([p1x, p1y])
-            p0p = np.dot(R, p0)
-            p1p = np.dot(R, p1)
-
-            # Get right side coordinates in project,rotated system
-            dz = np.sin(dips[i]) * widths[i]
-            dx = np.cos(dips[i]) * widths[i]
-            p3xp = p0p[0] + dx
-            p3yp = p0p[1]
-            p2xp = p1p[0] + dx
-            p2yp = p1p[1]
-
-            # Get right side coordinates in un-rotated projected system
-            p3p = np.array([p3xp, p3yp])
-            p2p = np.array([p2xp, p2yp])
-            Rback = np.array([[np.cos(-theta), -np.sin(-theta)],
-                              [np.sin(-theta), np.cos(-theta)]])
-            p3 = np.dot(Rback, p3p)
-            p2 = np.dot(Rback, p2p)
-            p3x = np.array([p3[0]])
-            p3y = np.array([p3[1]])
-            p2x = np.array([p2[0]])
-            p2y = np.array([p2[1]])
-
-            # project lower edge points back to lat/lon coordinates
-            lon3, lat3 = proj(p3x, p3y, reverse=True)
-            lon2, lat2 = proj(p2x, p2y, reverse=True)
-
-            xp2[i] = lon2
-            xp3[i] = lon3
-            yp2[i] = lat2
-            yp3[i] = lat3
-            zpdown[i] = zp[i] + dz
+
+        # Project the top edge coordinates of all rectangles
+        p0x, p0y = proj(xp0, yp0)
+        p1x, p1y = proj(xp1, yp1)
+
+        # Get the rotation angle defined by these two points
+        if strike is None:
+            theta = np.arctan2(p1x - p0x, p1y - p0y)  # angle from north
+        else:
+            theta = np.radians(strike) * np.ones_like(xp0)
+        cos = np.cos(theta)
+        sin = np.sin(theta)
+
+        # Rotate the top edge points into a new coordinate system (vertical
+        # line), where the right side is offset by the horizontal width
+        dz = np.sin(dips) * widths
+        dx = np.cos(dips) * widths
+        p3xp = cos * p0x - sin * p0y + dx
+        p3yp = sin * p0x + cos * p0y
+        p2xp = cos * p1x - sin * p1y + dx
+        p2yp = sin * p1x + cos * p1y
+
+        # Rotate the right side back to the projected system, and project
+        # lower edge points back to lat/lon coordinates
+        xp3, yp3 = proj(cos * p3xp + sin * p3yp, -sin * p3xp + cos * p3yp,
+                        reverse=True)
+        xp2, yp2 = proj(cos * p2xp + sin * p2yp, -sin * p2xp + cos * p2yp,
+                        reverse=True)
+        zpdown = zp + dz
 
         # assemble the vertices as the Fault constructor needs them...
         # which is: for each rectangle, there should be the four corners, the
         # first corner repeated, and then a nan.
-        nrects = len(zp)
         anan = np.ones_like(xp0) * np.nan
-        lon = np.array(list(zip(xp0, xp1, xp2, xp3, xp0, anan))
-                       ).reshape((nrects, 6)).flatten(order='C')
-        lat = np.array(list(zip(yp0, yp1, yp2, yp3, yp0, anan))
-                       ).reshape((nrects, 6)).flatten(order='C')
+        lon = np.column_stack((xp0, xp1, xp2, xp3, xp0, anan)).flatten()
+        lat = np.column_stack((yp0, yp1, yp2, yp3, yp0, anan)).flatten()
 
         # we need an array of depths, but we need to double each zp and zpdown
         # element we have
-        dep = []
-        for i in range(0, nrects):
-            dep += [zp[i], zp[i], zpdown[i], zpdown[i], zp[i], np.nan]
-        dep = np.array(dep)
+        dep = np.column_stack((zp, zp, zpdown, zpdown, zp, anan)).flatten()
 
         # take the nans off the end of each array
         lon = lon[0:-1]
@@ -208,6 +180,144 @@ class Fault(object):
 
         return cls(lon, lat, dep, reference)
 
+    @classmethod
+    def fromLibrary(cls, lib, rupture_id):
+        """
+        Create a fault object for one rupture of a fault library. Only the
+        quads of that rupture are read; the vertices in the library have
+        already been validated, so they are not validated again.
+
+        :param lib:
+            FaultLibrary object, or the directory of a fault library.
+        :param rupture_id:
+            Rupture id.
+        :returns:
+            Fault object, where each quad is given as its own polygon and the
+            segment index is that of the library.
+        :raises ShakeMapException:
+            if the rupture is not in the library.
+        """
+        if not isinstance(lib, FaultLibrary):
+            lib = FaultLibrary(lib)
+        lld, segment_index = lib.getQuads(rupture_id)
+        return cls._fromQuadArrays(lld, segment_index, lib.getReference())
+
+    @classmethod
+    def _fromQuadArrays(cls, lld, segment_index, reference):
+        """
+        Create a fault object from an array of validated quad vertices.
+
+        :param lld:
+            Numpy array (Q x 4 x 3) of longitude, latitude, and depth of the
+            vertices of each quadrilateral.
+        :param segment_index:
+            Sequence (Q) of segment indices of the quads.
+        :param reference:
+            String citeable reference for Fault.
+        :returns:
+            Fault object, where each quad is given as its own polygon.
+        """
+        # Each quad is a closed polygon followed by a nan
+        nq = lld.shape[0]
+        anan = np.ones((nq, 1)) * np.nan
+        ind = [0, 1, 2, 3, 0]
+        lon = np.hstack((lld[:, ind, 0], anan)).flatten()[0:-1]
+        lat = np.hstack((lld[:, ind, 1], anan)).flatten()[0:-1]
+        dep = np.hstack((lld[:, ind, 2], anan)).flatten()[0:-1]
+
+        flt = cls.__new__(cls)
+        flt._lon = lon
+        flt._lat = lat
+        flt._depth = dep
+        flt._reference = reference
+        flt._segment_index = [int(i) for i in segment_index]
+        flt._setQuadArrays(lld)
+        return flt
+
+    def simplify(self, tolerance_km):
+        """
+        Merge adjacent quadrilaterals of each segment where the merged quad
+        stays within a distance tolerance of the original ones. Quads are
+        merged greedily along each segment: a run of quads is extended as
+        long as the quad from the top left and bottom left vertices of its
+        first quad to the top right and bottom right vertices of its last
+        quad is a valid quad (see _validateQuad) and is within tolerance_km
+        of the run.
+
+        The distance between a merged quad and the quads it replaces is
+        measured both ways: from all of the vertices of the original quads
+        to the merged quad, and from points on the merged quad (on a grid
+        that includes the ends of the original quads along strike) to the
+        original quads. Since the distance from a site to the rupture can
+        change by at most this amount, the returned error bounds the change
+        of Rrup and Rjb, up to the sampling of the merged quad. GC2 distances
+        (Rx, Ry0) are not bounded by it.
+
+        :param tolerance_km:
+            Maximum distance (km) between merged and original quads.
+        :returns:
+            Tuple of a new Fault object, and the maximum distance (km)
+            between its quads and those of this fault.
+        """
+        # This is imported here since the distance module imports this one
+        from .distance import _calc_min_rupture_distance
+
+        lld = self._quad_lld
+        ecef = self._quad_ecef
+        segind = np.array(self._segment_index)
+        nq = lld.shape[0]
+
+        def merge(first, last):
+            # Merged quad (validated) and its distance to quads first:last
+            merged = np.stack((lld[first, 0], lld[last - 1, 1],
+                               lld[last - 1, 2], lld[first, 3]))
+            try:
+                merged = self._validateQuads(merged[np.newaxis])
+            except ShakeMapException:
+                return None, np.inf
+            x, y, z = latlon2ecef(merged[:, :, 1], merged[:, :, 0],
+                                  merged[:, :, 2])
+            mecef = np.stack((x, y, z), axis=-1)
+            orig = ecef[first:last]
+            d1 = _calc_min_rupture_distance(
+                mecef, orig.reshape((-1, 3)), prune=False)
+            # Points on the merged quad at the ends of the original quads
+            # (and half way) along strike, and at several depths
+            lengths = self._quad_lengths[first:last]
+            cum = np.cumsum(np.concatenate(([0.0], lengths)))
+            xfac = np.concatenate((cum, (cum[0:-1] + cum[1:]) / 2.0))
+            xfac = (xfac / cum[-1])[np.newaxis, :, np.newaxis]
+            yfac = np.linspace(0, 1, 5)[:, np.newaxis, np.newaxis]
+            m0, m1, m2, m3 = mecef[0]
+            top = m0 + (m1 - m0) * xfac
+            bot = m3 + (m2 - m3) * xfac
+            pts = (top + (bot - top) * yfac).reshape((-1, 3))
+            d2 = _calc_min_rupture_distance(orig, pts)
+            return merged[0], max(np.max(d1), np.max(d2))
+
+        quads = []
+        newseg = []
+        maxerror = 0.0
+        first = 0
+        while first < nq:
+            last = first + 1
+            quad = lld[first]
+            error = 0.0
+            while last < nq and segind[last] == segind[first]:
+                candidate, cerror = merge(first, last + 1)
+                if cerror > tolerance_km:
+                    break
+                quad = candidate
+                error = cerror
+                last += 1
+            quads.append(quad)
+            newseg.append(segind[first])
+            maxerror = max(maxerror, error)
+            first = last
+
+        flt = self._fromQuadArrays(np.array(quads), newseg, self._reference)
+        return flt, maxerror
+
     def writeFaultFile(self, faultfile):
         """
         Write fault data to fault file format as defined in ShakeMap Software
@@ -382,10 +492,7 @@ class Fault(object):
         :returns:
             Length of fault.
         """
-        flength = 0
-        for quad in self._quadrilaterals:
-            flength = flength + get_quad_length(quad)
-        return flength
+        return np.sum(self._quad_lengths)
 
     def getQuadrilaterals(self):
         """
@@ -395,7 +502,52 @@ class Fault(object):
             Each quad is a tuple of four Point objects
             (https://github.com/gem/oq-hazardlib/blob/master/openquake/hazardlib/geo/point.py)
         """
-        return copy.deepcopy(self._quadrilaterals)
+        return self._makeQuadList()
+
+    def getQuadVertices(self):
+        """
+        Return the vertices of all quadrilaterals as an array.
+
+        :returns:
+            Numpy array (Q x 4 x 3) of longitude, latitude, and depth (km) of
+            the four vertices of each quadrilateral.
+        """
+        return self._quad_lld.copy()
+
+    def getQuadsECEF(self, surface=False):
+        """
+        Return the ECEF coordinates of the vertices of all quadrilaterals.
+
+        :param surface:
+            Boolean; if True, the vertices are projected to the surface (depth
+            set to zero) before conversion, as is needed for Rjb.
+        :returns:
+            Numpy array (Q x 4 x 3) of ECEF x, y, z (m) of the four vertices
+            of each quadrilateral.
+        """
+        if surface:
+            return self._quad_ecef_surface.copy()
+        return self._quad_ecef.copy()
+
+    def getQuadNormals(self):
+        """
+        Return the unit normal vectors of all quadrilaterals (see
+        get_quad_normal).
+
+        :returns:
+            Numpy array (Q x 3) of normal vectors in ECEF coords.
+        """
+        return self._quad_normals.copy()
+
+    def getQuadStrikeVectors(self):
+        """
+        Return the unit vectors pointing in the direction of strike of all
+        quadrilaterals (see get_quad_strike_vector).
+
+        :returns:
+            Numpy array (Q x 3) of strike vectors in ECEF coords.
+        """
+        return self._quad_strike_vectors.copy()
 
     def getStrike(self):
         """
@@ -408,14 +560,10 @@ class Fault(object):
         :returns:
             Strike angle (float). 
         """
-        nq = len(self._quadrilaterals)
-        strikes = np.zeros(nq)
-        lengths = np.zeros(nq)
-        for i in range(nq):
-            P0 = self._quadrilaterals[i][0]
-            P1 = self._quadrilaterals[i][1]
-            strikes[i] = P0.azimuth(P1)
-            lengths[i] = get_quad_length(self._quadrilaterals[i])
+        lld = self._quad_lld
+        strikes = geodetic.azimuth(lld[:, 0, 0], lld[:, 0, 1],
+                                   lld[:, 1, 0], lld[:, 1, 1])
+        lengths = self._quad_lengths
         x = np.sin(np.radians(strikes))
         y = np.cos(np.radians(strikes))
         xbar = np.sum(x * lengths) / np.sum(lengths)
@@ -429,13 +577,7 @@ class Fault(object):
         :returns:
             Shallowest depth of all vertices (float).
         """
-        mindep = 9999999
-        for quad in self._quadrilaterals:
-            P0, P1, P2, P3 = quad
-            depths = np.array([P0.depth, P1.depth, P2.depth, P3.depth])
-            if np.min(depths) < mindep:
-                mindep = np.min(depths)
-        return mindep
+        return np.min(self._quad_lld[:, :, 2])
 
     def getDip(self):
         """
@@ -460,15 +602,7 @@ class Fault(object):
         :returns:
             Average width in km of all fault quadrilaterals (float).
         """
-        wsum = 0.0
-        for quad in self._quadrilaterals:
-            P0, P1, P2, P3 = quad
-            p0 = Vector.fromPoint(P0)
-            p1 = Vector.fromPoint(P1)
-            p3 = Vector.fromPoint(P3)
-            wsum += get_quad_width(p0, p1, p3)
-        mwidth = (wsum / len(self._quadrilaterals)) / 1000.0
-        return mwidth
+        return np.mean(self._quad_widths)
 
     def getIndividualWidths(self):
         """
@@ -478,15 +612,7 @@ class Fault(object):
         :returns:
             Array of quad widths in km of all fault quadrilaterals.
         """
-        nquad = self.getNumQuads()
-        widths = np.zeros(nquad)
-        for i in range(nquad):
-            P0, P1, P2, P3 = self._quadrilaterals[i]
-            p0 = Vector.fromPoint(P0)
-            p1 = Vector.fromPoint(P1)
-            p3 = Vector.fromPoint(P3)
-            widths[i] = get_quad_width(p0, p1, p3) / 1000.0
-        return widths
+        return self._quad_widths.copy()
 
     def getIndividualTopLengths(self):
         """
@@ -496,14 +622,7 @@ class Fault(object):
         :returns:
             Array of lengths in km of top edge of quadrilaterals.
         """
-        nquad = self.getNumQuads()
-        lengths = np.zeros(nquad)
-        for i in range(nquad):
-            P0, P1, P2, P3 = self._quadrilaterals[i]
-            p0 = Vector.fromPoint(P0)
-            p1 = Vector.fromPoint(P1)
-            lengths[i] = (p1 - p0).mag() / 1000.0
-        return lengths
+        return self._quad_lengths.copy()
 
     def _getTrapMeanLength(self, p0, p1, p2, p3):
         """
@@ -699,47 +818,150 @@ class Fault(object):
         istart = 0
         endpoints = list(np.where(np.isnan(self._lon))[0])
         endpoints.append(len(self._lon))
-        self._quadrilaterals = []
         self._segment_index = []
         segind = 0
+        vertind = []
         for iend in endpoints:
-            lonseg = self._lon[istart:iend][0:-1]  # remove closing points
-            latseg = self._lat[istart:iend][0:-1]
-            depthseg = self._depth[istart:iend][0:-1]
-            # each segment can have many contiguous quadrilaterals defined in it
-            # separations (nans) between segments mean that segments are not
-            # contiguous.
-            npoints = len(lonseg)
+            # each segment can have many contiguous quadrilaterals defined in
+            # it, with the closing point at iend - 1; separations (nans)
+            # between segments mean that segments are not contiguous.
+            npoints = iend - 1 - istart
             nquads = int((npoints - 4) / 2) + 1
-            startidx = 0
-            endidx = -1
-            for i in range(0, nquads):
-                topLeft = point.Point(lonseg[startidx], latseg[startidx],
-                                      depthseg[startidx])
-                topRight = point.Point(
-                    lonseg[
-                        startidx + 1],
-                    latseg[
-                        startidx + 1],
-                    depthseg[
-                        startidx + 1])
-                bottomRight = point.Point(
-                    lonseg[
-                        endidx - 1],
-                    latseg[
-                        endidx - 1],
-                    depthseg[
-                        endidx - 1])
-                bottomLeft = point.Point(lonseg[endidx], latseg[endidx],
-                                         depthseg[endidx])
-                surface = self._validateQuad(topLeft, topRight, bottomRight,
-                                             bottomLeft)
-                self._quadrilaterals.append(surface)
-                startidx += 1
-                endidx -= 1
+            i = np.arange(nquads)
+            # top left, top right, bottom right, bottom left
+            vertind.append(istart + np.column_stack(
+                (i, i + 1, npoints - 2 - i, npoints - 1 - i)))
             istart = iend + 1
             self._segment_index.extend([segind] * nquads)
             segind = segind + 1
+        vertind = np.concatenate(vertind)
+        lld = np.stack((self._lon[vertind], self._lat[vertind],
+                        self._depth[vertind]), axis=-1)
+        self._setQuadArrays(self._validateQuads(lld))
+
+    def _validateQuads(self, lld):
+        """
+        Validate and fix* all quadrilaterals at once. This does the same as
+        _validateQuad for each quad, as array operations.
+
+        :param lld:
+            Numpy array (Q x 4 x 3) of longitude, latitude, and depth of the
+            vertices of each quadrilateral.
+        :returns:
+            Numpy array (Q x 4 x 3) of (potentially) modified vertices.
+        :raises ShakeMapException:
+            See _validateQuad.
+        """
+        # Are the top and bottom edges both parallel to the surface?
+        depth = lld[:, :, 2]
+        topDepthsEqual = np.isclose(depth[:, 0], depth[:, 1], atol=2e-3)
+        bottomDepthsEqual = np.isclose(depth[:, 2], depth[:, 3], atol=2e-3)
+        if not np.all(topDepthsEqual & bottomDepthsEqual):
+            raise ShakeMapException(
+                'Top and bottom edges of fault quadrilateral must be parallel to the surface')
+        # Is top edge defined by first two vertices?
+        if np.any(depth[:, 1] > depth[:, 2]):
+            raise ShakeMapException(
+                'Top edge of a quadrilateral must be defined by the first two vertices')
+        # Translate vertices to ECEF
+        x, y, z = latlon2ecef(lld[:, :, 1], lld[:, :, 0], lld[:, :, 2])
+        ecef = np.stack((x, y, z), axis=-1)
+        # Is dip angle clockwise and btw 0-90 degrees?
+        right = _is_point_to_right(ecef[:, 0], ecef[:, 1], ecef[:, 2],
+                                   depth[:, 0])
+        irev = np.where(~right)[0]
+        if len(irev):
+            order = [1, 0, 3, 2]
+            lld = lld.copy()
+            lld[irev] = lld[irev][:, order]
+            ecef[irev] = ecef[irev][:, order]
+            if not np.all(_is_point_to_right(
+                    ecef[irev, 0], ecef[irev, 1], ecef[irev, 2],
+                    lld[irev, 0, 2])):
+                raise ShakeMapException(
+                    'Third vertex of quadrilateral must be to the right of the second vertex')
+            for i in irev:
+                print('Reversing quad where dip not between 0 and 90 degrees.')
+        # Are all 4 points (reasonably) co-planar?
+        p0 = VectorArray(ecef[:, 0])
+        p1 = VectorArray(ecef[:, 1])
+        p2 = VectorArray(ecef[:, 2])
+        p3 = VectorArray(ecef[:, 3])
+        # Calculate normalized vector along top edge
+        v0 = (p1 - p0).norm()
+        # Calculate distance btw p3 and p2
+        d = (p3 - p2).mag()
+        # get the new P2 value
+        newp2 = p3 + v0 * d
+        dnormal = _get_distance_to_planes(ecef[:, 0:3], ecef[:, 2])
+        # Square root of the trapezoid area (see _getTrapMeanLength)
+        AB = p0 - p1
+        AC = p0 - p3
+        h = AB.cross(AC).cross(AB).norm().dot(AC)
+        a = (p1 - p0).mag()
+        b = (newp2 - p3).mag()
+        geometricMean = np.sqrt(((a + b) / 2.0) * h)
+        if np.any(dnormal / geometricMean > OFFPLANE_TOLERANCE):
+            raise ShakeMapException(
+                'Points in quadrilateral are not co-planar')
+        ecef[:, 2] = newp2.getArray()
+        lat, lon, dep = ecef2latlon(ecef[:, :, 0].ravel(),
+                                    ecef[:, :, 1].ravel(),
+                                    ecef[:, :, 2].ravel())
+        return np.stack((lon, lat, dep), axis=-1).reshape(ecef.shape)
+
+    def _setQuadArrays(self, lld):
+        """
+        Store the (validated) quadrilaterals, and compute the geometric
+        quantities that are needed repeatedly (ECEF vertices, normal and
+        strike vectors, lengths, and widths) once for all quads.
+
+        :param lld:
+            Numpy array (Q x 4 x 3) of longitude, latitude, and depth of the
+            vertices of each quadrilateral.
+        """
+        self._quad_lld = lld
+        self._quadlist = None
+
+        x, y, z = latlon2ecef(lld[:, :, 1], lld[:, :, 0], lld[:, :, 2])
+        self._quad_ecef = np.stack((x, y, z), axis=-1)
+        x, y, z = latlon2ecef(lld[:, :, 1], lld[:, :, 0], 0.0)
+        self._quad_ecef_surface = np.stack((x, y, z), axis=-1)
+
+        p0 = VectorArray(self._quad_ecef[:, 0, :])
+        p1 = VectorArray(self._quad_ecef[:, 1, :])
+        p3 = VectorArray(self._quad_ecef[:, 3, :])
+        v1 = p1 - p0
+        self._quad_normals = (p3 - p0).cross(v1).norm().getArray()
+        self._quad_strike_vectors = v1.norm().getArray()
+        self._quad_lengths = v1.mag() / 1000
+        # Same as get_quad_width
+        AB = p0 - p1
+        AC = p0 - p3
+        t1 = AB.cross(AC).cross(AB).norm()
+        self._quad_widths = t1.dot(AC) / 1000.0
+
+    def _makeQuadList(self):
+        """
+        Create a list of quadrilaterals from the vertex array.
+
+        :returns:
+            List of quadrilaterals; each quad is a list of four Point objects.
+        """
+        return [[point.Point(lon, lat, dep) for lon, lat, dep in quad]
+                for quad in self._quad_lld]
+
+    @property
+    def _quadrilaterals(self):
+        """
+        List of quadrilaterals, created from the vertex array when it is
+        first needed. This is kept for code that works with Point objects;
+        the array accessors (e.g., getQuadVertices, getQuadsECEF) should be
+        preferred.
+        """
+        if self._quadlist is None:
+            self._quadlist = self._makeQuadList()
+        return self._quadlist
 
     def _getSegmentIndex(self):
         """
@@ -750,6 +972,21 @@ class Fault(object):
         """
         return copy.deepcopy(self._segment_index)
 
+    def getGC2Frame(self):
+        """
+        Return the GC2Frame for this fault. The frame is only computed once
+        and is cached on the fault; it is recomputed if the segment index has
+        been changed.
+
+        :returns:
+            GC2Frame object.
+        """
+        frame = getattr(self, '_gc2frame', None)
+        if frame is None or frame.segment_index != list(self._segment_index):
+            frame = GC2Frame(self)
+            self._gc2frame = frame
+        return frame
+
     def getLats(self):
         """
         Return a copy of the array of latitude points for the fault.
@@ -793,7 +1030,7 @@ class Fault(object):
         :returns:
             number of fault quadrilaterals.
         """
-        return len(self._quadrilaterals)
+        return self._quad_lld.shape[0]
 
     def getFaultAsArrays(self):
         """
@@ -849,6 +1086,159 @@ class Fault(object):
             istart = inan[i] + 1
 
 
+class GC2Frame(object):
+    """
+    Quantities needed to compute the GC2 coordinates U and T of Spudich and
+    Chiou (2015) http://dx.doi.org/10.3133/ofr20151028 that depend only on
+    the fault, i.e., the grouping of quads into segments, the nominal strike
+    and strike discordance of multi-segment faults, and the quad lengths and
+    U offsets. These are the same for every set of sites, so they are computed
+    once per fault (see Fault.getGC2Frame).
+    """
+
+    def __init__(self, fault):
+        """
+        Constructor for GC2Frame.
+
+        :param fault:
+            Fault object.
+        """
+        verts = fault.getQuadVertices()
+        self.segment_index = list(fault._segment_index)
+        segindnp = np.array(self.segment_index)
+        nseg = len(np.unique(segindnp))
+        nq = len(verts)
+        self.nseg = nseg
+
+        # Quad lengths
+        self.quad_lengths = fault.getIndividualTopLengths()
+
+        # Local Cartesian frame (km) around the top edge of the rupture. Sites
+        # are projected into it once and then u_i and t_i are computed for
+        # all quads.
+        lon0 = verts[:, 0, 0]
+        lat0 = verts[:, 0, 1]
+        lon1 = verts[:, 1, 0]
+        lat1 = verts[:, 1, 1]
+        west = min(np.min(lon0), np.min(lon1))
+        east = max(np.max(lon0), np.max(lon1))
+        south = min(np.min(lat0), np.min(lat1))
+        north = max(np.max(lat0), np.max(lat1))
+        self._bounds = (west, east, north, south)
+        self.proj = get_orthographic_projection(*self._bounds)
+        self.p0x, self.p0y = self.proj(lon0, lat0)
+        self.p1x, self.p1y = self.proj(lon1, lat1)
+
+        # Unit vectors pointing along strike (u) and normal to strike (t)
+        dx = self.p1x - self.p0x
+        dy = self.p1y - self.p0y
+        mag = np.sqrt(dx * dx + dy * dy)
+        self.u_hat = np.column_stack((dx / mag, dy / mag))
+        self.t_hat = np.column_stack((dy / mag, -dx / mag))
+
+        self.p_origin = None
+        self.dc = None
+        self.bhat = None
+        self.iq0 = None
+        self.iq1 = None
+        if nseg > 1:
+            # Index of first and last quad for each segment
+            iq0 = np.unique(segindnp, return_index=True)[1]
+            iq1 = nq - 1 - np.unique(segindnp[::-1], return_index=True)[1]
+
+            # Segment end points (lon, lat); the first and last top vertex of
+            # each segment, and the top vertices at the "inner" ends that are
+            # also candidates for the nominal strike end points.
+            start = verts[iq0, 0, :2]
+            end = verts[iq1, 1, :2]
+            last_start = verts[iq1, 0, :2]
+            first_end = verts[iq0, 1, :2]
+
+            # Nominal strike is defined by the two segment end points that
+            # are farthest apart. Candidates for the first point are the start
+            # and end of one segment, and for the second point are the last
+            # quad's first vertex and first quad's second vertex of a later
+            # segment. Distances for all pairs are computed at once; the
+            # array is ordered so that argmax picks the first pair in the
+            # order (segment pair, first point, second point).
+            c0 = np.concatenate((start, end))
+            c1 = np.concatenate((last_start, first_end))
+            lon0 = c0[:, 0].reshape(2, nseg).T
+            lat0 = c0[:, 1].reshape(2, nseg).T
+            lon1 = c1[:, 0].reshape(2, nseg).T
+            lat1 = c1[:, 1].reshape(2, nseg).T
+            # Shape is (first segment, second segment, first point,
+            # second point)
+            i0 = (slice(None), np.newaxis, slice(None), np.newaxis)
+            i1 = (np.newaxis, slice(None), np.newaxis, slice(None))
+            dist = geodetic.distance(lon0[i0], lat0[i0], 0.0,
+                                     lon1[i1], lat1[i1], 0.0)
+            s0, s1 = np.triu_indices(nseg, k=1)
+            dist = dist[s0, s1].reshape(-1)
+            imax = np.argmax(dist)
+            if not dist[imax] > 0:
+                raise ShakeMapException(
+                    'Cannot determine nominal strike of fault.')
+            ipair, ipt = divmod(imax, 4)
+            p0ind, p1ind = divmod(ipt, 2)
+            A0 = c0[p0ind * nseg + s0[ipair]]
+            A1 = c1[p1ind * nseg + s1[ipair]]
+
+            # ECEF (at the surface) of the nominal strike end points
+            p_origin = Vector(*latlon2ecef(A0[1], A0[0], 0.0))
+            a1 = Vector(*latlon2ecef(A1[1], A1[0], 0.0))
+            ahat = (a1 - p_origin).norm()
+
+            # Vectors along each segment trace (ECEF, at the surface)
+            sx, sy, sz = latlon2ecef(start[:, 1], start[:, 0], np.zeros(nseg))
+            ex, ey, ez = latlon2ecef(end[:, 1], end[:, 0], np.zeros(nseg))
+            b_prime = np.column_stack((ex - sx, ey - sy, ez - sz))
+            e_j = np.sum(b_prime * ahat.getArray(), axis=1)
+            E = np.sum(e_j)
+
+            # Array of discordancy
+            dc = np.sign(e_j) * np.sign(E)
+            b = np.sum(b_prime * dc[:, np.newaxis], axis=0)
+            bhat = Vector.fromTuple(b).norm()
+
+            # Distance (km) of each segment's start along the nominal strike
+            seg_offsets = np.dot(
+                (np.column_stack((sx, sy, sz)) - p_origin.getArray()) *
+                dc[:, np.newaxis], bhat.getArray()) / 1000.0
+
+            self.p_origin = p_origin
+            self.dc = dc
+            self.bhat = bhat
+            self.iq0 = iq0
+            self.iq1 = iq1
+
+        # Offset added to u_i for each quad: the length of the preceding
+        # quads of its segment plus the offset of the segment (for a single
+        # segment, of all preceding quads). Also the length of the fault
+        # used for Ry and Ry0.
+        lengths = self.quad_lengths
+        if nseg == 1:
+            self.u_offsets = np.r_[0.0, np.cumsum(lengths)[:-1]]
+        else:
+            self.u_offsets = np.zeros(nq)
+            for iseg, seg in enumerate(np.unique(segindnp)):
+                iq = np.flatnonzero(segindnp == seg)
+                self.u_offsets[iq] = seg_offsets[iseg] + \
+                    np.r_[0.0, np.cumsum(lengths[iq])[:-1]]
+        self.total_length = np.cumsum(lengths)[-1]
+        self.end_length = self.u_offsets[-1] + lengths[-1]
+
+    def __getstate__(self):
+        # The projection may not be picklable; it is rebuilt on unpickling
+        state = self.__dict__.copy()
+        del state['proj']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.proj = get_orthographic_projection(*self._bounds)
+
+
 def get_quad_width(p0, p1, p3):
     """
     Return width of an individual planar trapezoid, where the p0-p1 distance
@@ -870,9 +1260,9 @@ def get_quad_width(p0, p1, p3):
 
     return width
 
-def get_quad_mesh(q, dx):
+def get_quad_mesh(q, dx, cache=True):
     """
-    Length of top eduge of a quadrilateral.
+    Mesh of subfaults of a quadrilateral.
 
     :param q:
         A quadrilateral.
@@ -880,6 +1270,10 @@ def get_quad_mesh(q, dx):
         Target dx in km; used to get nx and ny of mesh, but mesh snaps
         to edges of fault so actual dx/dy will not actually equal this
         value in general.
+    :param cache:
+        Boolean; if True, meshes are cached by the quad vertices and dx, so
+        that repeated calls for the same quad return the same mesh. The
+        arrays of a cached mesh are read-only.
     :returns:
         Mesh dictionary, which includes numpy arrays:
 
@@ -889,85 +1283,62 @@ def get_quad_mesh(q, dx):
         - ulx: upper left x coordinate in ECEF coords.
         - etc.
     """
+    if cache:
+        key = tuple((P.longitude, P.latitude, P.depth) for P in q) + \
+            (float(dx),)
+        mesh = _mesh_cache.get(key)
+        if mesh is not None:
+            _mesh_cache.move_to_end(key)
+            return mesh
+
     P0, P1, P2, P3 = q
-    p0 = Vector.fromPoint(P0)  # fromPoint converts to ECEF
-    p1 = Vector.fromPoint(P1)
-    p2 = Vector.fromPoint(P2)
-    p3 = Vector.fromPoint(P3)
+    p0 = Vector.fromPoint(P0).getArray()  # fromPoint converts to ECEF
+    p1 = Vector.fromPoint(P1).getArray()
+    p2 = Vector.fromPoint(P2).getArray()
+    p3 = Vector.fromPoint(P3).getArray()
     # Get nx based on length of top edge, minimum allowed is 2
     toplen_km = get_quad_length(q)
     nx = int(np.max([round(toplen_km / dx, 0) + 1, 2]))
 
-    # Get array of points along top and bottom edges
-    xfac = np.linspace(0, 1, nx)
-    topp = [p0 + (p1 - p0) * a for a in xfac]
-    botp = [p3 + (p2 - p3) * a for a in xfac]
+    # Get array (nx x 3) of points along top and bottom edges
+    xfac = np.linspace(0, 1, nx)[:, np.newaxis]
+    topp = p0 + (p1 - p0) * xfac
+    botp = p3 + (p2 - p3) * xfac
 
     # Get ny based on mean length of vectors connecting top and bottom points
-    ylen_km = np.ones(nx)
-    for i in range(nx):
-        ylen_km[i] = (topp[i] - botp[i]).mag() / 1000
+    d = topp - botp
+    ylen_km = np.sqrt(np.sum(d * d, axis=1)) / 1000
     ny = int(np.max([round(np.mean(ylen_km) / dx, 0) + 1, 2]))
-    yfac = np.linspace(0, 1, ny)
+    yfac = np.linspace(0, 1, ny)[:, np.newaxis, np.newaxis]
 
-    # Build mesh: dict of ny by nx arrays (x, y, z):
-    mesh = {'x': np.zeros([ny, nx]), 'y': np.zeros(
-        [ny, nx]), 'z': np.zeros([ny, nx])}
-    for i in range(nx):
-        mpts = [topp[i] + (botp[i] - topp[i]) * a for a in yfac]
-        mesh['x'][:, i] = [a.x for a in mpts]
-        mesh['y'][:, i] = [a.y for a in mpts]
-        mesh['z'][:, i] = [a.z for a in mpts]
+    # Build mesh: dict of ny by nx arrays (x, y, z)
+    pts = topp + (botp - topp) * yfac
+    mesh = {'x': pts[:, :, 0], 'y': pts[:, :, 1], 'z': pts[:, :, 2]}
 
     # Make arrays of pixel corners
-    mesh['llx'] = mesh['x'][1:, 0:-1]
-    mesh['lrx'] = mesh['x'][1:, 1:]
-    mesh['ulx'] = mesh['x'][0:-1, 0:-1]
-    mesh['urx'] = mesh['x'][0:-1, 1:]
-    mesh['lly'] = mesh['y'][1:, 0:-1]
-    mesh['lry'] = mesh['y'][1:, 1:]
-    mesh['uly'] = mesh['y'][0:-1, 0:-1]
-    mesh['ury'] = mesh['y'][0:-1, 1:]
-    mesh['llz'] = mesh['z'][1:, 0:-1]
-    mesh['lrz'] = mesh['z'][1:, 1:]
-    mesh['ulz'] = mesh['z'][0:-1, 0:-1]
-    mesh['urz'] = mesh['z'][0:-1, 1:]
-    mesh['cpx'] = np.zeros_like(mesh['llx'])
-    mesh['cpy'] = np.zeros_like(mesh['llx'])
-    mesh['cpz'] = np.zeros_like(mesh['llx'])
-
-    # i and j are indices over subfaults
-    ni, nj = mesh['llx'].shape
-    for i in range(0, ni):
-        for j in range(0, nj):
-            # Fault corner points
-            pp0 = Vector(
-                mesh['ulx'][
-                    i, j], mesh['uly'][
-                    i, j], mesh['ulz'][
-                    i, j])
-            pp1 = Vector(
-                mesh['urx'][
-                    i, j], mesh['ury'][
-                    i, j], mesh['urz'][
-                    i, j])
-            pp2 = Vector(
-                mesh['lrx'][
-                    i, j], mesh['lry'][
-                    i, j], mesh['lrz'][
-                    i, j])
-            pp3 = Vector(
-                mesh['llx'][
-                    i, j], mesh['lly'][
-                    i, j], mesh['llz'][
-                    i, j])
-            # Find center of quad
-            mp0 = pp0 + (pp1 - pp0) * 0.5
-            mp1 = pp3 + (pp2 - pp3) * 0.5
-            cp = mp0 + (mp1 - mp0) * 0.5
-            mesh['cpx'][i, j] = cp.x
-            mesh['cpy'][i, j] = cp.y
-            mesh['cpz'][i, j] = cp.z
+    ul = pts[0:-1, 0:-1]
+    ur = pts[0:-1, 1:]
+    lr = pts[1:, 1:]
+    ll = pts[1:, 0:-1]
+    for name, corner in [('ll', ll), ('lr', lr), ('ul', ul), ('ur', ur)]:
+        mesh[name + 'x'] = corner[:, :, 0]
+        mesh[name + 'y'] = corner[:, :, 1]
+        mesh[name + 'z'] = corner[:, :, 2]
+
+    # Find center of each subfault
+    mp0 = ul + (ur - ul) * 0.5
+    mp1 = ll + (lr - ll) * 0.5
+    cp = mp0 + (mp1 - mp0) * 0.5
+    mesh['cpx'] = cp[:, :, 0]
+    mesh['cpy'] = cp[:, :, 1]
+    mesh['cpz'] = cp[:, :, 2]
+
+    if cache:
+        for arr in mesh.values():
+            arr.setflags(write=False)
+        _mesh_cache[key] = mesh
+        while len(_mesh_cache) > MESH_CACHE_SIZE:
+            _mesh_cache.popitem(last=False)
     return mesh
 
 
@@ -1077,6 +1448,62 @@ def get_quad_slip(q, rake):
     return slp_ecef
 
 
+def _is_point_to_right(p0, p1, p2, depth0):
+    """
+    Check if the third vertex of quadrilaterals is to the right of the top
+    edge (see Fault._isPointToRight).
+
+    :param p0:
+        Numpy array (Q x 3) of ECEF coordinates of the first vertices.
+    :param p1:
+        Numpy array (Q x 3) of ECEF coordinates of the second vertices.
+    :param p2:
+        Numpy array (Q x 3) of ECEF coordinates of the third vertices.
+    :param depth0:
+        Numpy array (Q) of depths (km) of the first vertices.
+    :returns:
+        Boolean array (Q); True where the third vertex is to the right.
+    """
+    eps = 1e-6
+    p0 = VectorArray(p0)
+    qnv = (VectorArray(p2) - p0).cross(VectorArray(p1) - p0).norm()
+    tmp = (p0 + qnv).getArray()
+    tmplat, tmplon, tmpz = ecef2latlon(tmp[:, 0], tmp[:, 1], tmp[:, 2])
+    return (tmpz - depth0) < eps
+
+
+def _get_distance_to_planes(planepoints, otherpoints):
+    """
+    Calculate the distances of points to planes (see
+    Fault.getDistanceToPlane).
+
+    :param planepoints:
+        Numpy array (Q x 3 x 3) of three ECEF points defining each plane.
+    :param otherpoints:
+        Numpy array (Q x 3) of ECEF points to compare to the planes.
+    :returns:
+        Numpy array (Q) of distances (m) from the points to the planes.
+    """
+    D = np.linalg.det(planepoints)
+    ones = np.ones(planepoints.shape[0:2])
+    abc = np.zeros(otherpoints.shape)
+    for i in range(3):
+        m = planepoints.copy()
+        m[:, :, i] = ones
+        abc[:, i] = np.linalg.det(m)
+    d = -1
+    nonzero = D != 0
+    abc[nonzero] = (-d / D[nonzero])[:, np.newaxis] * abc[nonzero]
+    a, b, c = abc[:, 0], abc[:, 1], abc[:, 2]
+    numer = np.abs(a * otherpoints[:, 0] +
+                   b * otherpoints[:, 1] +
+                   c * otherpoints[:, 2] + d)
+    denom = np.sqrt(a**2 + b**2 + c**2)
+    dist = np.zeros(len(D))
+    dist[nonzero] = numer[nonzero] / denom[nonzero]
+    return dist
+
+
 def get_quad_length(q):
     """
     Length of top eduge of a quadrilateral.
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import json
+import os
+
+# third party imports
+import numpy as np
+
+# local imports
+from shakemap.utils.exception import ShakeMapException
+
+# Bump this when the layout of the library changes
+LIBRARY_VERSION = 1
+
+
+class FaultLibrary(object):
+    """
+    Columnar, memory-mapped library of ruptures (e.g., a UCERF3 rupture
+    set). The library is a directory of .npy files:
+
+    - vertices.npy: (Q x 4 x 3) longitude, latitude, and depth of the
+      (validated) quad vertices of all ruptures, one rupture after another.
+    - segment_index.npy: (Q) segment index of each quad.
+    - offsets.npy: (N + 1) index of the first quad of each rupture; the
+      quads of rupture i are offsets[i]:offsets[i + 1].
+    - ids.npy: (N) rupture ids.
+    - sorted_ids.npy and id_order.npy: (N) the sorted rupture ids and their
+      positions in the library, which are the id to offset index.
+    - rupture_<name>.npy: (N) rupture parameters (e.g., magnitude, dip,
+      width, rake, name).
+    - quad_<name>.npy: (Q) quad parameters.
+
+    plus a metadata.json file. The arrays are loaded memory-mapped, so a
+    rupture is read without loading or parsing the rest of the library.
+    """
+
+    def __init__(self, libdir):
+        """
+        Constructor for FaultLibrary.
+
+        :param libdir:
+            Library directory (see write).
+        :raises ShakeMapException:
+            if libdir is not a fault library of this version.
+        """
+        mfile = os.path.join(libdir, 'metadata.json')
+        if not os.path.isfile(mfile):
+            raise ShakeMapException(
+                '%s is not a fault library.' % libdir)
+        with open(mfile, 'rt') as f:
+            metadata = json.load(f)
+        if metadata.get('version') != LIBRARY_VERSION:
+            raise ShakeMapException(
+                'Fault library %s has unsupported version %s.' %
+                (libdir, metadata.get('version')))
+        self._libdir = libdir
+        self._reference = metadata.get('reference', '')
+        self._rupture_columns = metadata['rupture_columns']
+        self._quad_columns = metadata['quad_columns']
+        self._vertices = self._load('vertices')
+        self._segment_index = self._load('segment_index')
+        self._offsets = self._load('offsets')
+        self._ids = self._load('ids')
+        self._sorted_ids = self._load('sorted_ids')
+        self._id_order = self._load('id_order')
+        self._columns = {}
+
+    def _load(self, name):
+        """
+        Load one array of the library, memory-mapped.
+
+        :param name:
+            Name of the array (file name without .npy).
+        :returns:
+            Read-only memory-mapped numpy array.
+        """
+        return np.load(os.path.join(self._libdir, name + '.npy'),
+                       mmap_mode='r')
+
+    @classmethod
+    def write(cls, libdir, ids, faults, columns=None, quad_columns=None,
+              reference=''):
+        """
+        Write a fault library.
+
+        :param libdir:
+            Library directory; created if it does not exist.
+        :param ids:
+            Sequence of (unique) rupture ids; these are converted to strings.
+        :param faults:
+            Iterable of Fault objects, one for each id.
+        :param columns:
+            Dictionary of rupture parameters; each value is a sequence with
+            one value for each rupture (e.g., {'magnitude': [...]}).
+        :param quad_columns:
+            Dictionary of quad parameters; each value is a sequence with one
+            sequence for each rupture, with one value for each quad.
+        :param reference:
+            String citeable reference for the ruptures.
+        :returns:
+            FaultLibrary object.
+        :raises ShakeMapException:
+            if the ids are not unique or the number of values of the columns
+            does not match the number of ruptures or quads.
+        """
+        ids = np.array([str(i) for i in ids])
+        if len(np.unique(ids)) != len(ids):
+            raise ShakeMapException('Rupture ids must be unique.')
+        if columns is None:
+            columns = {}
+        if quad_columns is None:
+            quad_columns = {}
+
+        vertices = []
+        segment_index = []
+        nquads = []
+        for flt in faults:
+            vertices.append(flt.getQuadVertices())
+            segment_index.append(np.array(flt._getSegmentIndex(),
+                                          dtype=np.int32))
+            nquads.append(flt.getNumQuads())
+        if len(nquads) != len(ids):
+            raise ShakeMapException(
+                'Number of faults must equal the number of ids.')
+        offsets = np.concatenate(([0], np.cumsum(nquads))).astype(np.int64)
+
+        id_order = np.argsort(ids)
+        arrays = {'vertices': np.concatenate(vertices),
+                  'segment_index': np.concatenate(segment_index),
+                  'offsets': offsets,
+                  'ids': ids,
+                  'sorted_ids': ids[id_order],
+                  'id_order': id_order}
+        for name, values in columns.items():
+            values = np.array(values)
+            if values.shape[0] != len(ids):
+                raise ShakeMapException(
+                    'Column %s must have one value for each rupture.' % name)
+            arrays['rupture_' + name] = values
+        for name, values in quad_columns.items():
+            values = np.concatenate([np.array(v).reshape(-1)
+                                     for v in values])
+            if values.shape[0] != offsets[-1]:
+                raise ShakeMapException(
+                    'Column %s must have one value for each quad.' % name)
+            arrays['quad_' + name] = values
+
+        if not os.path.isdir(libdir):
+            os.makedirs(libdir)
+        for name, values in arrays.items():
+            np.save(os.path.join(libdir, name + '.npy'), values)
+        metadata = {'version': LIBRARY_VERSION,
+                    'reference': reference,
+                    'rupture_columns': sorted(columns.keys()),
+                    'quad_columns': sorted(quad_columns.keys())}
+        # The metadata file is written last, so a partially written library
+        # cannot be opened
+        with open(os.path.join(libdir, 'metadata.json'), 'wt') as f:
+            json.dump(metadata, f)
+        return cls(libdir)
+
+    def __len__(self):
+        """
+        :returns:
+            Number of ruptures in the library.
+        """
+        return len(self._ids)
+
+    def __contains__(self, rupture_id):
+        """
+        :param rupture_id:
+            Rupture id.
+        :returns:
+            True if the rupture is in the library.
+        """
+        return self._getIndex(rupture_id) is not None
+
+    def _getIndex(self, rupture_id):
+        """
+        Find the position of a rupture in the library, using a binary search
+        of the sorted ids.
+
+        :param rupture_id:
+            Rupture id.
+        :returns:
+            Index of the rupture, or None if it is not in the library.
+        """
+        rupture_id = str(rupture_id)
+        sorted_ids = self._sorted_ids
+        i = np.searchsorted(sorted_ids, rupture_id)
+        if i < len(sorted_ids) and sorted_ids[i] == rupture_id:
+            return int(self._id_order[i])
+        return None
+
+    def getIds(self):
+        """
+        Return the rupture ids, in the order of the library.
+
+        :returns:
+            List of rupture ids (strings).
+        """
+        return [str(i) for i in self._ids]
+
+    def getReference(self):
+        """
+        Return the reference of the library.
+
+        :returns:
+            String citeable reference.
+        """
+        return self._reference
+
+    def getColumnNames(self):
+        """
+        Return the names of the rupture and quad parameters.
+
+        :returns:
+            Tuple of lists of rupture parameter names and quad parameter
+            names.
+        """
+        return list(self._rupture_columns), list(self._quad_columns)
+
+    def getOffsets(self, rupture_id):
+        """
+        Return the range of quads of a rupture.
+
+        :param rupture_id:
+            Rupture id.
+        :returns:
+            Tuple of the index of the first quad and one past the last quad
+            of the rupture.
+        :raises ShakeMapException:
+            if the rupture is not in the library.
+        """
+        i = self._getIndex(rupture_id)
+        if i is None:
+            raise ShakeMapException(
+                'Rupture %s is not in the fault library.' % rupture_id)
+        return int(self._offsets[i]), int(self._offsets[i + 1])
+
+    def getQuads(self, rupture_id):
+        """
+        Return the quad vertices and segment index of a rupture.
+
+        :param rupture_id:
+            Rupture id.
+        :returns:
+            Tuple of numpy array (Q x 4 x 3) of longitude, latitude, and
+            depth of the quad vertices and array (Q) of segment indices.
+        """
+        start, end = self.getOffsets(rupture_id)
+        return (np.array(self._vertices[start:end]),
+                np.array(self._segment_index[start:end]))
+
+    def _getColumn(self, name):
+        """
+        Load (memory-mapped) a parameter column.
+
+        :param name:
+            File name of the column.
+        :returns:
+            Numpy array.
+        """
+        if name not in self._columns:
+            self._columns[name] = self._load(name)
+        return self._columns[name]
+
+    def getRupture(self, rupture_id):
+        """
+        Return the parameters of a rupture.
+
+        :param rupture_id:
+            Rupture id.
+        :returns:
+            Dictionary of rupture parameters (e.g., magnitude, dip).
+        :raises ShakeMapException:
+            if the rupture is not in the library.
+        """
+        i = self._getIndex(rupture_id)
+        if i is None:
+            raise ShakeMapException(
+                'Rupture %s is not in the fault library.' % rupture_id)
+        return dict((name, self._getColumn('rupture_' + name)[i].item())
+                    for name in self._rupture_columns)
+
+    def getQuadColumn(self, name, rupture_id):
+        """
+        Return a quad parameter of a rupture.
+
+        :param name:
+            Name of the quad parameter.
+        :param rupture_id:
+            Rupture id.
+        :returns:
+            Numpy array with one value for each quad of the rupture.
+        :raises ShakeMapException:
+            if the rupture or the parameter is not in the library.
+        """
+        if name not in self._quad_columns:
+            raise ShakeMapException(
+                'Quad parameter %s is not in the fault library.' % name)
+        start, end = self.getOffsets(rupture_id)
+        return np.array(self._getColumn('quad_' + name)[start:end])
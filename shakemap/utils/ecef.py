@@ -63,7 +63,7 @@ def ecef2latlon(x, y, z):
     # convert lat,lon to dd, and alt to depth positive DOWN in km
     lat = lat * RADIANS_TO_DEGREES
     lon = lon * RADIANS_TO_DEGREES
-    lon[lon > 180] = lon - 360.0
+    lon[lon > 180] -= 360.0
     dep = -alt / 1000.0
     # if input values were scalar, give that back to them
     if inputIsScalar:
@@ -100,3 +100,102 @@ def latlon2ecef(lat, lon, dep):
     z = (N * (1.0 - WGS84_E * WGS84_E) + alt) * slat
 
     return (x, y, z)
+
+
+def latlon2ecef_grid(lats, lons, dep=0.0, out=None, dtype=np.float64):
+    """
+    Convert a regular grid of lat,lon,depth to Earth-Centered-Earth-Fixed
+    (ECEF) cartesian coordinates. The trigonometric functions are only
+    evaluated for each row latitude and column longitude, and then combined
+    by broadcasting. The results are identical to those of latlon2ecef for
+    the corresponding 2D arrays (e.g., from numpy.meshgrid).
+
+    :parameter lats:
+        A 1D numpy array of the latitudes of the rows (decimal degrees).
+    :parameter lons:
+        A 1D numpy array of the longitudes of the columns (decimal degrees).
+    :parameter dep:
+        A scalar, or a numpy array (rows x columns), of depths (km), positive
+        DOWN.
+    :parameter out:
+        Optional tuple of three numpy arrays (rows x columns) into which x, y,
+        and z are written.
+    :parameter dtype:
+        Numpy dtype of the outputs if out is not given. The calculations are
+        done in float64; with float32 the coordinates are rounded to about
+        half a meter.
+    :return:
+        Tuple of x,y,z numpy arrays (rows x columns) of ECEF coordinates.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    shape = (len(lats), len(lons))
+    alt = -np.asarray(dep, dtype=np.float64) * 1000.0
+    clat = np.cos(lats * DEGREES_TO_RADIANS)[:, np.newaxis]
+    slat = np.sin(lats * DEGREES_TO_RADIANS)[:, np.newaxis]
+    clon = np.cos(lons * DEGREES_TO_RADIANS)[np.newaxis, :]
+    slon = np.sin(lons * DEGREES_TO_RADIANS)[np.newaxis, :]
+
+    N = WGS84_A / np.sqrt(1.0 - WGS84_E * WGS84_E * slat * slat)
+
+    if out is None:
+        out = tuple(np.empty(shape, dtype=dtype) for i in range(3))
+    x, y, z = out
+    r = (N + alt) * clat
+    np.multiply(r, clon, out=x)
+    np.multiply(r, slon, out=y)
+    z[...] = (N * (1.0 - WGS84_E * WGS84_E) + alt) * slat
+
+    return (x, y, z)
+
+
+def is_meshgrid(lat, lon):
+    """
+    Check whether lat,lon are 2D arrays of a regular grid (as made by
+    numpy.meshgrid), i.e., latitude is constant along rows and longitude is
+    constant along columns.
+
+    :parameter lat:
+        A numpy array of latitude values (decimal degrees).
+    :parameter lon:
+        A numpy array of longitude values (decimal degrees).
+    :return:
+        Boolean.
+    """
+    lat = np.asarray(lat)
+    lon = np.asarray(lon)
+    if lat.ndim != 2 or lat.shape != lon.shape:
+        return False
+    return bool(np.all(lat == lat[:, :1]) and np.all(lon == lon[:1, :]))
+
+
+def latlon2ecef_mesh(lat, lon, dep, out=None, dtype=np.float64):
+    """
+    Convert lat,lon,depth to ECEF coordinates, using latlon2ecef_grid if
+    lat,lon are a regular 2D grid (see is_meshgrid) and latlon2ecef
+    otherwise.
+
+    :parameter lat:
+        A numpy array of latitude values (decimal degrees).
+    :parameter lon:
+        A numpy array of longitude values (decimal degrees).
+    :parameter dep:
+        A numpy array (or scalar value) of depths (km), positive DOWN.
+    :parameter out:
+        Optional tuple of three numpy arrays, with the shape of lat, into
+        which x, y, and z are written.
+    :parameter dtype:
+        Numpy dtype of the outputs if out is not given; see
+        latlon2ecef_grid.
+    :return:
+        Tuple of x,y,z numpy arrays of ECEF coordinates.
+    """
+    if is_meshgrid(lat, lon):
+        return latlon2ecef_grid(lat[:, 0], lon[0, :], dep, out=out,
+                                dtype=dtype)
+    xyz = latlon2ecef(lat, lon, dep)
+    if out is None:
+        return tuple(np.asarray(a, dtype=dtype) for a in xyz)
+    for a, b in zip(out, xyz):
+        a[...] = b
+    return out
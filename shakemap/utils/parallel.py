@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import sys
+
+# third party imports
+import numpy as np
+
+# local imports
+from shakemap.utils.exception import ShakeMapException
+
+
+def check_parallel():
+    """
+    Check that the parallel mode (n_workers > 1) can be used; it needs
+    multiprocessing.shared_memory (Python 3.8 or later). Only the parallel
+    code paths call this, so the serial paths work with older Pythons.
+
+    :returns:
+        The multiprocessing.shared_memory module.
+    :raises ShakeMapException:
+        if the parallel mode is not available.
+    """
+    if sys.version_info < (3, 8):
+        raise ShakeMapException(
+            'Parallel mode (n_workers > 1) requires Python 3.8 or later.')
+    from multiprocessing import shared_memory
+    return shared_memory
+
+
+class SharedArray(object):
+    """
+    Numpy array backed by shared memory so that it can be read and written
+    by worker processes without being pickled. The parent process creates
+    the array and passes getSpec() to the workers, which use fromSpec() to
+    attach to the same memory.
+    """
+
+    def __init__(self, shape, dtype, name=None):
+        """
+        Create a new shared array, or attach to an existing one.
+
+        :param shape:
+            Shape of the array.
+        :param dtype:
+            Numpy dtype of the array.
+        :param name:
+            Name of existing shared memory to attach to; if None, new shared
+            memory is created.
+        :raises ShakeMapException:
+            if shared memory is not available (see check_parallel).
+        """
+        shared_memory = check_parallel()
+        self._shape = tuple(shape)
+        self._dtype = np.dtype(dtype)
+        if name is None:
+            nbytes = max(1, int(np.prod(self._shape)) * self._dtype.itemsize)
+            self._shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            self._owner = True
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self.array = np.ndarray(self._shape, dtype=self._dtype,
+                                buffer=self._shm.buf)
+
+    @classmethod
+    def fromArray(cls, a):
+        """
+        Create a shared array holding a copy of a numpy array.
+
+        :param a:
+            Numpy array.
+        :returns:
+            SharedArray object.
+        """
+        shared = cls(a.shape, a.dtype)
+        shared.array[...] = a
+        return shared
+
+    @classmethod
+    def fromSpec(cls, spec):
+        """
+        Attach to the shared array described by spec.
+
+        :param spec:
+            Tuple returned by getSpec().
+        :returns:
+            SharedArray object.
+        """
+        name, shape, dtype = spec
+        return cls(shape, dtype, name=name)
+
+    def getSpec(self):
+        """
+        :returns:
+            Picklable tuple (name, shape, dtype) describing the array.
+        """
+        return (self._shm.name, self._shape, self._dtype.str)
+
+    def close(self):
+        """
+        Release the shared memory; it is freed if this object created it.
+        """
+        self.array = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def get_tiles(n, tile_size):
+    """
+    Split a range of n items into tiles.
+
+    :param n:
+        Number of items.
+    :param tile_size:
+        Maximum number of items per tile.
+    :returns:
+        List of (start, end) tuples.
+    """
+    tile_size = max(1, int(tile_size))
+    return [(i, min(i + tile_size, n)) for i in range(0, n, tile_size)]
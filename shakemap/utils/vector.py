@@ -7,12 +7,10 @@ from ..utils.ecef import latlon2ecef, ecef2latlon
 
 class Vector(object):
     """
-    Three-dimensional vector object, stored as three floats of x,y,z.
-
-    To do 
-        - Optimize/vectorize calculations like dot/cross for arrays of
-          vectors. 
+    Three-dimensional vector object, stored as three floats of x,y,z. For
+    arrays of vectors, see VectorArray.
     """
+    __slots__ = ('x', 'y', 'z')
 
     def __init__(self, x, y, z):
         """
@@ -255,3 +253,257 @@ class Vector(object):
         String representation of Vector.
         """
         return '<x=%.4f,y=%.4f,z=%.4f>' % (self.x, self.y, self.z)
+
+
+class VectorArray(object):
+    """
+    Array of three-dimensional vectors, stored as an Nx3 numpy array of
+    x,y,z. The operations are the same as those of Vector, but are done for
+    all vectors at once.
+    """
+
+    def __init__(self, array):
+        """
+        Create an array of vectors in cartesian space.
+
+        :param array:
+            Nx3 array-like of x,y,z coordinates (a single x,y,z triple is
+            treated as a 1x3 array).
+        :returns:
+            VectorArray object.
+        :raises ValueError:
+            If the array does not have three columns.
+        """
+        array = np.array(array, dtype=np.float64)
+        if array.ndim == 1:
+            array = array.reshape((1, -1))
+        if array.ndim != 2 or array.shape[1] != 3:
+            raise ValueError('VectorArray requires an Nx3 array.')
+        self.array = array
+
+    @classmethod
+    def fromPoints(cls, points):
+        """
+        Create a VectorArray from a list of hazardlib Point objects; the
+        lat, lon, depth values are converted to ECEF coordinates.
+
+        :param points:
+            List of Openquake Point objects.
+        :returns:
+            A VectorArray object.
+        """
+        lat = np.array([p.latitude for p in points], dtype=np.float64)
+        lon = np.array([p.longitude for p in points], dtype=np.float64)
+        dep = np.array([p.depth for p in points], dtype=np.float64)
+        return cls.fromLatLonDepth(lat, lon, dep)
+
+    @classmethod
+    def fromLatLonDepth(cls, lat, lon, dep):
+        """
+        Create a VectorArray from arrays of lat, lon, depth, which are
+        converted to ECEF coordinates.
+
+        :param lat:
+            Numpy array of latitudes (decimal degrees).
+        :param lon:
+            Numpy array of longitudes (decimal degrees).
+        :param dep:
+            Numpy array of depths (km), positive down.
+        :returns:
+            A VectorArray object.
+        """
+        x, y, z = latlon2ecef(np.reshape(lat, (-1,)), np.reshape(lon, (-1,)),
+                              np.reshape(dep, (-1,)))
+        return cls(np.column_stack((x, y, z)))
+
+    @classmethod
+    def fromVectors(cls, vectors):
+        """
+        Create a VectorArray from a list of Vector objects.
+
+        :param vectors:
+            List of Vector objects.
+        :returns:
+            A VectorArray object.
+        """
+        return cls(np.array([v.getTuple() for v in vectors],
+                            dtype=np.float64).reshape((-1, 3)))
+
+    def __len__(self):
+        return self.array.shape[0]
+
+    def __getitem__(self, index):
+        """
+        :param index:
+            An integer, slice, or index array.
+        :returns:
+            A Vector for an integer index, otherwise a VectorArray.
+        """
+        if isinstance(index, (int, np.integer)):
+            return Vector.fromTuple(self.array[index])
+        return VectorArray(self.array[index])
+
+    def _getOther(self, other, operation):
+        """
+        :returns:
+            Nx3 (or 1x3) numpy array of other, which is a VectorArray or a
+            Vector.
+        :raises TypeError:
+            If other is not a VectorArray or Vector object.
+        """
+        if isinstance(other, VectorArray):
+            return other.array
+        if isinstance(other, Vector):
+            return other.getArray()[np.newaxis, :]
+        raise TypeError("Cannot %s VectorArray and %s objects" %
+                        (operation, type(other)))
+
+    def __add__(self, other):
+        """
+        Add another VectorArray (elementwise) or a Vector (to each vector).
+
+        :param other:
+            A VectorArray or Vector object.
+        :returns:
+            A VectorArray object.
+        :raises TypeError:
+            If other is not a VectorArray or Vector object.
+        """
+        return VectorArray(self.array + self._getOther(other, 'add'))
+
+    def __sub__(self, other):
+        """
+        Subtract another VectorArray (elementwise) or a Vector (from each
+        vector).
+
+        :param other:
+            A VectorArray or Vector object.
+        :returns:
+            A VectorArray object.
+        :raises TypeError:
+            If other is not a VectorArray or Vector object.
+        """
+        return VectorArray(self.array - self._getOther(other, 'subtract'))
+
+    def __mul__(self, length):
+        """
+        Multiply the vectors by a scalar, or by an array of N scalars.
+
+        :param length:
+            A scalar number or array of length N.
+        :returns:
+            A VectorArray object.
+        :raises TypeError:
+            When length is not a number or array.
+        """
+        try:
+            length = np.asarray(length, dtype=np.float64)
+        except (ValueError, TypeError):
+            raise TypeError(
+                "Cannot multiply VectorArray and %s objects" %
+                type(length))
+        if length.ndim == 1:
+            length = length[:, np.newaxis]
+        return VectorArray(self.array * length)
+
+    def __rmul__(self, length):
+        return self.__mul__(length)
+
+    def cross(self, other):
+        """
+        Calculate the cross products with another VectorArray (elementwise)
+        or a Vector.
+
+        :param other:
+            A VectorArray or Vector object.
+        :returns:
+            A VectorArray object.
+        :raises TypeError:
+            If other is not a VectorArray or Vector object.
+        """
+        return VectorArray(np.cross(self.array,
+                                    self._getOther(other, 'cross')))
+
+    def dot(self, other):
+        """
+        Calculate the dot products with another VectorArray (elementwise)
+        or a Vector.
+
+        :param other:
+            A VectorArray or Vector object.
+        :returns:
+            Numpy array (N) of dot products.
+        :raises TypeError:
+            If other is not a VectorArray or Vector object.
+        """
+        return np.sum(self.array * self._getOther(other, 'dot'), axis=1)
+
+    def distance(self, other):
+        """
+        Calculate the distances to another VectorArray (elementwise) or a
+        Vector.
+
+        :param other:
+            A VectorArray or Vector object.
+        :returns:
+            Numpy array (N) of distances.
+        :raises TypeError:
+            If other is not a VectorArray or Vector object.
+        """
+        d = self.array - self._getOther(other, 'calculate distance between')
+        return np.sqrt(np.sum(d * d, axis=1))
+
+    def mag(self):
+        """
+        :returns:
+            Numpy array (N) of the lengths of the vectors.
+        """
+        return np.sqrt(np.sum(self.array * self.array, axis=1))
+
+    def norm(self):
+        """
+        :returns:
+            VectorArray of the normalized vectors.
+        """
+        return VectorArray(self.array / self.mag()[:, np.newaxis])
+
+    def getArray(self):
+        """
+        :returns:
+            Nx3 Numpy array of x,y,z.
+        """
+        return self.array
+
+    def toVectors(self):
+        """
+        :returns:
+            List of Vector objects.
+        """
+        return [Vector(x, y, z) for x, y, z in self.array]
+
+    def toLatLonDepth(self):
+        """
+        Convert the vectors back to lat, lon, depth.
+
+        :returns:
+            Tuple of lat, lon, depth numpy arrays.
+        """
+        return ecef2latlon(self.array[:, 0], self.array[:, 1],
+                           self.array[:, 2])
+
+    def toPoints(self):
+        """
+        Convert the vectors to a list of hazardlib Point objects, after
+        translating back to lat, lon, depth.
+
+        :returns:
+            List of Openquake Point objects.
+        """
+        lat, lon, dep = self.toLatLonDepth()
+        return [point.Point(lo, la, de) for lo, la, de in zip(lon, lat, dep)]
+
+    def __repr__(self):
+        """
+        String representation of VectorArray.
+        """
+        return '<VectorArray of %i vectors>' % len(self)
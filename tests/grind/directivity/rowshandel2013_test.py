@@ -718,8 +718,40 @@ def test_ss3():
     np.testing.assert_allclose(
         fd1, fd1_test, rtol=1e-5)
 
+    # The expected values were computed with the T = 1 s coefficients;
+    # C1 is 0.75 rather than 0.35 at T = 3 s
     np.testing.assert_allclose(
-        fd3, fd3_test, rtol=1e-5)
+        fd3, fd3_test * 0.75 / 0.35, rtol=1e-5)
+
+    # Culling sites outside of the distance taper must not change Fd
+    test2 = Rowshandel2013(source, slat, slon, deps, dx=1, T=[1.0, 3.0],
+                           a_weight=0.5, mtype=1, cull=True)
+    fdc = test2.getFd()
+    np.testing.assert_array_equal(fdc[0], fd1)
+    np.testing.assert_array_equal(fdc[1], fd3)
+    culled = (fd1 == 0) & (fd3 == 0)
+    assert np.any(culled)
+    assert np.all(test2.getXiPrime()[culled] == 0)
+    assert np.all(test2.getLD()[culled] == 0)
+    np.testing.assert_array_equal(test2.getXiPrime()[~culled], xip[~culled])
+
+    # Several hypocenters at once
+    epilon2, epilat2 = proj(epix, np.array([0.8 * flty[1]]), reverse=True)
+    event2 = dict(event, lat=epilat2[0], lon=epilon2[0])
+    source2 = Source(event2, flt)
+    source2.setEventParam('rake', rake)
+    test3 = Rowshandel2013(source2, slat, slon, deps, dx=1, T=[1.0, 3.0],
+                           a_weight=0.5, mtype=1)
+    batch = Rowshandel2013.fromHypocenters(
+        source, [source.getHypo(), source2.getHypo()], slat, slon, deps,
+        dx=1, T=[1.0, 3.0], a_weight=0.5, mtype=1)
+    assert len(batch) == 2
+    for r, rtest in zip(batch, [test1, test3]):
+        np.testing.assert_allclose(r.getXiPrime(), rtest.getXiPrime(),
+                                   rtol=1e-12)
+        np.testing.assert_allclose(r.getLD(), rtest.getLD(), rtol=1e-12)
+        for fdb, fdt in zip(r.getFd(), rtest.getFd()):
+            np.testing.assert_allclose(fdb, fdt, rtol=1e-12, atol=1e-15)
 
 def test_rv4():
     magnitude = 7.0
@@ -815,7 +847,42 @@ def test_rv4():
          0.04439572]]
         )
 
-    np.testing.assert_allclose(fd, fd_test, atol = 1e-4)
+    # The expected values were computed with the T = 1 s coefficients;
+    # C1 is 0.95 rather than 0.35 at T = 5 s
+    np.testing.assert_allclose(fd, fd_test * 0.95 / 0.35, atol = 1e-4)
+
+    # Blocking of the site/subfault pairs must not change the result
+    for block_size in [1, 500]:
+        test2 = Rowshandel2013(source, slat, slon, deps, dx=1, T=5.0,
+                               a_weight=0.5, mtype=1, block_size=block_size)
+        np.testing.assert_allclose(test2.getFd()[0], fd, rtol=1e-12)
+
+    # Tiles of sites, computed here and in worker processes
+    test3 = Rowshandel2013(source, slat, slon, deps, dx=1, T=5.0,
+                           a_weight=0.5, mtype=1, chunk_size=30)
+    np.testing.assert_allclose(test3.getFd()[0], fd, rtol=1e-12)
+    test4 = Rowshandel2013(source, slat, slon, deps, dx=1, T=5.0,
+                           a_weight=0.5, mtype=1, chunk_size=30, n_workers=2)
+    np.testing.assert_allclose(test4.getFd()[0], fd, rtol=1e-12)
+    np.testing.assert_allclose(test4.getXiPrime(), test1.getXiPrime(),
+                               rtol=1e-12)
+
+    # Several periods at once, with interpolated coefficients
+    periods = [0.5, 2.0, 5.0, 20.0]
+    test5 = Rowshandel2013(source, slat, slon, deps, dx=1, T=periods,
+                           a_weight=0.5, mtype=1)
+    fds = test5.getFd()
+    assert len(fds) == 4
+    assert test5.getDT().shape == (4,) + slat.shape
+    np.testing.assert_allclose(fds[2], fd, rtol=1e-12)
+    c1 = [0.35, 0.35 + 0.4 * np.log(2.0) / np.log(3.0), 0.95, 1.60]
+    for i in range(len(periods)):
+        single = Rowshandel2013(source, slat, slon, deps, dx=1,
+                                T=periods[i], a_weight=0.5, mtype=1)
+        np.testing.assert_allclose(fds[i], single.getFd()[0], rtol=1e-12)
+        np.testing.assert_allclose(
+            fds[i], c1[i] * test5.getWP()[i] * test5.getDT()[i] *
+            (test5.getXiPrime() - test5._xi_c), rtol=1e-12)
 
 
 
@@ -1022,4 +1089,6 @@ def test_so6():
           0.00000000e+00,   0.00000000e+00,   0.00000000e+00]]
     )
 
-    np.testing.assert_allclose(fd, fd_test, atol = 1e-4)
+    # The expected values were computed with the T = 1 s coefficients;
+    # C1 is 0.95 rather than 0.35 at T = 5 s
+    np.testing.assert_allclose(fd, fd_test * 0.95 / 0.35, atol = 1e-4)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import os.path
+import sys
+import time
+import tempfile
+import shutil
+
+# third party
+import numpy as np
+from mapio.geodict import GeoDict
+from openquake.hazardlib.gsim.abrahamson_2014 import AbrahamsonEtAl2014
+
+# hack the path so that I can debug these functions if I need to
+homedir = os.path.dirname(os.path.abspath(__file__))  # where is this script?
+shakedir = os.path.abspath(os.path.join(homedir, '..'))
+# put this at the front of the system path, ignoring any installed mapio stuff
+sys.path.insert(0, shakedir)
+
+from shakemap.grind.fault import Fault
+from shakemap.grind.source import Source
+from shakemap.grind.distance import Distance
+from shakemap.grind.distance import get_distance
+import shakemap.grind.distance_cache as distance_cache
+from shakemap.grind.distance_cache import DistanceCache
+from shakemap.utils.timeutils import ShakeDateTime
+
+
+def _get_source(lat=36.6):
+    flt = Fault.fromTrace(np.array([-121.5]), np.array([36.8]),
+                          np.array([-121.3]), np.array([36.6]),
+                          np.array([1.0]), np.array([12.0]),
+                          np.array([60.0]))
+    event = {'lat': lat, 'lon': -121.3, 'depth': 8, 'mag': 7,
+             'id': '', 'locstring': '', 'type': 'U',
+             'time': ShakeDateTime.utcfromtimestamp(int(time.time())),
+             'timezone': 'UTC'}
+    return Source(event, flt)
+
+
+def test_distance_cache():
+    gd = GeoDict({'xmin': -122.0, 'xmax': -121.0, 'ymin': 36.0,
+                  'ymax': 37.0, 'dx': 0.1, 'dy': 0.1, 'nx': 11, 'ny': 11})
+    lon, lat = np.meshgrid(np.linspace(gd.xmin, gd.xmax, gd.nx),
+                           np.linspace(gd.ymax, gd.ymin, gd.ny))
+    dep = np.zeros_like(lat)
+    source = _get_source()
+    methods = ['rrup', 'rjb', 'rx', 'ry0']
+    target = get_distance(methods, lat, lon, dep, source)
+
+    cachedir = tempfile.mkdtemp()
+    try:
+        cache = DistanceCache(cachedir)
+        key = DistanceCache.getKey(source, gd)
+        assert cache.load(key, methods) == {}
+
+        # First call computes and saves the distances
+        dists = cache.getDistance(methods, lat, lon, dep, source, gd)
+        for m in methods:
+            np.testing.assert_array_equal(dists[m], target[m])
+            assert os.path.isfile(os.path.join(cachedir, key, m + '.npy'))
+
+        # Second call loads them memory-mapped
+        dists = cache.load(key, methods)
+        for m in methods:
+            assert isinstance(dists[m], np.memmap)
+            np.testing.assert_array_equal(dists[m], target[m])
+
+        # A different hypocenter gives a different key
+        assert DistanceCache.getKey(_get_source(lat=36.7), gd) != key
+
+        # A tiny cache keeps only the most recent entry
+        cache = DistanceCache(cachedir, max_size=1)
+        source2 = _get_source(lat=36.7)
+        key2 = DistanceCache.getKey(source2, gd)
+        cache.getDistance(methods, lat, lon, dep, source2, gd)
+        assert not os.path.isdir(os.path.join(cachedir, key))
+        assert os.path.isdir(os.path.join(cachedir, key2))
+    finally:
+        shutil.rmtree(cachedir)
+
+
+def test_distance_cache_approximated():
+    # The sites approximated beyond max_distance are saved with the
+    # distances and returned when they are loaded
+    gd = GeoDict({'xmin': -124.0, 'xmax': -118.5, 'ymin': 34.0,
+                  'ymax': 39.0, 'dx': 0.125, 'dy': 0.125, 'nx': 45,
+                  'ny': 41})
+    lon, lat = np.meshgrid(np.linspace(gd.xmin, gd.xmax, gd.nx),
+                           np.linspace(gd.ymax, gd.ymin, gd.ny))
+    dep = np.zeros_like(lat)
+    source = _get_source()
+    gmpe = AbrahamsonEtAl2014()
+    target = Distance(gmpe, source, lat, lon, dep, max_distance=100.0,
+                      geodict=gd).getApproximated()
+    assert np.any(target) and not np.all(target)
+
+    cachedir = tempfile.mkdtemp()
+    try:
+        cache = DistanceCache(cachedir)
+        key = DistanceCache.getKey(source, gd, max_distance=100.0)
+        for i in range(2):
+            dist = Distance(gmpe, source, lat, lon, dep, max_distance=100.0,
+                            geodict=gd, cache=cache)
+            np.testing.assert_array_equal(dist.getApproximated(), target)
+            assert os.path.isfile(
+                os.path.join(cachedir, key, 'approximated.npy'))
+        assert isinstance(dist.getApproximated(), np.memmap)
+
+        # Without max_distance nothing is approximated
+        dist = Distance(gmpe, source, lat, lon, dep, geodict=gd, cache=cache)
+        assert dist.getApproximated() is None
+
+        # A source without a fault has no mask, and the distances are only
+        # computed once
+        event = dict(source._event_dict)
+        psource = Source(event)
+        psource.setMechanism('ALL')
+        methods = ['repi', 'rjb', 'rrup']
+        calls = []
+
+        def counted_get_distance(*args, **kwargs):
+            calls.append(args[0])
+            return get_distance(*args, **kwargs)
+        distance_cache.get_distance = counted_get_distance
+        try:
+            for i in range(3):
+                dists = cache.getDistance(methods, lat, lon, dep, psource,
+                                          gd, max_distance=100.0)
+                assert 'approximated' not in dists
+        finally:
+            distance_cache.get_distance = get_distance
+        assert len(calls) == 1
+    finally:
+        shutil.rmtree(cachedir)
@@ -3,6 +3,8 @@
 # stdlib imports
 import os.path
 import sys
+import tempfile
+import shutil
 import time as time
 
 # third party
@@ -16,6 +18,7 @@ shakedir = os.path.abspath(os.path.join(homedir, '..'))
 sys.path.insert(0, shakedir)
 
 from openquake.hazardlib.geo.utils import get_orthographic_projection
+from openquake.hazardlib.geo.point import Point
 from openquake.hazardlib.gsim.abrahamson_2014 import AbrahamsonEtAl2014
 from openquake.hazardlib.gsim.berge_thierry_2003 import BergeThierryEtAl2003SIGMA
 
@@ -25,6 +28,55 @@ from shakemap.grind.source import Source
 from shakemap.grind.sites import Sites
 from shakemap.grind.distance import Distance
 from shakemap.grind.distance import get_distance
+from shakemap.grind.distance import MESH_TOLERANCE
+from shakemap.grind.distance import ADAPTIVE_MIN_DISTANCE
+from shakemap.grind.distance import _get_quads_ecef
+from shakemap.grind.distance import _calc_min_rupture_distance
+from shakemap.grind.distance import _calc_rupture_distance
+from shakemap.grind.distance import get_ps2ff_interpolators
+from shakemap.grind.distance import _calc_gc2
+from shakemap.grind.distance import write_ps2ff_npz
+from shakemap.grind.distance import _read_ps2ff_csv
+from shakemap.utils.ecef import latlon2ecef
+
+
+def _get_source():
+    # Two quad fault used by the tests of the distance approximations
+    lon0 = np.array([-121.5, -121.3])
+    lat0 = np.array([36.8, 36.6])
+    lon1 = np.array([-121.3, -121.0])
+    lat1 = np.array([36.6, 36.5])
+    z = np.array([1.0, 1.0])
+    W = np.array([12.0, 15.0])
+    dip = np.array([90.0, 60.0])
+    flt = Fault.fromTrace(lon0, lat0, lon1, lat1, z, W, dip)
+    event = {'lat': 36.6, 'lon': -121.3, 'depth': 8, 'mag': 7,
+             'id': '', 'locstring': '', 'type': 'U',
+             'time': ShakeDateTime.utcfromtimestamp(int(time.time())),
+             'timezone': 'UTC'}
+    return Source(event, flt)
+
+
+def _get_hayward_source():
+    # Multi-segment fault read from the test data
+    faultfile = os.path.abspath(os.path.join(
+        homedir, '..', 'data', 'eventdata',
+        'hayward_RC_HN_HS_HE_Shaw09Mod_GEOL.txt'))
+    flt = Fault.readFaultFile(faultfile)
+    event = {'lat': 37.8, 'lon': -122.2, 'depth': 8, 'mag': 7,
+             'id': '', 'locstring': '', 'type': 'U',
+             'time': ShakeDateTime.utcfromtimestamp(int(time.time())),
+             'timezone': 'UTC'}
+    return Source(event, flt)
+
+
+def _get_fault_grid(source, pad, n):
+    # Regular grid of n x n sites around the fault, padded by pad degrees
+    flon, flat, _ = source._fault.getFaultAsArrays()
+    lon, lat = np.meshgrid(
+        np.linspace(np.nanmin(flon) - pad, np.nanmax(flon) + pad, n),
+        np.linspace(np.nanmax(flat) + pad, np.nanmin(flat) - pad, n))
+    return lat, lon, np.zeros_like(lat)
 
 
 def test_distance_no_fault():
@@ -983,3 +1035,229 @@ def test_chichi_with_get_distance():
 
     np.testing.assert_allclose(
         nga_T, dists['T'], rtol=0, atol=2)
+
+
+def test_min_rupture_distance():
+    # Multi-quad fault; all-quad kernel should match the per-quad minimum
+    lon0 = np.array([-121.5, -121.3, -121.0])
+    lat0 = np.array([36.8, 36.6, 36.5])
+    lon1 = np.array([-121.3, -121.0, -120.8])
+    lat1 = np.array([36.6, 36.5, 36.3])
+    z = np.array([0.0, 2.0, 0.0])
+    dip = np.array([90.0, 60.0, 45.0])
+    W = np.array([12.0, 15.0, 18.0])
+    flt = Fault.fromTrace(lon0, lat0, lon1, lat1, z, W, dip)
+    quadlist = flt.getQuadrilaterals()
+
+    lons, lats = np.meshgrid(np.linspace(-122.0, -120.3, 23),
+                             np.linspace(36.0, 37.2, 17))
+    sites_ecef = np.column_stack(
+        latlon2ecef(lats.ravel(), lons.ravel(), np.zeros(lats.size)))
+
+    for surface in [False, True]:
+        quads = _get_quads_ecef(quadlist, surface=surface)
+        target = np.ones(lats.size) * 1e16
+        for P0, P1, P2, P3 in quadlist:
+            if surface:
+                P0, P1, P2, P3 = [Point(p.longitude, p.latitude, 0.0)
+                                  for p in (P0, P1, P2, P3)]
+            target = np.minimum(
+                target,
+                _calc_rupture_distance(P0, P1, P2, P3, sites_ecef).ravel())
+        dist = _calc_min_rupture_distance(quads, sites_ecef)
+        np.testing.assert_array_equal(dist, target)
+        # Small blocks must not change the result
+        dist = _calc_min_rupture_distance(quads, sites_ecef, block_size=7)
+        np.testing.assert_array_equal(dist, target)
+        # Pruning quads with bounding spheres must not change the result
+        dist = _calc_min_rupture_distance(quads, sites_ecef, prune=False)
+        np.testing.assert_array_equal(dist, target)
+
+
+def test_ps2ff_tables():
+    # Interpolators are only built once per region/mechanism/kind
+    r1, v1 = get_ps2ff_interpolators('Rjb', 'Stable Shallow Crust', 'SS')
+    r2, v2 = get_ps2ff_interpolators('Rjb', 'Stable Shallow Crust', 'SS')
+    assert r1 is r2
+    assert v1 is v2
+
+    # The precompiled tables match the csv files
+    tdir = tempfile.mkdtemp()
+    try:
+        npzfile = os.path.join(tdir, 'ps2ff_tables.npz')
+        write_ps2ff_npz(npzfile)
+        name = 'Rrup_WC94_mechR_ar1p7_seis0-20'
+        dists, mags, ratios, var = _read_ps2ff_csv(name)
+        with np.load(npzfile) as npz:
+            np.testing.assert_array_equal(npz[name + '/dists'], dists)
+            np.testing.assert_array_equal(npz[name + '/mags'], mags)
+            np.testing.assert_array_equal(npz[name + '/ratios'], ratios)
+            np.testing.assert_array_equal(npz[name + '/var'], var)
+    finally:
+        shutil.rmtree(tdir)
+
+
+def test_gc2_straight_fault():
+    # North striking vertical fault, split into two quads
+    flt = Fault.fromTrace(np.array([-120.0, -120.0]), np.array([35.0, 35.1]),
+                          np.array([-120.0, -120.0]), np.array([35.1, 35.2]),
+                          np.array([0.0, 0.0]), np.array([10.0, 10.0]),
+                          np.array([90.0, 90.0]))
+    flt._segment_index = [0, 0]
+    gc2 = flt.getGC2Frame()
+    lat = np.array([35.1, 35.1, 35.3])
+    lon = np.array([-119.9, -120.1, -120.0])
+    U, T = _calc_gc2(gc2, lat, lon)
+    km = 111.19
+    np.testing.assert_allclose(
+        T[0:2], [0.1 * km * np.cos(np.radians(35.1)),
+                 -0.1 * km * np.cos(np.radians(35.1))], rtol=1e-2)
+    np.testing.assert_allclose(U, [0.1 * km, 0.1 * km, 0.3 * km], rtol=1e-2)
+    np.testing.assert_allclose(T[2], 0.0, atol=1e-6)
+
+    # Processing the sites in small chunks gives the same result
+    U2, T2 = _calc_gc2(gc2, lat, lon, block_size=2)
+    np.testing.assert_array_equal(U, U2)
+    np.testing.assert_array_equal(T, T2)
+
+
+def test_distance_chunks():
+    # Computing the sites in blocks, or in parallel, must not change the
+    # distances
+    lon0 = np.array([-121.5, -121.3, -121.0])
+    lat0 = np.array([36.8, 36.6, 36.5])
+    lon1 = np.array([-121.3, -121.0, -120.8])
+    lat1 = np.array([36.6, 36.5, 36.3])
+    z = np.array([1.0, 1.0, 1.0])
+    W = np.array([12.0, 15.0, 18.0])
+    dip = np.array([90.0, 60.0, 45.0])
+    flt = Fault.fromTrace(lon0, lat0, lon1, lat1, z, W, dip)
+    event = {'lat': 36.6, 'lon': -121.3, 'depth': 8, 'mag': 7,
+             'id': '', 'locstring': '', 'type': 'U',
+             'time': ShakeDateTime.utcfromtimestamp(int(time.time())),
+             'timezone': 'UTC'}
+    source = Source(event, flt)
+    lon, lat = np.meshgrid(np.linspace(-122.0, -120.3, 23),
+                           np.linspace(37.2, 36.0, 17))
+    dep = np.zeros_like(lat)
+    methods = ['repi', 'rhypo', 'rjb', 'rrup', 'rx', 'ry', 'ry0', 'U', 'T']
+    dists = get_distance(methods, lat, lon, dep, source)
+    for kwargs in [{'chunk_size': 10}, {'max_memory': 1e5},
+                   {'n_workers': 2, 'chunk_size': 100}]:
+        cdists = get_distance(methods, lat, lon, dep, source, **kwargs)
+        for method in methods:
+            assert cdists[method].shape == lat.shape
+            np.testing.assert_array_equal(cdists[method], dists[method])
+
+
+def test_distance_context_not_copied():
+    # The distance context shares the arrays of the Distance object, which
+    # are protected from changes
+    source = _get_source()
+    lon, lat = np.meshgrid(np.linspace(-122.0, -120.5, 7),
+                           np.linspace(37.2, 36.0, 5))
+    dep = np.zeros_like(lat)
+    dist = Distance(AbrahamsonEtAl2014(), source, lat, lon, dep)
+    dctx1 = dist.getDistanceContext()
+    dctx2 = dist.getDistanceContext()
+    for name in ['rjb', 'rrup', 'rx', 'ry0']:
+        value = getattr(dctx1, name)
+        assert np.shares_memory(value, getattr(dctx2, name))
+        assert not value.flags.writeable
+        try:
+            value[0, 0] = 0.0
+            assert False
+        except ValueError:
+            pass
+    # Replacing an array does not change the Distance object
+    dctx1.rjb = np.zeros_like(lat)
+    assert np.all(dist.getDistanceContext().rjb > 0)
+
+
+def test_distance_adaptive():
+    source = _get_source()
+    lon, lat = np.meshgrid(np.linspace(-123.5, -119.0, 91),
+                           np.linspace(38.5, 34.5, 81))
+    dep = np.zeros_like(lat)
+    methods = ['repi', 'rjb', 'rrup', 'rx', 'ry0']
+    dists = get_distance(methods, lat, lon, dep, source)
+    adists = get_distance(methods, lat, lon, dep, source, tolerance=0.001)
+    # The epicentral distance is never interpolated
+    np.testing.assert_array_equal(adists['repi'], dists['repi'])
+    near = dists['rjb'] < 20.0
+    for method in methods:
+        # Exact near the fault, and close to exact elsewhere
+        np.testing.assert_array_equal(adists[method][near],
+                                      dists[method][near])
+        err = np.abs(adists[method] - dists[method])
+        assert np.all(err <= 0.01 * np.maximum(dists['repi'], 1.0))
+
+
+def test_distance_adaptive_tolerance():
+    # On a real (multi-segment) fault, every adaptive distance is within
+    # tolerance of the exact one
+    source = _get_hayward_source()
+    lat, lon, dep = _get_fault_grid(source, 1.5, 121)
+    methods = ['repi', 'rhypo', 'rjb', 'rrup', 'rx', 'ry', 'ry0', 'U', 'T']
+    dists = get_distance(methods, lat, lon, dep, source)
+    adists = get_distance(methods, lat, lon, dep, source, tolerance=0.01)
+    for method in methods:
+        err = np.abs(adists[method] - dists[method])
+        scale = np.maximum(np.abs(dists[method]), ADAPTIVE_MIN_DISTANCE)
+        assert np.max(err / scale) <= 0.01
+
+
+def test_distance_max_distance():
+    source = _get_source()
+    lon, lat = np.meshgrid(np.linspace(-124.0, -118.5, 45),
+                           np.linspace(39.0, 34.0, 41))
+    dep = np.zeros_like(lat)
+    methods = ['repi', 'rhypo', 'rjb', 'rrup', 'rx', 'ry0']
+    dists = get_distance(methods, lat, lon, dep, source)
+    cdists = get_distance(methods, lat, lon, dep, source, max_distance=100.0)
+    approx = cdists['approximated']
+    assert np.any(approx) and not np.all(approx)
+    # Everything within the cutoff is exact
+    assert np.all(approx <= (dists['rjb'] > 100.0))
+    for method in methods:
+        np.testing.assert_array_equal(cdists[method][~approx],
+                                      dists[method][~approx])
+    np.testing.assert_array_equal(cdists['repi'], dists['repi'])
+    # Far sites are within half the fault length
+    length = source._fault.getGC2Frame().total_length
+    for method in ['rjb', 'rrup']:
+        err = np.abs(cdists[method] - dists[method])
+        assert np.all(err[approx] <= length / 2.0 + 1.0)
+
+
+def test_distance_max_distance_bound():
+    # Along a long fault, the sites to approximate are found from a tight
+    # lower bound on Rjb: the exact sub-grid is not much larger than needed
+    source = _get_hayward_source()
+    lat, lon, dep = _get_fault_grid(source, 2.0, 61)
+    dists = get_distance(['rjb'], lat, lon, dep, source)
+    cdists = get_distance(['rjb'], lat, lon, dep, source, max_distance=50.0)
+    approx = cdists['approximated']
+    assert np.all(approx <= (dists['rjb'] > 50.0))
+    near = dists['rjb'] <= 60.0
+    assert np.all(approx[~np.any(near, axis=1), :])
+    assert np.all(approx[:, ~np.any(near, axis=0)])
+
+
+def test_distance_mesh_dx():
+    source = _get_source()
+    lon, lat = np.meshgrid(np.linspace(-128.0, -114.0, 60),
+                           np.linspace(42.0, 31.0, 50))
+    dep = np.zeros_like(lat)
+    methods = ['rjb', 'rrup', 'rx']
+    dists = get_distance(methods, lat, lon, dep, source)
+    mdists = get_distance(methods, lat, lon, dep, source, mesh_dx=2.0)
+    for method in ['rjb', 'rrup']:
+        err = np.abs(mdists[method] - dists[method])
+        assert np.all(err <= MESH_TOLERANCE * dists[method] + 1e-9)
+        # Near sites are exact, far ones use the point cloud
+        near = dists[method] < 50.0
+        np.testing.assert_array_equal(mdists[method][near],
+                                      dists[method][near])
+        assert np.any(mdists[method] != dists[method])
+    np.testing.assert_array_equal(mdists['rx'], dists['rx'])
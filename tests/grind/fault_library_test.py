@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import os.path
+import sys
+
+# third party
+import numpy as np
+import pytest
+
+# hack the path so that I can debug these functions if I need to
+homedir = os.path.dirname(os.path.abspath(__file__))  # where is this script?
+shakedir = os.path.abspath(os.path.join(homedir, '../..'))
+# put this at the front of the system path, ignoring any installed mapio stuff
+sys.path.insert(0, shakedir)
+
+from shakemap.grind.fault import Fault
+from shakemap.grind.fault_library import FaultLibrary
+from shakemap.utils.exception import ShakeMapException
+
+
+def test_fault_library(tmpdir):
+    xp0 = np.array([-121.0, -120.5])
+    yp0 = np.array([36.0, 36.4])
+    xp1 = np.array([-120.5, -120.1])
+    yp1 = np.array([36.4, 36.6])
+    zp = np.array([1.0, 1.0])
+    widths = np.array([10.0, 12.0])
+    dips = np.array([60.0, 45.0])
+    f1 = Fault.fromTrace(xp0, yp0, xp1, yp1, zp, widths, dips)
+    f1._segment_index = [0, 0]
+    f2 = Fault.fromTrace(xp0[0:1], yp0[0:1], xp1[0:1], yp1[0:1], zp[0:1],
+                         widths[0:1], dips[0:1])
+
+    libdir = str(tmpdir.join('library'))
+    lib = FaultLibrary.write(
+        libdir, [12, 3], [f1, f2],
+        columns={'magnitude': [7.1, 6.5], 'name': ['first', 'second']},
+        quad_columns={'reversed': [[True, False], [False]]},
+        reference='test library')
+    assert len(lib) == 2
+    assert lib.getIds() == ['12', '3']
+    assert '3' in lib
+    assert 4 not in lib
+    assert lib.getOffsets(3) == (2, 3)
+
+    # Open the library again and read one rupture
+    lib = FaultLibrary(libdir)
+    assert lib.getRupture('12') == {'magnitude': 7.1, 'name': 'first'}
+    np.testing.assert_array_equal(lib.getQuadColumn('reversed', 12),
+                                  [True, False])
+    flt = Fault.fromLibrary(lib, 12)
+    np.testing.assert_array_equal(flt.getQuadVertices(),
+                                  f1.getQuadVertices())
+    assert flt._getSegmentIndex() == [0, 0]
+    assert flt.getReference() == 'test library'
+    np.testing.assert_allclose(flt.getFaultLength(), f1.getFaultLength())
+    flt = Fault.fromLibrary(libdir, 3)
+    np.testing.assert_array_equal(flt.getQuadVertices(),
+                                  f2.getQuadVertices())
+
+    with pytest.raises(ShakeMapException):
+        Fault.fromLibrary(lib, 4)
+    with pytest.raises(ShakeMapException):
+        lib.getQuadColumn('dip', 3)
+    with pytest.raises(ShakeMapException):
+        FaultLibrary.write(str(tmpdir.join('bad')), [1, 1], [f1, f2])
+    with pytest.raises(ShakeMapException):
+        FaultLibrary(str(tmpdir))
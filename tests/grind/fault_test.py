@@ -16,11 +16,18 @@ shakedir = os.path.abspath(os.path.join(homedir, '../..'))
 # put this at the front of the system path, ignoring any installed mapio stuff
 sys.path.insert(0, shakedir)
 
+from openquake.hazardlib.geo import point
 from shakemap.grind.fault import Fault
 from shakemap.utils.exception import ShakeMapException
 from shakemap.utils.misc import getCommandOutput
 from shakemap.grind.fault import get_local_unit_slip_vector
 from shakemap.grind.fault import get_quad_slip
+from shakemap.grind.fault import get_quad_normal
+from shakemap.grind.fault import get_quad_strike_vector
+from shakemap.grind.fault import get_quad_length
+from shakemap.grind.fault import get_quad_mesh
+from shakemap.utils.ecef import latlon2ecef
+from shakemap.grind.distance import _calc_min_rupture_distance
 
 def test_pisgah_bullion_mtn(tmpdir):
     # a segment of this fault causes a division by zero error that
@@ -258,3 +265,194 @@ def test_fromTrace():
     dips = [30.0, 45.0]
     fault = Fault.fromTrace(xp0, yp0, xp1, yp1, zp, widths,
                             dips, reference='From J Smith, (personal communication)')
+
+
+def test_gc2frame():
+    # Two segments with a kink
+    xp0 = np.array([-121.5, -121.3, -121.0])
+    yp0 = np.array([36.8, 36.6, 36.5])
+    xp1 = np.array([-121.3, -121.0, -120.8])
+    yp1 = np.array([36.6, 36.5, 36.3])
+    zp = np.array([2.0, 2.0, 2.0])
+    widths = np.array([10.0, 10.0, 10.0])
+    dips = np.array([90.0, 90.0, 90.0])
+    fault = Fault.fromTrace(xp0, yp0, xp1, yp1, zp, widths, dips)
+
+    depths = [p.depth for q in fault.getQuadrilaterals() for p in q]
+
+    # Frame is cached on the fault
+    gc2 = fault.getGC2Frame()
+    assert fault.getGC2Frame() is gc2
+    assert gc2.nseg == 3
+    np.testing.assert_allclose(gc2.bhat.mag(), 1.0)
+    np.testing.assert_array_equal(gc2.dc, [1.0, 1.0, 1.0])
+    # Quads are not modified
+    assert [p.depth for q in fault.getQuadrilaterals() for p in q] == depths
+
+    # Changing the segment index gives a new frame
+    fault._segment_index = [0, 0, 0]
+    gc2 = fault.getGC2Frame()
+    assert fault.getGC2Frame() is gc2
+    assert gc2.nseg == 1
+    np.testing.assert_allclose(gc2.total_length, fault.getFaultLength())
+    np.testing.assert_allclose(
+        gc2.u_offsets, np.cumsum(np.r_[0, gc2.quad_lengths[:-1]]))
+
+
+def test_quad_arrays():
+    xp0 = np.array([-121.0, -120.5])
+    yp0 = np.array([36.0, 36.4])
+    xp1 = np.array([-120.5, -120.1])
+    yp1 = np.array([36.4, 36.6])
+    zp = np.array([1.0, 1.0])
+    widths = np.array([10.0, 12.0])
+    dips = np.array([60.0, 45.0])
+    fault = Fault.fromTrace(xp0, yp0, xp1, yp1, zp, widths, dips)
+    quads = fault.getQuadrilaterals()
+
+    lld = fault.getQuadVertices()
+    assert lld.shape == (2, 4, 3)
+    assert fault.getNumQuads() == 2
+    for i, quad in enumerate(quads):
+        for j, P in enumerate(quad):
+            np.testing.assert_array_equal(
+                lld[i, j], [P.longitude, P.latitude, P.depth])
+            np.testing.assert_array_equal(
+                fault.getQuadsECEF()[i, j],
+                latlon2ecef(P.latitude, P.longitude, P.depth))
+            np.testing.assert_array_equal(
+                fault.getQuadsECEF(surface=True)[i, j],
+                latlon2ecef(P.latitude, P.longitude, 0.0))
+        np.testing.assert_array_equal(fault.getQuadNormals()[i],
+                                      get_quad_normal(quad).getArray())
+        np.testing.assert_array_equal(fault.getQuadStrikeVectors()[i],
+                                      get_quad_strike_vector(quad).getArray())
+        np.testing.assert_array_equal(fault.getIndividualTopLengths()[i],
+                                      get_quad_length(quad))
+    np.testing.assert_allclose(fault.getIndividualWidths(), widths, rtol=2e-3)
+    np.testing.assert_allclose(fault.getWidth(), np.mean(widths), rtol=2e-3)
+    np.testing.assert_allclose(fault.getTopOfRupture(), 1.0)
+
+    # Returned arrays and quads are copies
+    lld[:] = 0.0
+    quads[0][0].depth = 5.0
+    assert fault.getQuadVertices()[0, 0, 2] != 0.0
+    assert fault.getQuadrilaterals()[0][0].depth != 5.0
+
+
+def test_quad_mesh():
+    xp0 = np.array([-121.0])
+    yp0 = np.array([36.0])
+    xp1 = np.array([-120.9])
+    yp1 = np.array([36.05])
+    zp = np.array([1.0])
+    widths = np.array([5.0])
+    dips = np.array([45.0])
+    fault = Fault.fromTrace(xp0, yp0, xp1, yp1, zp, widths, dips)
+    q = fault.getQuadrilaterals()[0]
+    mesh = get_quad_mesh(q, 1.0)
+    ny, nx = mesh['x'].shape
+    assert mesh['cpx'].shape == (ny - 1, nx - 1)
+    # Corners of the mesh are the quad vertices
+    p0 = fault.getQuadsECEF()[0]
+    np.testing.assert_allclose(
+        [mesh['x'][0, 0], mesh['y'][0, 0], mesh['z'][0, 0]], p0[0])
+    np.testing.assert_allclose(
+        [mesh['x'][-1, 0], mesh['y'][-1, 0], mesh['z'][-1, 0]], p0[3])
+    # Centers are the mean of the subfault corners
+    for c in 'xyz':
+        np.testing.assert_allclose(
+            mesh['cp' + c], (mesh['ul' + c] + mesh['ur' + c] +
+                             mesh['ll' + c] + mesh['lr' + c]) / 4.0)
+
+    # Meshes are cached and read-only
+    assert get_quad_mesh(q, 1.0) is mesh
+    assert get_quad_mesh(q, 2.0) is not mesh
+    assert not mesh['cpx'].flags.writeable
+    mesh2 = get_quad_mesh(q, 1.0, cache=False)
+    assert mesh2 is not mesh
+    for key in mesh:
+        np.testing.assert_array_equal(mesh2[key], mesh[key])
+
+
+def test_validate_quads():
+    # Second segment has a quad that needs to be reversed
+    lon = np.array([0.0, 1.0, 2.0, 2.1, 1.1, 0.1, 0.0, np.nan,
+                    3.0, 4.0, 4.0, 3.0, 3.0])
+    lat = np.array([0.0, 0.2, 0.1, 0.3, 0.4, 0.2, 0.0, np.nan,
+                    0.0, 0.0, 0.1, 0.1, 0.0])
+    dep = np.array([0.0, 0.0, 0.0, 10.0, 10.0, 10.0, 0.0, np.nan,
+                    0.0, 0.0, 5.0, 5.0, 0.0])
+    fault = Fault(lon, lat, dep, 'test')
+    assert fault.getNumQuads() == 3
+    assert fault._getSegmentIndex() == [0, 0, 1]
+    raw = [(0, 1, 4, 5), (1, 2, 3, 4), (8, 9, 10, 11)]
+    for quad, ind in zip(fault.getQuadrilaterals(), raw):
+        points = [point.Point(lon[i], lat[i], dep[i]) for i in ind]
+        expected = fault._validateQuad(*points)
+        for P, E in zip(quad, expected):
+            np.testing.assert_allclose(
+                [P.longitude, P.latitude, P.depth],
+                [E.longitude, E.latitude, E.depth], atol=1e-10)
+
+    # Bottom edge not horizontal
+    dep[10] = 6.0
+    with pytest.raises(ShakeMapException):
+        Fault(lon, lat, dep, 'test')
+
+
+def test_fromTrace_strike():
+    xp0 = np.array([-121.0, -120.5])
+    yp0 = np.array([36.0, 36.4])
+    xp1 = np.array([-120.5, -120.1])
+    yp1 = np.array([36.4, 36.6])
+    zp = np.array([1.0, 1.0])
+    widths = np.array([10.0, 12.0])
+    dips = np.array([60.0, 45.0])
+    f1 = Fault.fromTrace(xp0, yp0, xp1, yp1, zp, widths, dips,
+                         strike=[45.0])
+    f2 = Fault.fromTrace(xp0, yp0, xp1, yp1, zp, widths, dips,
+                         strike=45.0)
+    f3 = Fault.fromTrace(xp0, yp0, xp1, yp1, zp, widths, dips,
+                         strike=[45.0, 45.0])
+    np.testing.assert_array_equal(f1.getQuadVertices(), f3.getQuadVertices())
+    np.testing.assert_array_equal(f2.getQuadVertices(), f3.getQuadVertices())
+    with pytest.raises(ShakeMapException):
+        Fault.fromTrace(xp0, yp0, xp1, yp1, zp, widths, dips,
+                        strike=[45.0, 45.0, 45.0])
+
+
+def test_simplify():
+    # Straight trace of 20 quads in two segments
+    n = 20
+    lon = np.linspace(-121.0, -120.6, n + 1)
+    lat = np.linspace(36.0, 36.3, n + 1)
+    zp = np.zeros(n)
+    widths = np.ones(n) * 10.0
+    dips = np.ones(n) * 60.0
+    strike = np.ones(n) * 45.0
+    fault = Fault.fromTrace(lon[0:-1], lat[0:-1], lon[1:], lat[1:], zp,
+                            widths, dips, strike=strike)
+    fault._segment_index = [0] * 10 + [1] * 10
+
+    # Quads are only merged within a segment
+    simple, error = fault.simplify(0.1)
+    assert simple.getNumQuads() == 2
+    assert simple._getSegmentIndex() == [0, 1]
+    assert error <= 0.1
+    np.testing.assert_allclose(simple.getFaultLength(),
+                               fault.getFaultLength(), rtol=1e-4)
+
+    # Reported error bounds the change of the distances
+    x, y, z = latlon2ecef(np.array([36.0, 36.5, 35.8]),
+                          np.array([-120.5, -121.2, -120.9]),
+                          np.zeros(3))
+    points = np.column_stack((x, y, z))
+    d0 = _calc_min_rupture_distance(fault.getQuadsECEF(), points)
+    d1 = _calc_min_rupture_distance(simple.getQuadsECEF(), points)
+    assert np.max(np.abs(d1 - d0)) <= error + 1e-6
+
+    # No merging with zero tolerance
+    simple, error = fault.simplify(0.0)
+    assert simple.getNumQuads() == n
+    assert error == 0.0
@@ -14,6 +14,7 @@ shakedir = os.path.abspath(os.path.join(homedir, '..'))
 sys.path.insert(0, shakedir)
 
 from shakemap.utils.ecef import latlon2ecef, ecef2latlon
+from shakemap.utils.ecef import latlon2ecef_grid, latlon2ecef_mesh
 
 
 def test_ecef():
@@ -37,3 +38,29 @@ def test_ecef():
     np.testing.assert_almost_equal(lon2, lon, decimal=2)
     np.testing.assert_almost_equal(dep2, dep, decimal=2)
     print('Passed tests of ECEF conversion code.')
+
+
+def test_ecef_grid():
+    lats = np.linspace(40.0, 30.0, 11)
+    lons = np.linspace(-125.0, -110.0, 16)
+    lon, lat = np.meshgrid(lons, lats)
+    dep = np.zeros_like(lat)
+    x, y, z = latlon2ecef(lat, lon, dep)
+
+    # Same as the conversion of every site
+    for a, b in zip((x, y, z), latlon2ecef_grid(lats, lons, 0.0)):
+        np.testing.assert_array_equal(a, b)
+    for a, b in zip((x, y, z), latlon2ecef_mesh(lat, lon, dep)):
+        np.testing.assert_array_equal(a, b)
+
+    # Output buffers and float32
+    out = tuple(np.zeros(lat.shape, dtype=np.float32) for i in range(3))
+    res = latlon2ecef_grid(lats, lons, 0.0, out=out)
+    for a, b in zip((x, y, z), res):
+        assert b.dtype == np.float32
+        np.testing.assert_allclose(a, b, atol=1.0)
+    assert res[0] is out[0]
+
+    # Sites that are not a grid
+    x1, y1, z1 = latlon2ecef_mesh(lat[0], lon[0], dep[0])
+    np.testing.assert_array_equal(x1, x[0])
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+# stdlib imports
+import os.path
+import sys
+
+# third party
+import numpy as np
+
+# hack the path so that I can debug these functions if I need to
+homedir = os.path.dirname(os.path.abspath(__file__))  # where is this script?
+shakedir = os.path.abspath(os.path.join(homedir, '..'))
+# put this at the front of the system path, ignoring any installed mapio stuff
+sys.path.insert(0, shakedir)
+
+import shakemap.utils.parallel as parallel
+from shakemap.utils.parallel import SharedArray, get_tiles, check_parallel
+from shakemap.utils.exception import ShakeMapException
+
+
+def test_check_parallel(monkeypatch):
+    assert hasattr(check_parallel(), 'SharedMemory')
+    # On older Pythons the parallel mode fails with a clear error
+    monkeypatch.setattr(parallel.sys, 'version_info', (3, 5, 0))
+    try:
+        check_parallel()
+        assert False
+    except ShakeMapException:
+        pass
+    try:
+        SharedArray((2, 2), np.float64)
+        assert False
+    except ShakeMapException:
+        pass
+
+
+def test_shared_array():
+    a = np.arange(12.0).reshape(3, 4)
+    shared = SharedArray.fromArray(a)
+    try:
+        other = SharedArray.fromSpec(shared.getSpec())
+        np.testing.assert_array_equal(other.array, a)
+        # Writes are seen by both
+        other.array[1, 2] = -1.0
+        assert shared.array[1, 2] == -1.0
+        other.close()
+    finally:
+        shared.close()
+
+
+def test_get_tiles():
+    assert get_tiles(10, 4) == [(0, 4), (4, 8), (8, 10)]
+    assert get_tiles(3, 10) == [(0, 3)]
+    assert get_tiles(0, 10) == []
+
+
+if __name__ == '__main__':
+    test_shared_array()
+    test_get_tiles()
@@ -13,7 +13,10 @@ shakedir = os.path.abspath(os.path.join(homedir, '..'))
 # put this at the front of the system path, ignoring any installed mapio stuff
 sys.path.insert(0, shakedir)
 
+from openquake.hazardlib.geo import point
+
 from shakemap.utils.vector import Vector
+from shakemap.utils.vector import VectorArray
 
 
 def test():
@@ -35,5 +38,38 @@ def test():
     aplusb = a + b
     print('Passed Vector class tests.')
 
+
+def test_vector_array():
+    a = VectorArray([[1, 0, 0], [1, 1, 1], [0, 3, 4]])
+    b = VectorArray([[0, 1, 0], [2, 2, 2], [0, 3, 4]])
+    assert len(a) == 3
+    assert a[1] == Vector(1, 1, 1)
+    np.testing.assert_array_equal((a + b).getArray()[1], [3, 3, 3])
+    np.testing.assert_array_equal((b - a).getArray()[0], [-1, 1, 0])
+    np.testing.assert_array_equal((2 * a).getArray()[2], [0, 6, 8])
+    np.testing.assert_array_equal(a.mag(), [1, np.sqrt(3), 5])
+    np.testing.assert_array_equal(a.dot(b), [0, 6, 25])
+    np.testing.assert_array_equal(a.cross(b).getArray()[0], [0, 0, 1])
+    np.testing.assert_allclose(a.norm().mag(), 1.0)
+    np.testing.assert_array_equal(a.dot(Vector(0, 0, 1)), [0, 1, 4])
+
+    # Same as Vector for each element
+    for i in range(len(a)):
+        assert a.cross(b)[i] == a[i].cross(b[i])
+        assert a.norm()[i] == a[i].norm()
+        assert a.distance(b)[i] == a[i].distance(b[i])
+
+    # Conversion to and from points
+    points = [point.Point(-120.0, 35.0, 10.0), point.Point(-119.5, 35.2, 0.0)]
+    va = VectorArray.fromPoints(points)
+    for i, p in enumerate(points):
+        assert va[i] == Vector.fromPoint(p)
+    for p1, p2 in zip(points, va.toPoints()):
+        np.testing.assert_allclose([p1.longitude, p1.latitude, p1.depth],
+                                   [p2.longitude, p2.latitude, p2.depth],
+                                   atol=1e-6)
+    assert VectorArray.fromVectors(va.toVectors()).getArray().tolist() == \
+        va.getArray().tolist()
+
 if __name__ == '__main__':
     test()